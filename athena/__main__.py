@@ -1,36 +1,25 @@
-import signal
-
+from __future__ import annotations
 from ._metadata import __version__
-import asyncio
 from io import IOBase
 import sys, os
 import click
-import threading
 import logging
-from typing import Callable
-from importlib.metadata import version
-
-
-from .defaults import DEFAULT_FIXTURE_FILE_CONTENTS, DEFAULT_MODULE_FILE_CONTENTS, DEFAULT_SECRET_FILE_CONTENTS, DEFAULT_VARIABLE_FILE_CONTENTS
-from .client import AthenaSession
-from .resource import DEFAULT_ENVIRONMENT_KEY, AggregatedResource, dump_resource_file
-from .run import ExecutionTrace
-
-from .watch import EVENT_TYPE_MODIFIED
+from typing import Callable, TYPE_CHECKING
 
+# subcommands import what they need when they are invoked, so that
+# simple commands don't pay for the whole dependency tree on startup
 from . import file
-from . import cache
-from . import history
 from . import state as athena_state
-from . import run as athena_run
-from . import status as athena_status
-from . import server as athena_server
-from .status import DryRunApplyResult
+from . import daemon as athena_daemon
+from . import humanize
 from .exceptions import AthenaException, QuietException
 from .format import colors, color
-from . import display
-from .athena_json import jsonify, dejsonify
-from .watch import watch_async as athena_watch_async
+
+if TYPE_CHECKING:
+    from .client import AthenaSession
+    from .resource import AggregatedResource
+    from .run import ExecutionTrace
+    from .status import DryRunApplyResult
 
 LOG_TEMPLATE = '[%(levelname)s] %(name)s: %(message)s'
 logging.basicConfig(format=LOG_TEMPLATE, level=100)
@@ -39,6 +28,22 @@ _logger = logging.getLogger(__name__)
 
 
 
+class DurationParamType(click.ParamType):
+    name = 'duration'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            seconds = humanize.parse_delta(value)
+        except ValueError:
+            self.fail(f"{value!r} is not a valid duration, expected a number with an optional unit (ms, s, m, h, d)", param, ctx)
+        if seconds < 0:
+            self.fail(f"{value!r} is negative", param, ctx)
+        return seconds
+
+DURATION = DurationParamType()
+
 @click.group()
 @click.version_option(version=__version__)
 def athena():
@@ -54,6 +59,9 @@ def serve(paths: list[str], verbose: bool):
     
     PATH - Path to server module(s) to execute. Invalid module paths will be ignored.
     """
+    import signal, threading
+    from . import server as athena_server
+
     if (verbose):
         logging.root.setLevel(logging.INFO)
 
@@ -82,6 +90,9 @@ def init(path: str | None, bare: bool):
     """
     Initializes an athena project at PATH/athena
     """
+    from .defaults import DEFAULT_FIXTURE_FILE_CONTENTS, DEFAULT_MODULE_FILE_CONTENTS, DEFAULT_SECRET_FILE_CONTENTS, DEFAULT_VARIABLE_FILE_CONTENTS
+    from .resource import dump_resource_file
+
     root = file.init(path or os.getcwd(), bare)
     state = athena_state.init()
     athena_state.save(root, state)
@@ -126,6 +137,7 @@ def get_history(path: str | None):
     """
     path = path or os.getcwd()
     root = file.find_root(path)
+    from . import history
     click.echo(history.get(root))
 
 @athena.group(name='set')
@@ -165,6 +177,7 @@ def clear_environment(path: str | None):
     path = path or os.getcwd()
     root = file.find_root(path)
     state = athena_state.load(root)
+    from .resource import DEFAULT_ENVIRONMENT_KEY
     state.environment = DEFAULT_ENVIRONMENT_KEY
     athena_state.save(root, state)
 
@@ -176,6 +189,7 @@ def clear_history(path: str | None):
     """
     path = path or os.getcwd()
     root = file.find_root(path)
+    from . import history
     history.clear(root)
 
 @clear.command(name='cache')
@@ -186,6 +200,7 @@ def clear_cache(path: str | None):
     """
     path = path or os.getcwd()
     root = file.find_root(path)
+    from . import cache
     cache.clear(root)
 
 def filter_paths_and_group_by_root(paths: list[str], path_filter: Callable[[str], bool] | None=None):
@@ -224,26 +239,80 @@ def run_modules_and(
         paths: list[str],
         force_environment: str | None=None,
         module_callback: Callable[[str, ExecutionTrace], None] | None=None,
-        final_callback: Callable[[dict[str, ExecutionTrace]], None] | None=None,
-        loop: asyncio.AbstractEventLoop | None = None,
+        jobs: int=1,
+        daemon_request: dict | None=None,
         ):
+    # when a daemon request is given, roots with a running daemon have their modules forwarded to it
     module_paths_by_root = filter_paths_and_group_by_root(paths, file.is_athena_module)
+    runs = []
     for root, modules in module_paths_by_root.items():
-        loop = loop or asyncio.get_event_loop()
-        try:
-            environment = force_environment or internal_get_environment(root)
-            results = loop.run_until_complete(athena_run.run_modules(root, modules, environment, module_callback))
-            if final_callback is not None:
-                final_callback(results)
-        finally:
-            loop.close()
+        environment = force_environment or internal_get_environment(root)
+        if daemon_request is not None:
+            request = daemon_request | { 'modules': list(modules), 'environment': environment, 'jobs': jobs }
+            if athena_daemon.try_forward(root, request, click.echo):
+                continue
+        runs.append((root, modules, environment))
+    if len(runs) == 0:
+        return
+
+    import asyncio
+    from .client import AthenaSession
+    from . import run as athena_run
+
+    # all the roots share one loop and one connection pool, each root keeps its own cache and history
+    async def run_roots():
+        async with AthenaSession() as session:
+            async def run_root(root: str, modules: list[str], environment: str):
+                await athena_run.run_modules(root, modules, environment, module_callback, session, jobs)
+
+            tasks = [asyncio.create_task(run_root(*i)) for i in runs]
+            try:
+                await asyncio.gather(*tasks)
+            except:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+    asyncio.run(run_roots())
+
+def echo_module_result(command: str, plain: bool=False, verbose: bool=False) -> Callable[[str, ExecutionTrace], None]:
+    def module_callback(module_name: str, result: ExecutionTrace):
+        from . import display
+        output = display.module_result(command, module_name, result, plain, verbose)
+        if output is not None:
+            click.echo(output)
+    return module_callback
+
+def run_command_and(command: str, paths: list[str], environment: str | None, jobs: int, plain: bool=False, verbose: bool=False):
+    run_modules_and(
+            paths,
+            force_environment=environment,
+            module_callback=echo_module_result(command, plain, verbose),
+            jobs=jobs,
+            daemon_request={ 'command': command, 'plain': plain, 'verbose': verbose })
+
+def run_modules_in_workers_and(
+        paths: list[str],
+        workers: int,
+        force_environment: str | None=None,
+        module_callback: Callable[[str, str], None] | None=None,
+        jobs: int=1,
+        ):
+    from . import run as athena_run
+    module_paths_by_root = filter_paths_and_group_by_root(paths, file.is_athena_module)
+    for root, modules in module_paths_by_root.items():
+        environment = force_environment or internal_get_environment(root)
+        athena_run.run_modules_in_workers(root, list(modules), environment, module_callback, workers, jobs)
 
 
 @athena.command()
 @click.argument('paths', type=str, nargs=-1)
 @click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
 @click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
-def run(paths: list[str], environment: str | None, verbose: bool):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help="number of modules to run concurrently", default=1)
+@click.option('-w', '--workers', type=click.IntRange(min=1), help="number of worker processes to split the modules across", default=1)
+def run(paths: list[str], environment: str | None, verbose: bool, jobs: int, workers: int):
     """
     Run one or more modules and indicated whether they pass or fail.
     
@@ -252,24 +321,28 @@ def run(paths: list[str], environment: str | None, verbose: bool):
     if (verbose):
         logging.root.setLevel(logging.INFO)
 
-    run_modules_and(
-            paths,
-            force_environment=environment,
-            module_callback=lambda module_name, result: click.echo(f"{module_name}: {result.format_long()}"))
+    if workers > 1:
+        run_modules_in_workers_and(
+                paths,
+                workers,
+                force_environment=environment,
+                module_callback=lambda module_name, result: click.echo(f"{module_name}: {result}"),
+                jobs=jobs)
+        return
+
+    run_command_and('run', paths, environment, jobs, verbose=verbose)
 
 @athena.command()
 @click.argument('paths', type=str, nargs=-1)
 @click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
-def exec(paths: list[str], environment: str | None):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help="number of modules to run concurrently", default=1)
+def exec(paths: list[str], environment: str | None, jobs: int):
     """
     Execute one or more modules without any additional processing of output.
     
     PATH - Path to module(s) to run.
     """
-    run_modules_and(
-            paths,
-            force_environment=environment,
-            module_callback=lambda _, __: None)
+    run_command_and('exec', paths, environment, jobs)
 
 
 @athena.command()
@@ -280,6 +353,7 @@ def status(path: str | None):
     
     PATH - Path to file or directory of modules to watch.
     """
+    from . import status as athena_status
 
     path = path or os.getcwd()
     root = file.find_root(path)
@@ -317,6 +391,8 @@ def export_secrets(path: str | None):
     """
     path = path or os.getcwd()
     root = file.find_root(path)
+    from . import status as athena_status
+    from .athena_json import jsonify
     secrets = athena_status.collect_secrets(root)
     click.echo(jsonify(secrets, reversible=True))
 
@@ -330,6 +406,8 @@ def export_variables(path: str | None):
     """
     path = path or os.getcwd()
     root = file.find_root(path)
+    from . import status as athena_status
+    from .athena_json import jsonify
     variables = athena_status.collect_variables(root)
     click.echo(jsonify(variables, reversible=True))
 
@@ -344,6 +422,9 @@ def _import_resource(skip_confirmation: bool, path: str | None, data: str, dry_r
     if data is None or len(data) == 0:
         raise AthenaException("no data provided")
 
+    from . import status as athena_status
+    from .athena_json import dejsonify
+
     aggregated_resource = dejsonify(data, expected_type=athena_status.AggregatedResource)
     path = path or os.getcwd()
     root = file.find_root(path)
@@ -389,6 +470,7 @@ def athena_import_secrets(path: str | None, secret_data: IOBase, yes: bool):
     PATH - Path to athena project
     """
 
+    from . import status as athena_status
     _import_resource(yes, path, secret_data.read(), athena_status.dry_run_apply_secrets)
 
 @athena_import.command(name='variables')
@@ -404,6 +486,7 @@ def athena_import_variables(path: str | None, variable_data: IOBase, yes: bool):
 
     PATH - Path to athena project
     """
+    from . import status as athena_status
     _import_resource(yes, path, variable_data.read(), athena_status.dry_run_apply_variables)
 
 @athena.command()
@@ -420,6 +503,11 @@ def watch(path: str | None, environment: str | None, command: str, verbose: bool
     PATH - Path to file or directory of modules to watch.
     """
     
+    import asyncio
+    from .client import AthenaSession
+    from .watch import EVENT_TYPE_MODIFIED, watch_async as athena_watch_async
+    from . import run as athena_run
+
     if plain and command not in ['responses', 'requests', 'traces']:
         click.echo('to use --plain, command must be one of (requests, responses, traces)', err=True)
         raise QuietException()
@@ -430,27 +518,7 @@ def watch(path: str | None, environment: str | None, command: str, verbose: bool
     path = path or os.getcwd()
     root = file.find_root(path)
 
-    def module_callback(module_name: str, result: ExecutionTrace):
-        match command:
-            case 'responses':
-                if plain:
-                    click.echo(f"{display.trace_plain(result, include_requests=False, include_responses=True)}")
-                else:
-                    click.echo(f"{display.trace(result, include_requests=False, include_responses=True, verbose=verbose)}")
-            case 'requests':
-                if plain:
-                    click.echo(f"{display.trace_plain(result, include_requests=True, include_responses=False)}")
-                else:
-                    click.echo(f"{display.trace(result, include_requests=True, include_responses=False, verbose=verbose)}")
-            case 'traces':
-                if plain:
-                    click.echo(f"{display.trace_plain(result, include_requests=True, include_responses=True)}")
-                else:
-                    click.echo(f"{display.trace(result, include_requests=True, include_responses=True, verbose=verbose)}")
-            case 'run':
-                click.echo(f"{module_name}: {result.format_long()}")
-            case 'exec':
-                pass
+    module_callback = echo_module_result(command, plain, verbose)
 
     async def on_change_async(changed_path: str, session: AthenaSession):
         env = environment or internal_get_environment(root)
@@ -476,12 +544,32 @@ def watch(path: str | None, environment: str | None, command: str, verbose: bool
 
     asyncio.run(inner())
 
+@athena.command()
+@click.argument('path', type=str, required=False)
+@click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
+def daemon(path: str | None, verbose: bool):
+    """
+    Start a long-lived process that keeps a warm session for the athena project.
+    While it is running, the run, exec, responses, requests and traces commands will forward their modules to it.
+
+    PATH - Path to athena project
+    """
+    if (verbose):
+        logging.root.setLevel(logging.INFO)
+
+    import asyncio
+
+    path = path or os.getcwd()
+    root = file.find_root(path)
+    asyncio.run(athena_daemon.serve_async(root, lambda _: click.echo(f'Athena daemon started for `{root}`. Press ^C to stop.')))
+
 @athena.command()
 @click.argument('paths', type=str, nargs=-1)
 @click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
 @click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
 @click.option('-p', '--plain', is_flag=True, help="format output as plain json")
-def responses(paths: list[str], environment: str | None, verbose: bool, plain: bool):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help="number of modules to run concurrently", default=1)
+def responses(paths: list[str], environment: str | None, verbose: bool, plain: bool, jobs: int):
     """
     Run one or more modules and print the response traces.
     
@@ -490,19 +578,15 @@ def responses(paths: list[str], environment: str | None, verbose: bool, plain: b
     if (verbose):
         logging.root.setLevel(logging.INFO)
 
-    if plain:
-        module_callback = lambda _, result: click.echo(f"{display.trace_plain(result, include_requests=False, include_responses=True)}")
-    else:
-        module_callback = lambda _, result: click.echo(f"{display.trace(result, include_requests=False, include_responses=True, verbose=verbose)}")
-
-    run_modules_and(paths, force_environment=environment, module_callback=module_callback)
+    run_command_and('responses', paths, environment, jobs, plain=plain, verbose=verbose)
 
 @athena.command()
 @click.argument('paths', type=str, nargs=-1)
 @click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
 @click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
 @click.option('-p', '--plain', is_flag=True, help="format output as plain json")
-def requests(paths: list[str], environment: str | None, verbose: bool, plain: bool):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help="number of modules to run concurrently", default=1)
+def requests(paths: list[str], environment: str | None, verbose: bool, plain: bool, jobs: int):
     """
     Run one or more modules and print the request traces.
     
@@ -511,19 +595,15 @@ def requests(paths: list[str], environment: str | None, verbose: bool, plain: bo
     if (verbose):
         logging.root.setLevel(logging.INFO)
 
-    if plain:
-        module_callback = lambda _, result: click.echo(f"{display.trace_plain(result, include_requests=True, include_responses=False)}")
-    else:
-        module_callback = lambda _, result: click.echo(f"{display.trace(result, include_requests=True, include_responses=False, verbose=verbose)}")
-
-    run_modules_and(paths, force_environment=environment, module_callback=module_callback)
+    run_command_and('requests', paths, environment, jobs, plain=plain, verbose=verbose)
 
 @athena.command()
 @click.argument('paths', type=str, nargs=-1)
 @click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
 @click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
 @click.option('-p', '--plain', is_flag=True, help="format output as plain json")
-def traces(paths: list[str], environment: str | None, verbose: bool, plain: bool):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help="number of modules to run concurrently", default=1)
+def traces(paths: list[str], environment: str | None, verbose: bool, plain: bool, jobs: int):
     """
     Run one or more modules and print the full traces.
     
@@ -532,12 +612,73 @@ def traces(paths: list[str], environment: str | None, verbose: bool, plain: bool
     if (verbose):
         logging.root.setLevel(logging.INFO)
 
+    run_command_and('traces', paths, environment, jobs, plain=plain, verbose=verbose)
+
+@athena.command()
+@click.argument('path', type=str)
+@click.option('-v', '--verbose', is_flag=True, help='increase verbosity of output')
+@click.option('-e', '--environment', type=str, help="environment to run tests against", default=None)
+@click.option('-c', '--concurrency', type=click.IntRange(min=1), help="number of iterations to run at the same time. with open loop arrivals, this only limits synchronous modules", default=1)
+@click.option('-d', '--duration', type=DURATION, help="how long to measure for, e.g. 500ms, 30s or 2m", default='10s')
+@click.option('-w', '--warmup', type=DURATION, help="how long to run before measuring, results from this phase are discarded", default='0s')
+@click.option('-r', '--rate', type=click.FloatRange(min=0, min_open=True), help="number of iterations to start per second", default=None)
+@click.option('-a', '--arrivals', type=click.Choice(['closed', 'fixed', 'poisson']), help="closed waits for a free worker before starting an iteration, fixed and poisson start them on schedule regardless of how many are outstanding", default='closed')
+@click.option('--find-capacity', is_flag=True, help="ramp up the rate (or concurrency, if no rate is given) in steps until the slo is breached")
+@click.option('--slo', type=str, help="objectives for --find-capacity, e.g. p99<250ms,errors<1%", default='p99<1s,errors<1%')
+@click.option('--step', type=click.FloatRange(min=0, min_open=True), help="amount to increase by at each step of --find-capacity. defaults to the starting value", default=None)
+@click.option('--max-steps', type=click.IntRange(min=1), help="maximum number of steps for --find-capacity", default=10)
+@click.option('-p', '--plain', is_flag=True, help="format output as plain json")
+def load(path: str, environment: str | None, verbose: bool, concurrency: int, duration: float, warmup: float, rate: float | None, arrivals: str,
+         find_capacity: bool, slo: str, step: float | None, max_steps: int, plain: bool):
+    """
+    Repeatedly run a module and report the throughput, error rate and latency of its requests.
+    If the module has a `load` function, it will be run instead of `run`.
+
+    PATH - Path to module to run.
+    """
+    import asyncio
+    from .client import AthenaSession
+    from . import load as athena_load, display
+    from .athena_json import jsonify
+
+    if (verbose):
+        logging.root.setLevel(logging.INFO)
+
+    path = os.path.abspath(path)
+    if not file.is_athena_module(path):
+        raise AthenaException(f"not an athena module: {path}")
+    root = file.find_root(path)
+    environment = environment or internal_get_environment(root)
+
+    if find_capacity:
+        try:
+            slo_conditions = athena_load.parse_slo(slo)
+        except AthenaException as e:
+            raise click.BadParameter(str(e), param_hint="'--slo'")
+        parameter = 'rate' if rate is not None else 'concurrency'
+        on_step = lambda capacity_step: click.echo(display.capacity_step(parameter, capacity_step), err=True)
+
+        async def search():
+            async with AthenaSession() as session:
+                return await athena_load.find_capacity(root, path, environment, session, slo_conditions,
+                    concurrency, duration, warmup, rate, arrivals, step, max_steps, on_step)
+
+        capacity_report = asyncio.run(search())
+        if plain:
+            click.echo(jsonify(capacity_report))
+        else:
+            click.echo(display.capacity_report(capacity_report))
+        return
+
+    async def inner():
+        async with AthenaSession() as session:
+            return await athena_load.run_load(root, path, environment, session, concurrency, duration, warmup, rate, arrivals)
+
+    report = asyncio.run(inner())
     if plain:
-        module_callback = lambda _, result: click.echo(f"{display.trace_plain(result, include_requests=True, include_responses=True)}")
+        click.echo(jsonify(report))
     else:
-        module_callback = lambda _, result: click.echo(f"{display.trace(result, include_requests=True, include_responses=True, verbose=verbose)}")
-
-    run_modules_and(paths, force_environment=environment, module_callback=module_callback)
+        click.echo(display.load_report(report))
 
 def main():
     try:
@@ -23,6 +23,23 @@ def deserializeable_default(*default_args):
         return cls
     return inner
 
+def _serialize(o) -> dict:
+    # classes can provide their own fields, for example to include ones that are computed lazily
+    serialize = getattr(o, "_serialize", None)
+    if serialize is not None:
+        return serialize()
+    out = {}
+    for k, v in _fields(o):
+        if not k.startswith("_"):
+            out[k] = v
+    return out
+
+def _fields(o) -> list[tuple[str, Any]]:
+    if hasattr(o, "__dict__"):
+        return list(o.__dict__.items())
+    # slotted classes keep their fields in the slots of each class they inherit from
+    return [(k, getattr(o, k)) for cls in reversed(type(o).__mro__) for k in cls.__dict__.get("__slots__", ()) if hasattr(o, k)]
+
 class AthenaJSONEncoder(JSONEncoder):
     def default(self, o):
         if not o.__class__ in _serializeable_classes:
@@ -30,11 +47,7 @@ class AthenaJSONEncoder(JSONEncoder):
             if result:
                 return encoded
             return JSONEncoder.default(self, o)
-        out = {}
-        for k, v in o.__dict__.items():
-            if not k.startswith("_"):
-                out[k] = v
-        return out
+        return _serialize(o)
     def try_encode_obj(self, obj):
         if isinstance(obj, MultiDictProxy):
             return True, list(obj.items())
@@ -44,10 +57,7 @@ class AthenaReversibleJSONEncoder(JSONEncoder):
     def default(self, o):
         if not o.__class__ in _serializeable_classes:
             return JSONEncoder.default(self, o)
-        out = {}
-        for k, v in o.__dict__.items():
-            if not k.startswith("_"):
-                out[k] = v
+        out = _serialize(o)
         out["__class__"] = o.__class__.__name__
         return out
 
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import codecs, hashlib, mmap, re, tempfile
+from typing import IO, Iterator
+
+from .athena_json import serializeable
+from .exceptions import AthenaException
+
+DEFAULT_SPILL_THRESHOLD = 8 * 1024 * 1024
+PREVIEW_SIZE = 1024
+CHUNK_SIZE = 64 * 1024
+
+_text_content_type_re = re.compile(r"^(?:text/.*|application/(?:[\w.+-]+\+)?(?:json|xml)|application/(?:javascript|ecmascript|x-www-form-urlencoded|x-ndjson|graphql|yaml|x-yaml|sql))$")
+_binary_content_type_re = re.compile(r"^(?:image|audio|video|font)/.*|application/octet-stream$")
+
+def is_binary(content_type: str | None, prefix: bytes | memoryview) -> bool:
+    # the content type decides where it can, anything else is sniffed from the start of the body
+    if content_type is not None:
+        content_type = content_type.split(';')[0].strip().lower()
+        if _text_content_type_re.match(content_type):
+            return False
+        if _binary_content_type_re.match(content_type):
+            return True
+    prefix = bytes(prefix[:PREVIEW_SIZE])
+    if b'\x00' in prefix:
+        return True
+    try:
+        # not final, the prefix may end part way through a character
+        codecs.getincrementaldecoder('utf-8')().decode(prefix)
+        return False
+    except UnicodeDecodeError:
+        return True
+
+@serializeable
+class Body:
+    """Body of a streamed or binary request or response. The body is kept in memory until it grows past
+    the spill threshold, after which it is written to a temporary file that is memory-mapped for reading.
+    Uploads that were streamed from a file or an iterable are not kept, only their size, hash and preview.
+
+    Attributes:
+        size (int): The size of the body in bytes.
+        sha256 (str): The hex encoded SHA-256 hash of the body.
+        preview (str): The start of the body, decoded as text. Empty for binary bodies.
+        spilled (bool): Whether the body was written to disk.
+        binary (bool): Whether the body is binary, rather than text.
+    """
+    def __init__(self, spill_threshold: int=DEFAULT_SPILL_THRESHOLD, encoding: str | None=None, content_type: str | None=None, retain: bool=True):
+        self.size = 0
+        self.sha256 = ""
+        self.preview = ""
+        self.spilled = False
+        self.binary = False
+        self._spill_threshold = spill_threshold
+        self._encoding = encoding or 'utf-8'
+        self._content_type = content_type
+        self._retain = retain
+        self._hash = hashlib.sha256()
+        self._buffer: bytes | bytearray = bytearray()
+        self._file: IO[bytes] | None = None
+        self._mmap: mmap.mmap | None = None
+        self._closed = False
+
+    @staticmethod
+    def _wrap(content: bytes, encoding: str | None=None, content_type: str | None=None) -> Body:
+        # a body that was read in one go is kept as is, rather than copied into the buffer
+        body = Body(encoding=encoding, content_type=content_type)
+        body._hash.update(content)
+        body.size = len(content)
+        body._buffer = content
+        body._finish()
+        return body
+
+    def _write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        # a body that isn't retained only keeps enough for the preview
+        if not self._retain:
+            if len(self._buffer) < PREVIEW_SIZE:
+                self._buffer += chunk[:PREVIEW_SIZE - len(self._buffer)]
+            return
+        if self._file is None and len(self._buffer) + len(chunk) > self._spill_threshold:
+            self._file = tempfile.TemporaryFile(prefix='athena-')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+            self.spilled = True
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer += chunk
+
+    def _finish(self):
+        self.sha256 = self._hash.hexdigest()
+        if self._file is not None:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        prefix = memoryview(self._mmap if self._mmap is not None else self._buffer)[:PREVIEW_SIZE]
+        self.binary = is_binary(self._content_type, prefix)
+        if not self.binary:
+            self.preview = bytes(prefix).decode(self._encoding, errors='replace')
+
+    def view(self) -> memoryview:
+        """Get a read-only view over the body, without copying it into memory.
+
+        Returns:
+            memoryview: The body.
+        """
+        if not self._retain:
+            raise AthenaException("the body was streamed without being kept, only its size, hash and preview are available")
+        if self._closed:
+            raise AthenaException("the body was closed, only its size, hash and preview are available")
+        if self._mmap is not None:
+            return memoryview(self._mmap)
+        return memoryview(self._buffer).toreadonly()
+
+    def read(self) -> bytes:
+        """Read the whole body into memory.
+
+        Returns:
+            bytes: The body.
+        """
+        return bytes(self.view())
+
+    def iter_bytes(self, chunk_size: int=CHUNK_SIZE) -> Iterator[memoryview]:
+        """Iterate over the body in chunks.
+
+        Args:
+            chunk_size (int, optional): The maximum size of each chunk in bytes.
+
+        Returns:
+            Iterator[memoryview]: The chunks of the body.
+        """
+        view = self.view()
+        for i in range(0, len(view), chunk_size):
+            yield view[i:i+chunk_size]
+
+    def iter_text(self, chunk_size: int=CHUNK_SIZE) -> Iterator[str]:
+        """Iterate over the body in chunks, decoded as text.
+
+        Args:
+            chunk_size (int, optional): The maximum size of each chunk in bytes, before decoding.
+
+        Returns:
+            Iterator[str]: The decoded chunks of the body.
+        """
+        decoder = codecs.getincrementaldecoder(self._encoding)(errors='replace')
+        for chunk in self.iter_bytes(chunk_size):
+            yield decoder.decode(bytes(chunk))
+        yield decoder.decode(b'', final=True)
+
+    def text(self) -> str:
+        """Decode the whole body as text.
+
+        Returns:
+            str: The decoded body.
+        """
+        return str(self.view(), self._encoding, errors='replace')
+
+    @staticmethod
+    def _summarize(content: bytes, encoding: str | None=None, content_type: str | None=None) -> Body:
+        body = Body(encoding=encoding, content_type=content_type, retain=False)
+        body._write(content)
+        body._finish()
+        return body
+
+    def _summary(self) -> Body:
+        # a copy of the size, hash and preview, without the body itself
+        body = Body(encoding=self._encoding, content_type=self._content_type, retain=False)
+        body.size = self.size
+        body.sha256 = self.sha256
+        body.preview = self.preview
+        body.spilled = self.spilled
+        body.binary = self.binary
+        return body
+
+    def close(self):
+        """Release the memory or temporary file holding the body. Views that were already taken over a
+        spilled body stay readable, and the mapping is released along with the last of them."""
+        self._closed = True
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
@@ -24,6 +24,14 @@ def save(root: str, state: Cache):
     with open(cache_file_path, "w") as f:
         f.write(jsonify(state, reversible=True))
 
+def merge(state: Cache, before: dict, after: dict):
+    for key in before:
+        if key not in after:
+            state.data.pop(key, None)
+    for key, value in after.items():
+        if key not in before or before[key] != value:
+            state.data[key] = value
+
 def clear(root: str):
     save(root, Cache())
 
@@ -3,14 +3,20 @@ import requests
 
 from .resource import ResourceLoader, try_extract_value_from_resource, _resource_type, _resource_value_type
 from .exceptions import AthenaException
-from typing import Any, Callable, Protocol, TypeVar, Generic
+from typing import Any, Callable, Iterable, Protocol, TypeVar, Generic
 from .trace import AthenaTrace, ResponseTrace, RequestTrace, LinkedRequest, LinkedResponse
 from .request import RequestBuilder, Client
+from .body import Body
 from .athena_json import AthenaJSONEncoder, serializeable
 from .fake import Fake
+from .pool import ConnectionPool, PoolOptions, load_pool_options
+from .telemetry import PoolStats, PoolSummary
+from .retention import RetentionPolicy, TraceCounts, TraceRetention, load_retention_policy
+from . import state as athena_state
 from json import dumps as json_dumps
-from contextlib import AsyncExitStack
-import inspect
+from collections import deque
+import contextvars, copy, inspect, threading, weakref
+from concurrent.futures import ThreadPoolExecutor
 
 class ResourceFacade:
     """Facade to interact with resource files.
@@ -68,6 +74,7 @@ class ResourceFacade:
         return default
 
 T = TypeVar('T')
+R = TypeVar('R')
 class TypedResourceFacade(Generic[T]):
     """Typed facade to interact with resource files.
     """
@@ -204,10 +211,14 @@ class Context:
         self.root_path = root_path
 
 class AthenaSession:
-    def __init__(self):
-        self.async_session = aiohttp.ClientSession(request_class=LinkedRequest, response_class=LinkedResponse)
-        self.session = requests.Session()
+    def __init__(self, pool_options: PoolOptions | None=None):
         self.resource_loader = ResourceLoader()
+        self.pool_options = pool_options or PoolOptions()
+        self.pool_stats = PoolStats()
+        self._pools: dict[PoolOptions, ConnectionPool] = {}
+        self._environment_pool_options: dict[tuple[str, str | None], PoolOptions] = {}
+        self._environment_retention_policies: dict[tuple[str, str | None], RetentionPolicy] = {}
+        self._lock = threading.Lock()
 
     def __enter__(self):
         raise TypeError("Use async with instead")
@@ -217,14 +228,51 @@ class AthenaSession:
         pass
 
     async def __aenter__(self):
-        async with AsyncExitStack() as stack:
-            await stack.enter_async_context(self.async_session)
-            stack.enter_context(self.session)
-            self._stack = stack.pop_all()
         return self
 
     async def __aexit__(self, *args):
-        await self._stack.__aexit__(*args)
+        for pool in list(self._pools.values()):
+            await pool.close()
+
+    @property
+    def session(self) -> requests.Session:
+        return self.get_pool().session
+
+    @property
+    def async_session(self) -> aiohttp.ClientSession:
+        return self.get_pool().async_session
+
+    def get_pool(self, options: PoolOptions | None=None) -> ConnectionPool:
+        # clients with the same settings share a pool
+        options = self.pool_options.merge(options)
+        with self._lock:
+            if options not in self._pools:
+                self._pools[options] = ConnectionPool(options, self.pool_stats)
+            return self._pools[options]
+
+    def pool_summary(self) -> PoolSummary:
+        with self._lock:
+            pools = list(self._pools.values())
+        return self.pool_stats.summarize(sum([pool.idle() for pool in pools]))
+
+    def get_environment_pool_options(self, root: str, environment: str | None) -> PoolOptions:
+        key = (root, environment)
+        with self._lock:
+            if key not in self._environment_pool_options:
+                self._environment_pool_options[key] = load_pool_options(athena_state.load(root).pool, environment)
+            return self._environment_pool_options[key]
+
+    def get_environment_retention_policy(self, root: str, environment: str | None) -> RetentionPolicy:
+        key = (root, environment)
+        with self._lock:
+            if key not in self._environment_retention_policies:
+                self._environment_retention_policies[key] = load_retention_policy(athena_state.load(root).retention, environment)
+            return self._environment_retention_policies[key]
+
+    def clear_environment_cache(self):
+        with self._lock:
+            self._environment_pool_options.clear()
+            self._environment_retention_policies.clear()
 
 
 class Athena:
@@ -242,11 +290,27 @@ class Athena:
     def __init__(self,
         context: Context,
         session: AthenaSession,
-        cache_values: dict
+        cache_values: dict,
+        retention: RetentionPolicy | None=None
     ):
-        self.__history: list[AthenaTrace | str] = []
-        self.__pending_requests = {}
-        self.__history_lookup_cache = {}
+        # traces are kept in the order their requests were sent. a request that is still in flight holds its place with `None`
+        self.__history: dict[str, AthenaTrace | None] = {}
+        # the retained traces, and their requests and responses, mapped to the id of the trace
+        self.__index: dict[AthenaTrace | RequestTrace | ResponseTrace, str] = {}
+        # the retained traces in history order, extended as requests complete and rebuilt only when they complete out of order
+        self.__traces: list[AthenaTrace] | None = []
+        # clients may send from several threads at once, see `Client.send_many` and `parallel_map`
+        self.__history_lock = threading.Lock()
+        # collects the ids of the traces sent while running each item of `parallel_map`
+        self.__trace_group: contextvars.ContextVar[list[str] | None] = contextvars.ContextVar('trace_group', default=None)
+        self.__environment_retention = retention if retention is not None else session.get_environment_retention_policy(context.root_path, context._environment)
+        self.__retention = TraceRetention(self.__environment_retention)
+        # ids of the retained traces in the order they completed, for `keep_last`
+        self.__completed: deque[str] = deque()
+        # with `metadata_only`, the history holds a copy of each trace. the module can still look them up by the original
+        self.__originals: weakref.WeakKeyDictionary[AthenaTrace | RequestTrace | ResponseTrace, str] = weakref.WeakKeyDictionary()
+        # bodies that were spilled to a temporary file, closed when they are evicted or the module completes
+        self.__spilled_bodies: weakref.WeakSet[Body] = weakref.WeakSet()
         self.__session = session
         self.fixture: Fixture = _Fixture()
         self.infix: Fixture = _InjectFixture(self.fixture, self)
@@ -261,36 +325,170 @@ class Athena:
             'secret', self.context.environment)
 
     def __client_pre_hook(self, trace_id: str) -> None:
-        self.__history.append(trace_id)
-        self.__pending_requests[trace_id] = len(self.__history) - 1
+        group = self.__trace_group.get()
+        if group is not None:
+            group.append(trace_id)
+        with self.__history_lock:
+            self.__history[trace_id] = None
 
     def __client_post_hook(self, trace: AthenaTrace) -> None:
-        if trace.id in self.__pending_requests:
-            index = self.__pending_requests.pop(trace.id)
-            if index < len(self.__history):
-                self.__history[index] = trace
+        with self.__history_lock:
+            for body in [trace.request.body, trace.response.body]:
+                if body is not None and body.spilled:
+                    self.__spilled_bodies.add(body)
+            retained = self.__retention.retain(trace)
+            if retained is None:
+                self.__history.pop(trace.id, None)
                 return
-        self.__history.append(trace)
+            self.__history[trace.id] = retained
+            for subject in [retained, retained.request, retained.response]:
+                self.__index[subject] = trace.id
+            if retained is not trace:
+                for subject in [trace, trace.request, trace.response]:
+                    self.__originals[subject] = trace.id
+            if self.__traces is not None:
+                if next(reversed(self.__history)) == trace.id:
+                    self.__traces.append(retained)
+                else:
+                    self.__traces = None
+            keep_last = self.__retention.policy.keep_last
+            if keep_last is not None:
+                self.__completed.append(trace.id)
+                while len(self.__completed) > keep_last:
+                    self.__evict(self.__completed.popleft())
+
+    def __evict(self, trace_id: str) -> None:
+        trace = self.__history.pop(trace_id, None)
+        if trace is not None:
+            for subject in [trace, trace.request, trace.response]:
+                self.__index.pop(subject, None)
+            for body in [trace.request.body, trace.response.body]:
+                if body is not None:
+                    body.close()
+            if self.__traces is not None:
+                if len(self.__traces) > 0 and self.__traces[0] is trace:
+                    del self.__traces[0]
+                else:
+                    self.__traces = None
+            self.__retention.evicted()
+
+    def retain(self, policy: RetentionPolicy) -> None:
+        """Set the retention policy for the traces of this instance, applied on top of the settings for the
+        environment. The policy applies to requests that complete after it is set.
+
+        Args:
+            policy (RetentionPolicy): The retention policy.
+
+        Example:
+
+            from athena.retention import RetentionPolicy
 
-    def client(self, base_build_request: Callable[[RequestBuilder], RequestBuilder] | None=None, name: str | None=None) -> Client:
+            def run(athena: Athena):
+                athena.retain(RetentionPolicy(keep_last=100, failures=True))
+                client = athena.client()
+                for _ in range(50_000):
+                    client.get('https://example.com/status')
+        """
+        with self.__history_lock:
+            self.__retention.policy = self.__environment_retention.merge(policy)
+
+    def trace_counts(self) -> TraceCounts:
+        """Get the totals over every request sent by this instance, including the requests whose traces
+        were dropped by the retention policy.
+
+        Returns:
+            TraceCounts: The totals.
+        """
+        with self.__history_lock:
+            return copy.copy(self.__retention.counts)
+
+    def client(self, base_build_request: Callable[[RequestBuilder], RequestBuilder] | None=None, name: str | None=None, pool: PoolOptions | None=None) -> Client:
         """Create a new client.
 
         Args:
             base_build_request (Callable[[RequestBuilder], [RequestBuilder]] | None): Function to configure all requests sent by the client.
             name (str | None): Optional name for client.
+            pool (PoolOptions | None): Optional connection pool settings, applied on top of the settings for the environment.
 
         Returns:
             Client: The configured client.
         """
-        return Client(self.__session.session, self.__session.async_session, base_build_request, name, self.__client_pre_hook, self.__client_post_hook)
+        options = self.__session.get_environment_pool_options(self.context.root_path, self.context._environment).merge(pool)
+        return Client(self.__session.get_pool(options), base_build_request, name, self.__client_pre_hook, self.__client_post_hook)
+
+    def _bind_client(self, client: Client) -> Client:
+        return client._bind(self.__client_pre_hook, self.__client_post_hook)
+
+    def _close(self) -> None:
+        # called once the module has completed. the traces only need the size, hash and preview from here on
+        with self.__history_lock:
+            bodies = list(self.__spilled_bodies)
+            self.__spilled_bodies.clear()
+        for body in bodies:
+            body.close()
+
+    def parallel_map(self, fn: Callable[[T], R], items: Iterable[T], workers: int=10) -> list[R]:
+        """Call `fn` with each item on a pool of threads, for running synchronous request code in parallel.
+        The traces of the requests sent by each call are kept together, in the same order as the items,
+        after any traces from before the call.
+
+        Clients, and the trace history, are safe to use from several threads at once. Synchronous requests
+        wait for a connection once the pool limit for the host is reached.
+
+        Args:
+            fn (Callable[[T], R]): The function to call with each item.
+            items (Iterable[T]): The items.
+            workers (int): The maximum number of threads to run at once. Defaults to 10.
+
+        Returns:
+            list[R]: The result of each call, in the same order as the items.
+
+        Example:
+
+            def run(athena: Athena):
+                client = athena.client(lambda r: r.base_url('https://example.com'))
+                def fetch(user_id: int):
+                    return client.get(f'/users/{user_id}').json()['name']
+                names = athena.parallel_map(fetch, range(100), workers=20)
+        """
+        if workers < 1:
+            raise AthenaException(f"expected workers to be a positive integer, but found `{workers}`")
+        items = list(items)
+        groups: list[list[str]] = [[] for _ in items]
+
+        def call(index: int, item: T) -> R:
+            token = self.__trace_group.set(groups[index])
+            try:
+                return fn(item)
+            finally:
+                self.__trace_group.reset(token)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='athena-parallel') as executor:
+                contexts = [contextvars.copy_context() for _ in items]
+                return list(executor.map(lambda index, item: contexts[index].run(call, index, item), range(len(items)), items))
+        finally:
+            # move the traces of each item to the end of the history, in the order of the items
+            with self.__history_lock:
+                for group in groups:
+                    for trace_id in group:
+                        if trace_id in self.__history:
+                            self.__history[trace_id] = self.__history.pop(trace_id)
+                self.__traces = None
 
     def traces(self) -> list[AthenaTrace]:
-        """Get all `AthenaTrace`s from the lifetime of this instance. 
+        """Get all `AthenaTrace`s from the lifetime of this instance, that were kept by the retention policy.
 
         Returns:
             list[AthenaTrace]: List of traces.
         """
-        return [i for i in self.__history if isinstance(i, AthenaTrace)]
+        with self.__history_lock:
+            return list(self.__get_traces())
+
+    def __get_traces(self) -> list[AthenaTrace]:
+        if self.__traces is None:
+            self.__traces = [i for i in self.__history.values() if i is not None]
+        return self.__traces
 
     def trace(self, subject: AthenaTrace | RequestTrace | ResponseTrace | None=None) -> AthenaTrace:
         """Get the full `AthenaTrace` for a given request or response trace.
@@ -308,31 +506,23 @@ class Athena:
                 trace = athena.trace(response)
                 print(f'request completed in {trace.elapsed} seconds')
         """
-        traces = self.traces()
-        if subject is None:
-            if len(traces) == 0:
-                raise AthenaException(f"no completed traces in history")
-            subject = traces[-1]
-
-        is_trace = isinstance(subject, AthenaTrace)
-        is_request_trace = isinstance(subject, RequestTrace)
-        is_response_trace = isinstance(subject, ResponseTrace)
-        if not (is_trace or is_request_trace or is_response_trace):
-            raise AthenaException(f"unable to resolve parent for trace of type {type(subject).__name__}")
-
-        if subject in self.__history_lookup_cache:
-            return self.__history_lookup_cache[subject]
-        trace = None
-        for historic_trace in traces:
-            if ((is_trace and historic_trace == subject)
-                or (is_request_trace and historic_trace.request == subject)
-                or (is_response_trace and historic_trace.response == subject)):
-                trace = historic_trace
-        if trace is None:
-            raise AthenaException(f"unable to resolve parent for trace {subject}")
-
-        self.__history_lookup_cache[subject] = trace
-        return trace
+        with self.__history_lock:
+            if subject is None:
+                traces = self.__get_traces()
+                if len(traces) == 0:
+                    raise AthenaException(f"no completed traces in history")
+                return traces[-1]
+
+            if not isinstance(subject, (AthenaTrace, RequestTrace, ResponseTrace)):
+                raise AthenaException(f"unable to resolve parent for trace of type {type(subject).__name__}")
+
+            trace_id = self.__index.get(subject)
+            if trace_id is None:
+                trace_id = self.__originals.get(subject)
+            trace = self.__history.get(trace_id) if trace_id is not None else None
+            if trace is None:
+                raise AthenaException(f"unable to resolve parent for trace {subject}")
+            return trace
 
 def jsonify(item: Any, *args, **kwargs):
     """Runs objects through json.dumps, with an encoder for athena objects.
@@ -0,0 +1,183 @@
+from __future__ import annotations
+import contextvars, hashlib, json, logging, os, signal, socket, sys, tempfile, threading
+from typing import Any, Callable, TYPE_CHECKING
+
+from .exceptions import AthenaException
+
+if TYPE_CHECKING:
+    import asyncio
+
+_logger = logging.getLogger(__name__)
+
+# how long a client waits for the daemon to pick up its request, before running the modules itself
+FORWARD_TIMEOUT = 5.0
+
+def is_supported() -> bool:
+    return hasattr(socket, 'AF_UNIX')
+
+def get_socket_path(root: str) -> str:
+    # unix socket paths are limited to ~100 characters, so they are kept out of the project directory
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f'athena-{os.getuid()}-{digest}.sock')
+
+# the daemon serves several clients at once, so output written by a module is sent to whichever
+# request the module is running for. output from outside of a request goes to the daemon's own streams.
+_output_sink: contextvars.ContextVar[Callable[[str, str], None] | None] = contextvars.ContextVar('output_sink', default=None)
+
+class _OutputRouter:
+    def __init__(self, name: str, stream):
+        self._name = name
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        sink = _output_sink.get()
+        if sink is None:
+            return self._stream.write(text)
+        sink(self._name, text)
+        return len(text)
+
+    def flush(self):
+        if _output_sink.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+def try_forward(root: str, request: dict[str, Any], echo: Callable[[str], None]) -> bool:
+    if not is_supported():
+        return False
+    socket_path = get_socket_path(root)
+    if not os.path.exists(socket_path):
+        return False
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(FORWARD_TIMEOUT)
+    try:
+        client.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        client.close()
+        _logger.info(f'ignoring stale daemon socket at {socket_path}')
+        return False
+    except TimeoutError:
+        client.close()
+        _logger.warning(f'timed out connecting to the athena daemon at {socket_path}, running locally')
+        return False
+
+    with client, client.makefile('rw', encoding='utf-8') as stream:
+        # nothing has run until the daemon accepts the request, so it is still safe to run locally until then
+        try:
+            stream.write(json.dumps(request) + '\n')
+            stream.flush()
+            line = stream.readline()
+        except (TimeoutError, ConnectionError):
+            _logger.warning(f'the athena daemon at {socket_path} did not accept the request, running locally')
+            return False
+        if len(line) == 0 or json.loads(line)['type'] != 'accepted':
+            _logger.warning(f'the athena daemon at {socket_path} did not accept the request, running locally')
+            return False
+        # modules can run for as long as they need to once they have started
+        client.settimeout(None)
+        for line in stream:
+            message = json.loads(line)
+            match message['type']:
+                case 'output':
+                    echo(message['text'])
+                case 'stdout' | 'stderr':
+                    stream = sys.stdout if message['type'] == 'stdout' else sys.stderr
+                    stream.write(message['text'])
+                    stream.flush()
+                case 'error':
+                    raise AthenaException(message['message'])
+                case 'done':
+                    return True
+    raise AthenaException('lost connection to athena daemon')
+
+async def serve_async(root: str, on_ready: Callable[[str], None] | None=None):
+    # imported here so that forwarding clients don't pay for the full dependency tree
+    import asyncio
+    from .client import AthenaSession
+    from . import display, file, state as athena_state, run as athena_run
+    from .watch import watch_async
+
+    if not is_supported():
+        raise AthenaException('athena daemon requires unix domain socket support')
+
+    socket_path = get_socket_path(root)
+    if os.path.exists(socket_path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(socket_path)
+            raise AthenaException(f'an athena daemon is already running for `{root}`')
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+
+    async with AthenaSession() as session:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            def send(message: dict[str, Any]):
+                writer.write((json.dumps(message) + '\n').encode('utf-8'))
+
+            loop = asyncio.get_running_loop()
+            loop_thread = threading.get_ident()
+            def send_output(name: str, text: str):
+                # sync modules and fixtures write from worker threads, and the writer belongs to the loop
+                if threading.get_ident() == loop_thread:
+                    send({ 'type': name, 'text': text })
+                else:
+                    loop.call_soon_threadsafe(send, { 'type': name, 'text': text })
+
+            def module_callback(module_name, result):
+                output = display.module_result(request['command'], module_name, result, request['plain'], request['verbose'])
+                if output is not None:
+                    send({ 'type': 'output', 'text': output })
+
+            # tasks and worker threads started from here run in a copy of this context
+            _output_sink.set(send_output)
+            try:
+                request = json.loads(await reader.readline())
+                send({ 'type': 'accepted' })
+                await writer.drain()
+                environment = request['environment'] or athena_state.load(root).environment
+                await athena_run.run_modules(root, request['modules'], environment, module_callback, session, request['jobs'])
+                send({ 'type': 'done' })
+            except AthenaException as e:
+                send({ 'type': 'error', 'message': str(e) })
+            except Exception as e:
+                _logger.exception('error while handling daemon request')
+                send({ 'type': 'error', 'message': f'{type(e).__name__}: {str(e)}' })
+            finally:
+                try:
+                    await writer.drain()
+                finally:
+                    writer.close()
+
+        state_path = os.path.abspath(os.path.join(root, '.athena'))
+        def on_change(_: str, changed_path: str):
+            if file.is_resource_file(changed_path):
+                session.resource_loader.clear_cache()
+            elif os.path.abspath(changed_path) == state_path:
+                # the pool and retention settings for each environment are read from here
+                session.clear_environment_cache()
+
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        # the socket is created with owner only permissions. changing them after it is bound would leave
+        # a window where any user could connect.
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(handle, path=socket_path)
+        finally:
+            os.umask(umask)
+        watch_task = asyncio.create_task(watch_async(root, 0.1, on_change))
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _OutputRouter('stdout', stdout), _OutputRouter('stderr', stderr)
+        try:
+            if on_ready is not None:
+                on_ready(socket_path)
+            async with server:
+                await stop.wait()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            watch_task.cancel()
+            await asyncio.gather(watch_task, return_exceptions=True)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
@@ -1,6 +1,9 @@
 from athena.resource import try_extract_value_from_resource
 from .athena_json import jsonify
 from .run import ExecutionTrace
+from .trace import ConnectionTrace, TimingTrace
+from .body import PREVIEW_SIZE, Body
+from .load import CapacityReport, CapacityStep, LoadReport, TraceSummary
 from .format import long_format_error, short_format_error, color, colors, indent, rtruncate
 from . import humanize
 import random
@@ -91,6 +94,24 @@ def _try_prettify_url_encoded_form(text: str) -> str | None:
 
 formatter = TerminalFormatter()
 
+def module_result(command: str, module_name: str, result: ExecutionTrace, plain: bool, verbose: bool) -> str | None:
+    match command:
+        case 'responses':
+            if plain:
+                return trace_plain(result, include_requests=False, include_responses=True)
+            return trace(result, include_requests=False, include_responses=True, verbose=verbose)
+        case 'requests':
+            if plain:
+                return trace_plain(result, include_requests=True, include_responses=False)
+            return trace(result, include_requests=True, include_responses=False, verbose=verbose)
+        case 'traces':
+            if plain:
+                return trace_plain(result, include_requests=True, include_responses=True)
+            return trace(result, include_requests=True, include_responses=True, verbose=verbose)
+        case 'run':
+            return f"{module_name}: {result.format_long()}"
+    return None
+
 def trace_plain(trace: ExecutionTrace, include_requests: bool, include_responses: bool) -> str:
     jsonified = jsonify(trace.as_serializable())
     if include_requests and include_responses:
@@ -123,6 +144,12 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
     def sub_header() -> str:
         section_output = ""
         section_output += f"environment: {trace.environment}"
+        if trace.pool is not None and trace.pool.opened + trace.pool.reused > 0:
+            pool = trace.pool
+            section_output += f"\npool: {pool.active} active, {pool.idle} idle, {pool.peak} peak ({pool.opened} opened, {pool.reused} reused)"
+        if trace.trace_counts is not None and trace.trace_counts.dropped > 0:
+            counts = trace.trace_counts
+            section_output += f"\ntraces: {counts.requests} requests ({counts.failures} failed), {counts.retained} retained, {counts.dropped} dropped"
         if not trace.success:
             if trace.error is not None:
                 section_output += f"\n{color('Warning:', colors.yellow)} execution failed to complete successfully\n{color(format_error(trace.error), colors.brightred)}"
@@ -143,7 +170,9 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
             meta_info =  "\n".join([
                 f"{color(athena_trace.request.method, colors.bold)} {athena_trace.request.url}",
                 f"{color(athena_trace.response.status_code, colors.brightgreen)} {color(athena_trace.response.reason, colors.green)} {humanize.delta(athena_trace.end-athena_trace.start)}"
-                ])
+                ]
+                + ([_format_connection(athena_trace.connection)] if athena_trace.connection is not None else [])
+                + ([_format_timings(athena_trace.timings)] if athena_trace.timings is not None else []))
             entry.append(("", [meta_info]))
 
             if len(athena_trace.warnings) > 0:
@@ -168,6 +197,10 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
 
                 body_info = []
                 line_numbers = True
+                if athena_trace.request.body is not None:
+                    request_entry.append(_summarize_body(athena_trace.request.content_type, athena_trace.request.body))
+                    request_entry.append((f'url', [athena_trace.request.url]))
+                    return request_entry
                 
                 body_text = athena_trace.request.text
                 render_method = "text"
@@ -192,12 +225,12 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
                         numbered_text.append(color(f"{i+1}".ljust(number_column_width), colors.brightwhite) + " " + line)
                     body_text = "\n".join(numbered_text) + "\n"
                     
-                body_metadata = f"{athena_trace.request.content_type} [{render_method}] {humanize.bytes(len(athena_trace.request.text))}"
+                body_metadata = f"{athena_trace.request.content_type} [{render_method}] {humanize.bytes(len(athena_trace.request.content))}"
                 body_info.append(f"{body_text}")
 
                 body_info = "\n".join(body_info)
 
-                if athena_trace.request.content_type is not None or len(athena_trace.request.text) > 0:
+                if athena_trace.request.content_type is not None or len(athena_trace.request.content) > 0:
                     request_entry.append((f"{color('body', colors.underline)} | {body_metadata}", [body_info]))
 
                 request_entry.append((f'url', [athena_trace.request.url]))
@@ -219,6 +252,10 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
 
                 body_info = []
                 line_numbers = True
+                if athena_trace.response.body is not None:
+                    response_entry.append(_summarize_body(athena_trace.response.content_type, athena_trace.response.body))
+                    return response_entry
+
                 body_text = athena_trace.response.text
                 render_method = "text"
                 if athena_trace.response.content_type is not None:
@@ -242,7 +279,7 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
                         numbered_text.append(color(f"{i+1}".ljust(number_column_width), colors.brightwhite) + " " + line)
                     body_text = "\n".join(numbered_text) + "\n"
                     
-                body_metadata = f"{athena_trace.response.content_type} [{render_method}] {humanize.bytes(len(athena_trace.response.text))}"
+                body_metadata = f"{athena_trace.response.content_type} [{render_method}] {humanize.bytes(len(athena_trace.response.content))}"
                 body_info.append(f"{body_text}")
 
                 body_info = "\n".join(body_info)
@@ -268,6 +305,21 @@ def trace(trace: ExecutionTrace, include_requests: bool, include_responses: bool
             digests_output.append((color(name, colors.underline, colors.bold, colors.blue), value))
     return _compute_indented_output(output)
 
+def _format_connection(connection: ConnectionTrace) -> str:
+    name = f"connection #{connection.id}" if connection.id is not None else "connection"
+    state = "reused" if connection.reused else "new"
+    return f"{name} {color(state, colors.brightwhite)}, waited {humanize.delta(connection.pool_wait)}"
+
+def _format_timings(timings: TimingTrace) -> str:
+    return ", ".join([f"{color(phase, _phase_colors[phase])} {humanize.delta(phase_duration)}" for phase, phase_duration in timings.phases() if phase_duration is not None])
+
+def _summarize_body(content_type: str | None, body: Body) -> tuple[str, list[str]]:
+    # binary and streamed bodies are never decoded in full, so only the size, hash and any preview are shown
+    kind = "binary" if body.binary else "stream"
+    body_metadata = f"{content_type} [{kind}] {humanize.bytes(body.size)} sha256:{body.sha256[:12]}"
+    body_text = body.preview + ("..." if body.size > PREVIEW_SIZE else "") if not body.binary else ""
+    return (f"{color('body', colors.underline)} | {body_metadata}", [body_text])
+
 def _create_duration_view(trace: ExecutionTrace, output_max_width: int):
     time_data = []
     start = 0
@@ -275,18 +327,11 @@ def _create_duration_view(trace: ExecutionTrace, output_max_width: int):
     max_name_len = 25
     name_len = min(max([len(t.name) for t in trace.athena_traces]), max_name_len)
     for athena_trace in trace.athena_traces:
-        name = athena_trace.name
-        if len(name) > name_len:
-            if name_len < 5:
-                name = "..." + name[-(name_len-3):]
-            else:
-                name = name[:(name_len-3)//2] + "..." + name[-(name_len-3-((name_len-3)//2)):]
-        elif len(name) < name_len:
-            name = name.center(name_len)
+        name = _truncate_name(athena_trace.name, name_len).center(name_len)
         if start == 0:
             start = athena_trace.start
         end = athena_trace.end
-        time_data.append((name, athena_trace.start, athena_trace.end))
+        time_data.append((name, athena_trace.start, athena_trace.end, athena_trace.timings))
 
     seperator = "    "
     duration = end-start
@@ -296,17 +341,141 @@ def _create_duration_view(trace: ExecutionTrace, output_max_width: int):
         return ""
     
     output = []
-    for name, trace_start, trace_end in time_data:
+    for name, trace_start, trace_end, timings in time_data:
         line = " "*max_line_len
         start_position = int(round(((trace_start-start) / duration)*max_line_len))
         end_position = int(round(((trace_end-start) / duration)*max_line_len))
-        line = line[:start_position] + "·"*(end_position - start_position + 1) + " "
-        line_color = random.choice(_color_list)
-        line = color(line, line_color)
+        if timings is None:
+            line = line[:start_position] + "·"*(end_position - start_position + 1) + " "
+            line_color = random.choice(_color_list)
+            line = color(line, line_color)
+        else:
+            bar = _create_waterfall(timings, trace_end-trace_start, end_position - start_position + 1)
+            line = line[:start_position] + bar + " "
         output.append(f"{name}{seperator}{line}{humanize.delta(trace_end-trace_start)}")
 
+    if any([timings is not None for _, _, _, timings in time_data]):
+        legend = " ".join([color(phase, phase_color) for phase, phase_color in _phase_colors.items()])
+        output.append(f"{' '*name_len}{seperator}{legend}")
+
     return "\n".join(output)
 
+_phase_colors = {
+    'dns': colors.cyan,
+    'connect': colors.yellow,
+    'tls': colors.magenta,
+    'ttfb': colors.green,
+    'transfer': colors.blue,
+}
+
+def _create_waterfall(timings: TimingTrace, elapsed: float, width: int) -> str:
+    # anything that isn't one of the phases, like waiting for a connection, happens before them
+    phases = [(phase, phase_duration) for phase, phase_duration in timings.phases() if phase_duration is not None]
+    other = max(elapsed - sum([phase_duration for _, phase_duration in phases]), 0)
+    segments = [(None, other)] + phases
+    total = sum([segment_duration for _, segment_duration in segments])
+
+    bar = ""
+    position = 0
+    boundary = 0
+    for phase, segment_duration in segments:
+        boundary += segment_duration
+        segment_end = width if total == 0 else int(round(boundary / total * width))
+        if segment_end > position:
+            bar += color("·"*(segment_end - position), _phase_colors[phase] if phase is not None else colors.white)
+            position = segment_end
+    return bar
+
+def _truncate_name(name: str, name_len: int) -> str:
+    if len(name) <= name_len:
+        return name
+    if name_len < 5:
+        return "..." + name[-(name_len-3):]
+    return name[:(name_len-3)//2] + "..." + name[-(name_len-3-((name_len-3)//2)):]
+
+def load_report(report: LoadReport) -> str:
+    output = []
+    success_color = colors.green if report.failed_iterations == 0 else colors.red
+    header = f"{color(report.module_name, colors.underline, colors.bold)} {color('•', success_color)}"
+
+    execution = [f"environment: {report.environment}", f"concurrency: {report.concurrency}"]
+    if report.rate is not None:
+        execution.append(f"rate: {report.rate:g}/s ({report.arrivals} arrivals)")
+    execution.append(f"warm-up: {humanize.delta(report.warmup) if report.warmup > 0 else 'none'}")
+    execution.append(f"duration: {humanize.delta(report.duration)}")
+    execution.append(f"iterations: {report.iterations} ({report.failed_iterations} failed)")
+    if report.error is not None:
+        execution.append(f"{color('Warning:', colors.yellow)} last error\n{color(report.error, colors.brightred)}")
+
+    max_name_len = 40
+    name_len = max([len('total')] + [min(len(t.name), max_name_len) for t in report.traces])
+    columns = ['requests', 'rps', 'errors', 'p50', 'p90', 'p99', 'p999']
+    def row(name: str, values: list[str]) -> str:
+        return name.ljust(name_len) + "".join([v.rjust(10) for v in values])
+    def summary_row(summary: TraceSummary) -> str:
+        values = [str(summary.requests), f"{summary.rps:.1f}", f"{summary.error_rate:.1%}"]
+        values += [humanize.delta(summary.latency[c]) for c in columns[3:]]
+        return row(_truncate_name(summary.name, name_len), values)
+
+    table = [color(row("name", columns), colors.bold)]
+    table += [summary_row(t) for t in report.traces]
+    if len(report.traces) > 1:
+        table.append(color(summary_row(report.total), colors.bold))
+
+    sections = [
+        (color("execution", colors.underline), execution),
+        (color("latency", colors.underline), table)
+    ]
+
+    if report.total.corrected_latency is not None:
+        def corrected_row(summary: TraceSummary) -> str:
+            assert summary.corrected_latency is not None
+            return row(_truncate_name(summary.name, name_len), [humanize.delta(summary.corrected_latency[c]) for c in columns[3:]])
+        corrected_table = [color(row("name", columns[3:]), colors.bold)]
+        corrected_table += [corrected_row(t) for t in report.traces]
+        if len(report.traces) > 1:
+            corrected_table.append(color(corrected_row(report.total), colors.bold))
+        sections.append((color("corrected latency", colors.underline), corrected_table))
+
+    output.append((header, sections))
+    return _compute_indented_output(output)
+
+def capacity_step(parameter: str, step: CapacityStep) -> str:
+    value = f"{step.rate:g}/s" if parameter == 'rate' else str(step.concurrency)
+    values = [value, f"{step.rps:.1f}", humanize.delta(step.p50), humanize.delta(step.p99), f"{step.error_rate:.1%}"]
+    line = "".join([v.rjust(12) for v in values])
+    if step.passed:
+        return f"{line}    {color('passed', colors.green)}"
+    return f"{line}    {color('failed', colors.red)} ({', '.join(step.breaches)})"
+
+def capacity_report(report: CapacityReport) -> str:
+    output = []
+    if report.capacity is not None:
+        summary = f"{report.capacity.rps:.1f} rps"
+        header = f"{color(report.module_name, colors.underline, colors.bold)} {color('•', colors.green)} capacity: {summary}"
+    else:
+        header = f"{color(report.module_name, colors.underline, colors.bold)} {color('•', colors.red)} capacity: none"
+
+    execution = [
+        f"environment: {report.environment}",
+        f"arrivals: {report.arrivals}",
+        f"slo: {', '.join(report.slo)}",
+        f"warm-up: {humanize.delta(report.warmup) if report.warmup > 0 else 'none'}",
+        f"duration: {humanize.delta(report.duration)} per step",
+    ]
+    if not report.breached:
+        execution.append(f"{color('Warning:', colors.yellow)} the slo was not breached, capacity may be higher")
+
+    columns = [report.parameter, 'rps', 'p50', 'p99', 'errors']
+    curve = [color("".join([c.rjust(12) for c in columns]), colors.bold)]
+    curve += [capacity_step(report.parameter, step) for step in report.steps]
+
+    output.append((header, [
+        (color("execution", colors.underline), execution),
+        (color("curve", colors.underline), curve)
+    ]))
+    return _compute_indented_output(output)
+
 def _compute_indented_output(value) -> str:
     stringified_values = []
     for item in value:
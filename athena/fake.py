@@ -6,7 +6,14 @@ import datetime
 class Fake():
     """Generate randomized fake data"""
     def __init__(self):
-        self._faker = Faker()
+        self.__faker: Faker | None = None
+
+    @property
+    def _faker(self) -> Faker:
+        # building a Faker is comparatively slow, so it is deferred until it is first used
+        if self.__faker is None:
+            self.__faker = Faker()
+        return self.__faker
 
     def _discriminator(self):
         return self._faker.hexify('^^^^^^^^')
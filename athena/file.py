@@ -1,5 +1,5 @@
 from typing import Callable
-import os, yaml, re, glob
+import os, re, glob
 
 from .exceptions import AthenaException
 
@@ -100,10 +100,13 @@ def is_resource_file(path: str):
         return False
     return True
 
+# yaml is imported on first use, it is one of the slower imports for the cli entry point
 def import_yaml(file) -> object:
+     import yaml
      return yaml.load(file, Loader=yaml.FullLoader)
 
 def export_yaml(obj) -> str:
+    import yaml
     return yaml.dump(obj, default_flow_style=False)
 
 
@@ -18,6 +18,27 @@ def delta(
             return "{:.3g}".format(amount) + unit
     return "{:.3g}".format(milliseconds) + 'ms'
 
+_delta_units = [
+    ('ms', 0.001),
+    ('s', 1),
+    ('m', 60),
+    ('h', 60 * 60),
+    ('d', 60 * 60 * 24),
+]
+
+def parse_delta(
+        value: str
+        ) -> float:
+    # inverse of `delta`, e.g. `250ms` -> 0.25. a bare number is read as seconds.
+    text = value.strip().lower()
+    scale = 1
+    # check the longest units first, so that `ms` isn't read as `s`
+    for unit, multiplier in sorted(_delta_units, key=lambda u: len(u[0]), reverse=True):
+        if text.endswith(unit):
+            text, scale = text[:-len(unit)], multiplier
+            break
+    return float(text) * scale
+
 def bytes(
         value: float | int
         ) -> str:
@@ -0,0 +1,113 @@
+from __future__ import annotations
+import json
+from typing import Any, Iterable, Iterator
+
+from .exceptions import AthenaException
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+_delimiters = _whitespace + ',:]}'
+
+# reads json values out of a stream of text chunks, only keeping the chunks that
+# haven't been consumed yet. values are decoded with the c scanner, and a value that
+# fails to decode is retried once more of the stream has been read.
+class _Reader:
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        for chunk in self._chunks:
+            if len(chunk) == 0:
+                continue
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+            return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, token: str):
+        found = self.peek()
+        if found != token:
+            raise AthenaException(f"invalid json: expected `{token}` but found `{found or 'end of input'}`")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # strings and containers end with their closing token. a number or a bare literal only
+                # ends at a delimiter, anything else may be the rest of it, still in the next chunk
+                if self.eof or self.buffer[self.pos] in '"[{' or (end < len(self.buffer) and self.buffer[end] in _delimiters):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise AthenaException(f"invalid json: {e}")
+            self.fill()
+
+    def skip_value(self):
+        # containers are skipped one member at a time, so a large sibling of the target is never held in memory
+        token = self.peek()
+        if token not in '[{' or token == "":
+            self.read_value()
+            return
+        closing = ']' if token == '[' else '}'
+        self.pos += 1
+        if self.peek() == closing:
+            self.pos += 1
+            return
+        while True:
+            if closing == '}':
+                self.read_value()
+                self.expect(':')
+            self.skip_value()
+            token = self.peek()
+            self.pos += 1
+            if token == closing:
+                return
+            if token != ',':
+                raise AthenaException(f"invalid json: expected `,` or `{closing}` but found `{token or 'end of input'}`")
+
+def iter_json(chunks: Iterable[str], path: str="") -> Iterator[Any]:
+    reader = _Reader(chunks)
+    keys = [key for key in path.split('.') if len(key) > 0]
+    for i, key in enumerate(keys):
+        reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                raise AthenaException(f"invalid json path `{path}`: key `{'.'.join(keys[:i+1])}` not found")
+            found = reader.read_value()
+            reader.expect(':')
+            if found == key:
+                break
+            reader.skip_value()
+            token = reader.peek()
+            if token != '}':
+                reader.expect(',')
+
+    if reader.peek() != '[':
+        raise AthenaException(f"invalid json path `{path}`: expected an array")
+    reader.pos += 1
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.read_value()
+        token = reader.peek()
+        reader.pos += 1
+        if token == ']':
+            return
+        if token != ',':
+            raise AthenaException(f"invalid json: expected `,` or `]` but found `{token or 'end of input'}`")
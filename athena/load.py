@@ -0,0 +1,512 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, math, os, random, re, time
+from typing import Callable, Iterator
+
+from . import cache, file, humanize, module
+from .athena_json import serializeable
+from .client import Athena, Context, AthenaSession
+from .exceptions import AthenaException
+from .format import short_format_error
+from .retention import RetentionPolicy
+from .run import FixtureCache
+from .trace import AthenaTrace
+
+# relative width of each histogram bucket, this bounds the error of a reported percentile to ~1%
+HISTOGRAM_PRECISION = 0.01
+# latencies (in seconds) below this value all share the first bucket
+HISTOGRAM_MINIMUM = 1e-6
+_bucket_width = math.log1p(HISTOGRAM_PRECISION)
+
+# requests are grouped by their trace name, with the query string dropped and ids in the path replaced
+# by `{id}`. past this many groups, including the overflow, the rest are counted under OVERFLOW_TRACE_NAME.
+MAX_TRACE_NAMES = 100
+OVERFLOW_TRACE_NAME = '(other)'
+_id_segment_re = re.compile(r"^(\d+|[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12})$")
+
+# closed loop arrivals wait for a free worker, open loop arrivals are started on schedule
+ARRIVALS = ['closed', 'fixed', 'poisson']
+
+PERCENTILES = {
+    'p50': 50,
+    'p90': 90,
+    'p99': 99,
+    'p999': 99.9,
+}
+
+# latencies are grouped into logarithmic buckets, so the memory used depends on
+# the range of the recorded values rather than the number of them
+class LatencyHistogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self._buckets: dict[int, int] = {}
+
+    def record(self, value: float):
+        index = int(math.log(max(value, HISTOGRAM_MINIMUM) / HISTOGRAM_MINIMUM) / _bucket_width)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, percentile: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                # middle of the bucket, kept inside of the observed range
+                value = HISTOGRAM_MINIMUM * math.exp((index + 0.5) * _bucket_width)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def mean(self) -> float:
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class TraceStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.corrected_latency: LatencyHistogram | None = None
+
+    def record(self, trace: AthenaTrace, lag: float | None):
+        self.requests += 1
+        if trace.response.status_code >= 400:
+            self.errors += 1
+        latency = trace.end - trace.start
+        self.latency.record(latency)
+        if lag is not None:
+            if self.corrected_latency is None:
+                self.corrected_latency = LatencyHistogram()
+            self.corrected_latency.record(latency + lag)
+
+    def merge(self, other: 'TraceStats'):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+        if other.corrected_latency is not None:
+            if self.corrected_latency is None:
+                self.corrected_latency = LatencyHistogram()
+            self.corrected_latency.merge(other.corrected_latency)
+
+# running totals for a load test. traces are folded into these as soon as their
+# iteration completes, and are then discarded.
+def _group_trace_name(name: str) -> str:
+    path, _, _ = name.partition('?')
+    segments = path.split('/')
+    return '/'.join('{id}' if _id_segment_re.match(segment) else segment for segment in segments)
+
+class LoadStats:
+    def __init__(self):
+        self.iterations = 0
+        self.failed_iterations = 0
+        self.last_error: str | None = None
+        self.traces: dict[str, TraceStats] = {}
+
+    def record_iteration(self, success: bool, error: Exception | None, traces: list[AthenaTrace], scheduled: float | None):
+        self.iterations += 1
+        if not success:
+            self.failed_iterations += 1
+            if error is not None:
+                self.last_error = short_format_error(error)
+
+        # when an iteration starts late, every request in it is charged the time it spent waiting. otherwise
+        # a slow server would hold back the iterations that would have seen it being slow (coordinated omission).
+        lag = None
+        if scheduled is not None and len(traces) > 0:
+            lag = max(0.0, min(t.start for t in traces) - scheduled)
+        for trace in traces:
+            name = _group_trace_name(trace.name)
+            stats = self.traces.get(name)
+            if stats is None:
+                if len(self.traces) >= MAX_TRACE_NAMES - 1:
+                    name = OVERFLOW_TRACE_NAME
+                    stats = self.traces.get(name)
+                if stats is None:
+                    stats = self.traces[name] = TraceStats()
+            stats.record(trace, lag)
+
+    def total(self) -> TraceStats:
+        total = TraceStats()
+        for stats in self.traces.values():
+            total.merge(stats)
+        return total
+
+def _summarize_latency(histogram: LatencyHistogram) -> dict[str, float]:
+    latency = {
+        'mean': histogram.mean(),
+        'min': histogram.minimum if histogram.count > 0 else 0.0,
+        'max': histogram.maximum,
+    }
+    for key, percentile in PERCENTILES.items():
+        latency[key] = histogram.percentile(percentile)
+    return latency
+
+@serializeable
+class TraceSummary:
+    """Summary of the requests made for a single trace name. Query strings are dropped from the name,
+    and numeric or uuid path segments are replaced with `{id}`.
+
+    Attributes:
+        name (str): The name of the trace.
+        requests (int): The number of completed requests.
+        rps (float): The average number of requests completed per second.
+        errors (int): The number of requests with a 4xx or 5xx response.
+        error_rate (float): The fraction of requests that were errors.
+        latency (dict[str, float]): The `mean`, `min`, `max`, `p50`, `p90`, `p99` and `p999` latency in seconds.
+        corrected_latency (dict[str, float] | None): The same as `latency`, but measured from when each iteration
+            was scheduled to start rather than when it did. Only available when iterations are started at a fixed rate.
+    """
+    def __init__(self, name: str, stats: TraceStats, duration: float):
+        self.name = name
+        self.requests = stats.requests
+        self.rps = stats.requests / duration if duration > 0 else 0.0
+        self.errors = stats.errors
+        self.error_rate = stats.errors / stats.requests if stats.requests > 0 else 0.0
+        self.latency = _summarize_latency(stats.latency)
+        self.corrected_latency = _summarize_latency(stats.corrected_latency) if stats.corrected_latency is not None else None
+
+@serializeable
+class LoadReport:
+    """Results of the steady state phase of a load test.
+
+    Attributes:
+        module_name (str): The name of the module.
+        environment (str | None): The environment the module was run against.
+        arrivals (str): How iterations were started, one of `closed`, `fixed` or `poisson`.
+        concurrency (int): The number of iterations allowed to run at the same time.
+        rate (float | None): The (average) number of iterations started per second.
+        warmup (float): The length of the warm-up phase in seconds.
+        duration (float): The length of the steady state phase in seconds.
+        iterations (int): The number of iterations started during the steady state phase.
+        failed_iterations (int): The number of those iterations that did not complete successfully.
+        error (str | None): The most recent error raised by a failed iteration.
+        total (TraceSummary): Summary of all requests.
+        traces (list[TraceSummary]): Summary of the requests for each trace name. There are at most 100 of
+            them, once the limit is reached the requests for any new names are grouped under `(other)`.
+    """
+    def __init__(self,
+        module_name: str,
+        environment: str | None,
+        arrivals: str,
+        concurrency: int,
+        rate: float | None,
+        warmup: float,
+        duration: float,
+        stats: LoadStats
+    ):
+        self.module_name = module_name
+        self.environment = environment
+        self.arrivals = arrivals
+        self.concurrency = concurrency
+        self.rate = rate
+        self.warmup = warmup
+        self.duration = duration
+        self.iterations = stats.iterations
+        self.failed_iterations = stats.failed_iterations
+        self.error = stats.last_error
+        self.total = TraceSummary('total', stats.total(), duration)
+        self.traces = [TraceSummary(name, trace_stats, duration) for name, trace_stats in sorted(stats.traces.items())]
+
+def arrival_offsets(rate: float, arrivals: str) -> Iterator[float]:
+    # offsets (in seconds) from the start of the test at which each iteration should start
+    if arrivals == 'poisson':
+        offset = 0.0
+        while True:
+            yield offset
+            offset += random.expovariate(rate)
+    i = 0
+    while True:
+        yield i / rate
+        i += 1
+
+async def run_load(
+    root: str,
+    module_path: str,
+    environment: str | None,
+    session: AthenaSession,
+    concurrency: int,
+    duration: float,
+    warmup: float=0,
+    rate: float | None=None,
+    arrivals: str='closed') -> LoadReport:
+    module_path = os.path.normpath(module_path)
+    if not os.path.isfile(module_path):
+        raise AthenaException(f"cannot find module at {module_path}")
+    if not module_path.endswith(".py"):
+        raise AthenaException(f"not a python module {module_path}")
+    if arrivals not in ARRIVALS:
+        raise AthenaException(f"invalid arrivals `{arrivals}`, expected one of {', '.join(ARRIVALS)}")
+    if arrivals != 'closed' and rate is None:
+        raise AthenaException(f"{arrivals} arrivals require a rate")
+    module_name = os.path.basename(module_path)[:-3]
+
+    # the module is loaded once, and its function is called for every iteration
+    success, loaded_module, error = module.try_load_module(module_path)
+    if not success:
+        raise AthenaException(f"unable to load module {module_name}: {short_format_error(error)}")
+    function_name = 'load' if module.try_get_function(loaded_module, 'load', 1)[0] else 'run'
+    if not module.try_get_function(loaded_module, function_name, 1)[0]:
+        raise AthenaException(f"module {module_name} is missing a load or run function with 1 argument")
+
+    context = Context(environment, module_name, module_path, root)
+    fixture_paths = file.search_module_half_ancestors(root, module_path, 'fixture.py')
+    fixture_cache = FixtureCache()
+    athena_cache = cache.load(root)
+    stats = LoadStats()
+
+    start = time.time()
+    steady_start = start + warmup
+    steady_end = steady_start + duration
+
+    async def iterate(executor: ThreadPoolExecutor, scheduled: float | None):
+        iteration_start = scheduled if scheduled is not None else time.time()
+        # every iteration gets its own instance, so its traces are released once they are recorded
+        # every trace is folded into the stats, so the retention policy for the environment doesn't apply
+        athena_instance = Athena(context, session, athena_cache.data, RetentionPolicy())
+        initial_cache_data = dict(athena_instance.cache._data)
+        try:
+            success, error = True, None
+            for fixture_path in fixture_paths:
+                success, error = await fixture_cache.try_execute_fixture_async(fixture_path, module_path, athena_instance, executor)
+                if not success and error is not None:
+                    break
+            else:
+                success, _, error = await module.try_execute_function_async(loaded_module, function_name, (athena_instance,), executor)
+            if iteration_start >= steady_start:
+                stats.record_iteration(success, error, athena_instance.traces(), scheduled)
+        finally:
+            athena_instance._close()
+            cache.merge(athena_cache, initial_cache_data, athena_instance.cache._data)
+
+    async def run_closed(executor: ThreadPoolExecutor):
+        offsets = arrival_offsets(rate, 'fixed') if rate is not None else None
+        async def worker():
+            while True:
+                scheduled = None
+                if offsets is not None:
+                    # iterations are spaced out evenly, but a worker that falls behind will not skip any
+                    scheduled = start + next(offsets)
+                    if scheduled >= steady_end or time.time() >= steady_end:
+                        return
+                    if scheduled > time.time():
+                        await asyncio.sleep(scheduled - time.time())
+                elif time.time() >= steady_end:
+                    return
+                await iterate(executor, scheduled)
+        await _gather_or_cancel([asyncio.create_task(worker()) for _ in range(concurrency)])
+
+    async def run_open(executor: ThreadPoolExecutor):
+        assert rate is not None
+        tasks: set[asyncio.Task] = set()
+        failed: list[asyncio.Task] = []
+        def on_done(task: asyncio.Task):
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                failed.append(task)
+
+        # iterations are started on schedule, no matter how many of them are still outstanding
+        for offset in arrival_offsets(rate, arrivals):
+            scheduled = start + offset
+            if scheduled >= steady_end or len(failed) > 0:
+                break
+            # always yield, even when behind schedule, so the started iterations get to run instead
+            # of every late arrival being created in one burst
+            await asyncio.sleep(max(0, scheduled - time.time()))
+            task = asyncio.create_task(iterate(executor, scheduled))
+            tasks.add(task)
+            task.add_done_callback(on_done)
+        await _gather_or_cancel(list(tasks) + failed)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            if arrivals == 'closed':
+                await run_closed(executor)
+            else:
+                await run_open(executor)
+    finally:
+        cache.save(root, athena_cache)
+
+    return LoadReport(module_name, environment, arrivals, concurrency, rate, warmup, duration, stats)
+
+_slo_re = re.compile(r"^\s*(\w+)\s*(<=|<)\s*(.+?)\s*$")
+SLO_METRICS = ['mean', 'min', 'max'] + list(PERCENTILES.keys()) + ['errors']
+
+class SloCondition:
+    """A single objective that a load test has to meet, e.g. `p99<250ms` or `errors<1%`.
+
+    Attributes:
+        metric (str): The latency metric (`mean`, `min`, `max`, `p50`, `p90`, `p99`, `p999`) or `errors`.
+        inclusive (bool): Whether the value may be equal to the threshold.
+        threshold (float): The threshold in seconds, or as a fraction for `errors`.
+    """
+    def __init__(self, metric: str, inclusive: bool, threshold: float):
+        self.metric = metric
+        self.inclusive = inclusive
+        self.threshold = threshold
+
+    def _format(self, value: float) -> str:
+        if self.metric == 'errors':
+            return f"{value:.1%}"
+        return humanize.delta(value)
+
+    def value(self, report: LoadReport) -> float:
+        if self.metric == 'errors':
+            # failed iterations count against the objective, even if they never made a request
+            iteration_failure_rate = report.failed_iterations / report.iterations if report.iterations > 0 else 0.0
+            return max(report.total.error_rate, iteration_failure_rate)
+        # when the iterations followed a schedule, the time spent waiting on it counts too
+        latency = report.total.corrected_latency or report.total.latency
+        return latency[self.metric]
+
+    def check(self, report: LoadReport) -> str | None:
+        value = self.value(report)
+        if value < self.threshold or (self.inclusive and value == self.threshold):
+            return None
+        return f"{self.metric} {self._format(value)} {'>' if self.inclusive else '>='} {self._format(self.threshold)}"
+
+    def __str__(self):
+        return f"{self.metric}{'<=' if self.inclusive else '<'}{self._format(self.threshold)}"
+
+def parse_slo(slo: str) -> list[SloCondition]:
+    conditions = []
+    for part in slo.split(','):
+        match = _slo_re.match(part)
+        if match is None:
+            raise AthenaException(f"invalid slo condition `{part.strip()}`, expected e.g. `p99<250ms` or `errors<1%`")
+        metric, operator, threshold_text = match.groups()
+        if metric not in SLO_METRICS:
+            raise AthenaException(f"invalid slo metric `{metric}`, expected one of {', '.join(SLO_METRICS)}")
+        try:
+            if metric == 'errors':
+                threshold = float(threshold_text[:-1]) / 100 if threshold_text.endswith('%') else float(threshold_text)
+            else:
+                threshold = humanize.parse_delta(threshold_text)
+        except ValueError:
+            raise AthenaException(f"invalid slo threshold `{threshold_text}` for {metric}")
+        conditions.append(SloCondition(metric, operator == '<=', threshold))
+    return conditions
+
+@serializeable
+class CapacityStep:
+    """A single step of a capacity search.
+
+    Attributes:
+        concurrency (int): The concurrency used for this step.
+        rate (float | None): The target rate used for this step.
+        rps (float): The number of requests completed per second.
+        p50 (float): The median latency in seconds.
+        p99 (float): The 99th percentile latency in seconds.
+        error_rate (float): The fraction of requests that were errors.
+        passed (bool): Whether the step met every slo condition.
+        breaches (list[str]): The slo conditions that were not met.
+    """
+    def __init__(self, report: LoadReport, breaches: list[str]):
+        latency = report.total.corrected_latency or report.total.latency
+        self.concurrency = report.concurrency
+        self.rate = report.rate
+        self.rps = report.total.rps
+        self.p50 = latency['p50']
+        self.p99 = latency['p99']
+        self.error_rate = report.total.error_rate
+        self.passed = len(breaches) == 0
+        self.breaches = breaches
+
+@serializeable
+class CapacityReport:
+    """Results of a capacity search.
+
+    Attributes:
+        module_name (str): The name of the module.
+        environment (str | None): The environment the module was run against.
+        arrivals (str): How iterations were started, one of `closed`, `fixed` or `poisson`.
+        parameter (str): What was increased at each step, either `concurrency` or `rate`.
+        slo (list[str]): The slo conditions each step had to meet.
+        warmup (float): The length of the warm-up phase of each step in seconds.
+        duration (float): The length of the steady state phase of each step in seconds.
+        capacity (CapacityStep | None): The last step that met the slo, if any.
+        breached (bool): Whether the slo was breached before running out of steps.
+        steps (list[CapacityStep]): The throughput and latency of every step.
+    """
+    def __init__(self,
+        module_name: str,
+        environment: str | None,
+        arrivals: str,
+        parameter: str,
+        slo: list[SloCondition],
+        warmup: float,
+        duration: float
+    ):
+        self.module_name = module_name
+        self.environment = environment
+        self.arrivals = arrivals
+        self.parameter = parameter
+        self.slo = [str(c) for c in slo]
+        self.warmup = warmup
+        self.duration = duration
+        self.capacity: CapacityStep | None = None
+        self.breached = False
+        self.steps: list[CapacityStep] = []
+
+async def find_capacity(
+    root: str,
+    module_path: str,
+    environment: str | None,
+    session: AthenaSession,
+    slo: list[SloCondition],
+    concurrency: int,
+    duration: float,
+    warmup: float=0,
+    rate: float | None=None,
+    arrivals: str='closed',
+    step: float | None=None,
+    max_steps: int=10,
+    step_completed_callback: Callable[[CapacityStep], None] | None=None) -> CapacityReport:
+    # the rate is ramped when there is one, otherwise the concurrency is
+    parameter = 'rate' if rate is not None else 'concurrency'
+    initial_value = rate if rate is not None else concurrency
+    step = step or initial_value
+
+    module_name = os.path.basename(os.path.normpath(module_path))[:-3]
+    report = CapacityReport(module_name, environment, arrivals, parameter, slo, warmup, duration)
+    for i in range(max_steps):
+        value = initial_value + i * step
+        if parameter == 'rate':
+            load_report = await run_load(root, module_path, environment, session, concurrency, duration, warmup, value, arrivals)
+        else:
+            load_report = await run_load(root, module_path, environment, session, max(1, round(value)), duration, warmup, rate, arrivals)
+
+        breaches = [b for b in [c.check(load_report) for c in slo] if b is not None]
+        capacity_step = CapacityStep(load_report, breaches)
+        report.steps.append(capacity_step)
+        if step_completed_callback is not None:
+            step_completed_callback(capacity_step)
+        if not capacity_step.passed:
+            report.breached = True
+            break
+        report.capacity = capacity_step
+    return report
+
+async def _gather_or_cancel(tasks: list[asyncio.Task]):
+    try:
+        await asyncio.gather(*tasks)
+    except:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
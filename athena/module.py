@@ -1,5 +1,7 @@
 from collections.abc import Coroutine
-import os, sys, logging
+from concurrent.futures import Executor
+from types import CodeType, ModuleType
+import asyncio, contextvars, os, sys, logging
 from typing import Any, Dict, List, Callable
 
 from . import history
@@ -12,70 +14,131 @@ from . import cache, file
 from .client import Athena, Context, AthenaSession
 from .exceptions import AthenaException
 from .resource import ResourceLoader
-import importlib, inspect
+import hashlib, importlib.abc, importlib.machinery, importlib.util, inspect
 
-def try_execute_module(module_dir, module_name, function_name, function_args):
-    sys.path.insert(0, module_dir)
+# compiled module code, keyed by path and invalidated when the file changes on disk
+_code_cache: dict[str, tuple[tuple[int, int], CodeType]] = {}
+
+# modules are never added to sys.path, so a module that imports a helper next to it is resolved by this
+# finder instead. it only looks in the directory of the file doing the import, and only for directories
+# that modules were loaded from, after every other finder has had its turn.
+class _SiblingFinder(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.directories: set[str] = set()
+
+    def find_spec(self, fullname, path, target=None):
+        if path is not None or '.' in fullname:
+            return None
+        directory = _importing_directory()
+        if directory is None or directory not in self.directories:
+            return None
+        return importlib.machinery.PathFinder.find_spec(fullname, [directory])
+
+def _importing_directory() -> str | None:
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith('<frozen') and not filename.startswith(_importlib_directory):
+            module_file = frame.f_globals.get('__file__')
+            return os.path.dirname(os.path.abspath(module_file)) if isinstance(module_file, str) else None
+        frame = frame.f_back
+    return None
+
+_importlib_directory = os.path.dirname(importlib.__file__)
+_sibling_finder = _SiblingFinder()
+
+def load_module(module_path: str) -> ModuleType:
+    # modules are built from their file location and never added to sys.path. they are registered in
+    # sys.modules under a name derived from their path, so modules that share a file name cannot collide,
+    # while dataclasses, typing.get_type_hints and pickle can still find the module a class was defined in
+    module_name = f"athena_module_{hashlib.sha1(os.path.abspath(module_path).encode()).hexdigest()[:16]}"
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    if spec is None or spec.loader is None:
+        raise AthenaException(f"unable to load module at {module_path}")
+    module = importlib.util.module_from_spec(spec)
+    if _sibling_finder not in sys.meta_path:
+        sys.meta_path.append(_sibling_finder)
+    _sibling_finder.directories.add(os.path.dirname(os.path.abspath(module_path)))
+    sys.modules[module_name] = module
     try:
-        module = importlib.import_module(module_name)
-        try:
-            has_function, function = try_get_function(module, function_name, len(function_args))
-            if has_function:
-                result = function(*function_args)
-                return True, result, None
-            else:
-                return False, None, None
-        finally:
+        exec(_get_code(module_path, spec), module.__dict__)
+    except BaseException:
+        if sys.modules.get(module_name) is module:
             del sys.modules[module_name]
+        raise
+    return module
+
+def _get_code(module_path: str, spec) -> CodeType:
+    stat = os.stat(module_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _code_cache.get(module_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    code = spec.loader.get_code(spec.name)
+    _code_cache[module_path] = (version, code)
+    return code
+
+def try_load_module(module_path):
+    try:
+        return True, load_module(module_path), None
     except Exception as e:
         if isinstance(e, AthenaException):
             raise
         return False, None, e
-    finally:
-        sys.path.pop(0)
 
-def execute_module(module_dir, module_name, function_name, function_args):
-    sys.path.insert(0, module_dir)
+def try_execute_function(module, function_name, function_args):
     try:
-        module = importlib.import_module(module_name)
-        try:
-            has_function, function = try_get_function(module, function_name, len(function_args))
-            if not has_function:
-                raise AthenaException(f'Module {module_name} at {module_dir} is missing a {function_name} function with {len(function_args)} arguments')
-            return function(*function_args)
-        finally:
-            del sys.modules[module_name]
-    finally:
-        sys.path.pop(0)
+        has_function, function = try_get_function(module, function_name, len(function_args))
+        if has_function:
+            result = function(*function_args)
+            return True, result, None
+        else:
+            return False, None, None
+    except Exception as e:
+        if isinstance(e, AthenaException):
+            raise
+        return False, None, e
 
-async def try_execute_module_async(module_dir, module_name, function_name, function_args):
-    sys.path.insert(0, module_dir)
+def try_execute_module(module_path, function_name, function_args):
+    success, module, error = try_load_module(module_path)
+    if not success:
+        return False, None, error
+    return try_execute_function(module, function_name, function_args)
+
+def execute_module(module_path, function_name, function_args):
+    module = load_module(module_path)
+    has_function, function = try_get_function(module, function_name, len(function_args))
+    if not has_function:
+        raise AthenaException(f'Module {os.path.basename(module_path)[:-3]} at {os.path.dirname(module_path)} is missing a {function_name} function with {len(function_args)} arguments')
+    return function(*function_args)
+
+async def try_execute_module_async(module_path, function_name, function_args, executor: Executor | None=None):
+    success, module, error = try_load_module(module_path)
+    if not success:
+        return False, None, error
+    return await try_execute_function_async(module, function_name, function_args, executor)
+
+async def try_execute_function_async(module, function_name, function_args, executor: Executor | None=None):
     try:
-        module = importlib.import_module(module_name)
-        try:
-            has_function, function = try_get_function(module, function_name, len(function_args))
-            if has_function:
-                if inspect.iscoroutinefunction(function):
-                    result = await function(*function_args)
-                else:
-                    result = function(*function_args)
-                return True, result, None
+        has_function, function = try_get_function(module, function_name, len(function_args))
+        if has_function:
+            if inspect.iscoroutinefunction(function):
+                result = await function(*function_args)
+            elif executor is not None:
+                # run in a copy of the caller's context, so context variables like the daemon's output capture carry over
+                result = await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, function, *function_args)
             else:
-                return False, None, None
-        finally:
-            del sys.modules[module_name]
+                result = function(*function_args)
+            return True, result, None
+        else:
+            return False, None, None
     except Exception as e:
         if isinstance(e, AthenaException):
             raise
         return False, None, e
-    finally:
-        sys.path.pop(0)
 
 def try_get_function(module, function_name, num_args):
-    for name, value in inspect.getmembers(module):
-        if inspect.isfunction(value) and name == function_name:
-            arg_spec = inspect.getfullargspec(value)
-            if len(arg_spec.args) != num_args:
-                continue
-            return True, value
+    value = getattr(module, function_name, None)
+    if inspect.isfunction(value) and value.__code__.co_argcount == num_args:
+        return True, value
     return False, lambda: None
@@ -0,0 +1,205 @@
+from __future__ import annotations
+from collections.abc import Coroutine
+from concurrent.futures import Future
+import asyncio, threading
+from typing import Any, TypeVar
+
+import aiohttp
+import requests
+
+from .exceptions import AthenaException
+from .resource import try_extract_value_from_resource
+from .telemetry import PoolStats, TelemetryHTTPAdapter, create_trace_config
+from .trace import LinkedRequest, LinkedResponse
+
+class PoolOptions:
+    """Connection pool settings. Any setting that is left as `None` will fall back to the
+    environment settings, and then to the defaults.
+
+    Attributes:
+        limit (int | None): Maximum number of open connections. Defaults to 100.
+        limit_per_host (int | None): Maximum number of open connections to a single host. Defaults to `limit`.
+        keepalive_timeout (float | None): Seconds an idle connection is kept open for reuse. Defaults to 15.
+        dns_ttl (float | None): Seconds a resolved host name is cached for. Defaults to 10.
+        connect_timeout (float | None): Seconds to wait for a connection to be established.
+        read_timeout (float | None): Seconds to wait between reads of the response.
+        pool_timeout (float | None): Seconds to wait for a free connection once the pool limits are reached. Defaults to the timeout of the request.
+        transport (str | None): The stack that sends synchronous requests, either `requests` or `aiohttp`.
+            With `aiohttp`, synchronous and `async` requests share a single session, run on a background thread. Defaults to `requests`.
+    """
+    def __init__(self,
+        limit: int | None=None,
+        limit_per_host: int | None=None,
+        keepalive_timeout: float | None=None,
+        dns_ttl: float | None=None,
+        connect_timeout: float | None=None,
+        read_timeout: float | None=None,
+        transport: str | None=None,
+        pool_timeout: float | None=None
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.transport = transport
+        self.pool_timeout = pool_timeout
+
+    def _key(self) -> tuple:
+        return tuple(self.__dict__.values())
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, PoolOptions) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def merge(self, other: PoolOptions | None) -> PoolOptions:
+        """Create a copy of these options, with any settings from `other` taking precedence.
+
+        Args:
+            other (PoolOptions | None): The options to apply on top of these ones.
+
+        Returns:
+            PoolOptions: The merged options.
+        """
+        merged = PoolOptions(**self.__dict__)
+        if other is not None:
+            for k, v in other.__dict__.items():
+                if v is not None:
+                    merged.__dict__[k] = v
+        return merged
+
+POOL_OPTIONS = list(PoolOptions().__dict__.keys())
+TRANSPORTS = ['requests', 'aiohttp']
+
+def load_pool_options(resource: Any, environment: str | None) -> PoolOptions:
+    # the `pool` section of the .athena file has the same layout as the resource files, `option.environment: value`
+    if resource is None:
+        return PoolOptions()
+    if not isinstance(resource, dict):
+        raise AthenaException("expected `pool` settings in .athena to be of type `Dict`")
+    options = PoolOptions()
+    for name, value_set in resource.items():
+        if name not in POOL_OPTIONS:
+            raise AthenaException(f"unknown pool setting `{name}` in .athena, expected one of {', '.join(POOL_OPTIONS)}")
+        if not isinstance(value_set, dict):
+            raise AthenaException(f"expected pool setting `{name}` in .athena to be of type `Dict`")
+        success, value = try_extract_value_from_resource(resource, name, environment)
+        if success and value is not None:
+            if name == 'transport':
+                if value not in TRANSPORTS:
+                    raise AthenaException(f"expected pool setting `{name}` in .athena to be one of {', '.join(TRANSPORTS)}, but found `{value}`")
+            elif name in ['limit', 'limit_per_host']:
+                if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                    raise AthenaException(f"expected pool setting `{name}` in .athena to be a positive integer, but found `{value}`")
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise AthenaException(f"expected pool setting `{name}` in .athena to be a non-negative number, but found `{value}`")
+            options.__dict__[name] = value
+    return options
+
+T = TypeVar('T')
+
+class ConnectionPool:
+    def __init__(self, options: PoolOptions, stats: PoolStats):
+        self.options = options
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._adapter: TelemetryHTTPAdapter | None = None
+        self._session: requests.Session | None = None
+        self._async_session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: threading.Thread | None = None
+
+        if self.transport not in TRANSPORTS:
+            raise AthenaException(f"expected pool transport to be one of {', '.join(TRANSPORTS)}, but found `{self.transport}`")
+
+    @property
+    def limit(self) -> int:
+        return self.options.limit if self.options.limit is not None else 100
+
+    @property
+    def limit_per_host(self) -> int:
+        return self.options.limit_per_host if self.options.limit_per_host is not None else self.limit
+
+    @property
+    def transport(self) -> str:
+        return self.options.transport if self.options.transport is not None else 'requests'
+
+    # the sessions are only created once they are used. the async session has to be created
+    # on the event loop, and a module that only sends synchronous requests never needs it.
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                # urllib3 has no overall limit, so each host is allowed up to the per host limit. it also
+                # has no idle timeout or dns cache, so those only apply to the async session. threads that
+                # find the pool for a host exhausted wait for a connection, instead of opening one that is
+                # thrown away when it is returned to the full pool.
+                self._adapter = TelemetryHTTPAdapter(self.stats, pool_maxsize=self.limit_per_host, pool_block=True)
+                session = requests.Session()
+                session.mount('http://', self._adapter)
+                session.mount('https://', self._adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def async_session(self) -> aiohttp.ClientSession:
+        with self._lock:
+            if self._async_session is None:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host if self.limit_per_host < self.limit else 0,
+                    keepalive_timeout=self.options.keepalive_timeout if self.options.keepalive_timeout is not None else 15,
+                    ttl_dns_cache=int(self.options.dns_ttl) if self.options.dns_ttl is not None else 10,
+                    use_dns_cache=self.options.dns_ttl != 0)
+                self._async_session = aiohttp.ClientSession(connector=connector, request_class=LinkedRequest, response_class=LinkedResponse,
+                    trace_configs=[create_trace_config(self.stats)])
+            return self._async_session
+
+    # with the aiohttp transport, the async session lives on a loop of its own. synchronous requests
+    # can wait on it from any thread, including the main loop, and async requests hop over to it.
+    def run_in_loop(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=loop.run_forever, name='athena-pool', daemon=True)
+                self._loop_thread.start()
+                self._loop = loop
+            return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def requests_timeout(self, total: float) -> float | tuple[float, float]:
+        if self.options.connect_timeout is None and self.options.read_timeout is None:
+            return total
+        return (self.options.connect_timeout or total, self.options.read_timeout or total)
+
+    def requests_pool_timeout(self, total: float) -> float:
+        return self.options.pool_timeout if self.options.pool_timeout is not None else total
+
+    def aiohttp_timeout(self, total: float) -> aiohttp.ClientTimeout:
+        # aiohttp's connect timeout covers waiting for a free connection, as well as connecting
+        connect = self.options.pool_timeout + (self.options.connect_timeout or 0) if self.options.pool_timeout is not None else None
+        return aiohttp.ClientTimeout(total=total, connect=connect, sock_connect=self.options.connect_timeout, sock_read=self.options.read_timeout)
+
+    def idle(self) -> int:
+        idle = 0
+        if self._adapter is not None:
+            idle += self._adapter.idle()
+        if self._async_session is not None:
+            # aiohttp doesn't expose its idle connections, these have been kept in `_conns` since 3.0
+            idle += sum([len(conns) for conns in getattr(self._async_session.connector, '_conns', {}).values()])
+        return idle
+
+    async def close(self):
+        if self._loop is not None:
+            if self._async_session is not None:
+                await asyncio.wrap_future(self.run_in_loop(self._async_session.close()))
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            assert self._loop_thread is not None
+            await asyncio.get_running_loop().run_in_executor(None, self._loop_thread.join)
+            self._loop.close()
+        elif self._async_session is not None:
+            await self._async_session.close()
+        if self._session is not None:
+            self._session.close()
@@ -1,44 +1,22 @@
 from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from time import time
-import uuid
+from urllib.parse import urlencode
+import contextvars, copy, json, uuid
 
 from .exceptions import AthenaException
-import requests
-import aiohttp, asyncio, io
-from aiohttp.abc import AbstractStreamWriter
-from typing import Any, Callable
+from . import humanize
+import requests, urllib3
+import aiohttp, asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
 from .trace import AthenaTrace, ResponseTrace, AioHttpRequestContainer, LinkedResponse
+from .body import CHUNK_SIZE, DEFAULT_SPILL_THRESHOLD, Body
+from .upload import FileUpload, MultipartUpload, StreamUpload, Upload
+from .pool import ConnectionPool
+from . import telemetry
+from .telemetry import RequestTelemetry
 
-class BasicStringWriter(AbstractStreamWriter):
-    def __init__(self):
-        self._buffer = io.BytesIO()
-
-    async def write(self, chunk: bytes) -> None:
-        self._buffer.write(chunk)
-
-    async def write_eof(self, chunk: bytes = b"") -> None:
-        self._buffer.write(chunk)
-
-    async def drain(self) -> None:
-        pass
-
-    def enable_compression(self, encoding: str = "deflate") -> None:
-        """Enable HTTP body compression"""
-        pass
-
-    def enable_chunking(self) -> None:
-        """Enable HTTP chunked mode"""
-        pass
-
-    async def write_headers(
-        self, status_line: str, headers
-    ) -> None:
-        pass
-
-    def decode(self):
-        return self._buffer.getvalue().decode()
-
-
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class AthenaRequest:
     def __init__(self):
@@ -48,17 +26,45 @@ class AthenaRequest:
         self.url: str = ""
         self.method: str = ""
         self.files: Any = None
-        self.data: dict[str, Any] | None = None
+        self.data: dict[str, Any] | bytes | Upload | None = None
         self.json: dict | list | str | None = None
         self.params: list[tuple[str, str]] = []
         self.cookies: Any = None
         self.verify_ssl: bool = True
         self.allow_redirects: bool = True
         self.timeout: float = 30
+        self.stream_response: bool = False
+        self.spill_threshold: int = DEFAULT_SPILL_THRESHOLD
+        self.json_encoder: Callable[[Any], bytes | str] = json.dumps
 
         self._before_hooks: list[Callable[[AthenaRequest], None]] = []
         self._after_hooks: list[Callable[[ResponseTrace], None]] = []
 
+    def _set_default_content_type(self, content_type: str):
+        if not any([k.lower() == 'content-type' for k in self.headers]):
+            self.headers['Content-Type'] = content_type
+
+    def _encode_body(self) -> None:
+        # the body is encoded once, and the same bytes are handed to the transport and kept for the trace
+        if self.json is not None and self.data is None:
+            content = self.json_encoder(self.json)
+            self.data = content.encode('utf-8') if isinstance(content, str) else content
+            self.json = None
+            self._set_default_content_type('application/json')
+        elif isinstance(self.data, dict):
+            fields = []
+            for k, v in self.data.items():
+                for value in (v if isinstance(v, list) else [v]):
+                    if value is not None:
+                        fields.append((k, value))
+            self.data = urlencode(fields).encode('utf-8')
+            self._set_default_content_type('application/x-www-form-urlencoded')
+
+    def _summarize_upload(self) -> Body | None:
+        if isinstance(self.data, Upload):
+            return self.data.summarize()
+        return None
+
     def _run_before_hooks(self) -> None:
         for hook in self._before_hooks:
             hook(self)
@@ -67,6 +73,8 @@ class AthenaRequest:
             hook(trace)
 
     def _to_requests_request(self, session: requests.Session) -> requests.PreparedRequest:
+        if isinstance(self.data, StreamUpload) and self.data.is_async:
+            raise AthenaException("an async iterable body can only be sent with an async request, or with the aiohttp transport")
         return session.prepare_request(requests.Request(
             method=self.method.upper(),
             url=f"{self.base_url}{self.url}",
@@ -80,8 +88,12 @@ class AthenaRequest:
         ))
 
     def _to_aiohttp_request(self) -> AioHttpRequestContainer:
+        headers = self.headers
+        # aiohttp can't tell the size of an async iterable, and would chunk it otherwise
+        if isinstance(self.data, Upload) and self.data.size is not None:
+            headers = { **headers, 'Content-Length': str(self.data.size) }
         kwargs = {
-            'headers': self.headers,
+            'headers': headers,
             'data': self.data,
             'json': self.json,
             'params': self.params,
@@ -139,6 +151,12 @@ class HookStepFactory:
         self._add_build_step(add_hook)
         return self._parent
 
+def _get_multipart(rq: AthenaRequest) -> MultipartUpload:
+    if not isinstance(rq.data, MultipartUpload):
+        rq.data = MultipartUpload()
+    rq.headers["Content-Type"] = rq.data.content_type
+    return rq.data
+
 class BodyStepFactory:
     """Factory for adding a payload to the request."""
     def __init__(self,
@@ -167,6 +185,100 @@ class BodyStepFactory:
         self._add_build_step(add_data)
         return self._parent
 
+    def binary(self, payload: bytes, content_type: str="application/octet-stream") -> RequestBuilder:
+        """Set a raw binary payload, such as an image or a serialized protobuf message.
+
+        Args:
+            payload (bytes): body of the request
+            content_type (str): value of the `Content-Type` header (default `application/octet-stream`)
+        """
+        def add_data(rq: AthenaRequest):
+            rq.data = payload
+            rq.headers["Content-Type"] = content_type
+            return rq
+        self._add_build_step(add_data)
+        return self._parent
+
+    def file(self, path: str, content_type: str | None=None) -> RequestBuilder:
+        """Stream the payload from a file, without reading it into memory. The trace only keeps
+        the size, hash and a preview of the payload.
+
+        Args:
+            path (str): path of the file to upload
+            content_type (str | None): value of the `Content-Type` header, guessed from the file name if not provided
+
+        """
+        def add_data(rq: AthenaRequest):
+            upload = FileUpload(path, content_type)
+            rq.data = upload
+            rq.headers["Content-Type"] = upload.content_type
+            return rq
+        self._add_build_step(add_data)
+        return self._parent
+
+    def stream(self, chunks: Iterable[bytes] | AsyncIterable[bytes], content_type: str="application/octet-stream") -> RequestBuilder:
+        """Stream the payload from an iterable of chunks, using chunked transfer encoding. The trace
+        only keeps the size, hash and a preview of the payload. Async iterables can only be sent with
+        the `async` methods, or with the `aiohttp` transport.
+
+        Args:
+            chunks (Iterable[bytes] | AsyncIterable[bytes]): chunks of the payload
+            content_type (str): value of the `Content-Type` header (default `application/octet-stream`)
+
+        Example:
+
+            ```python
+            async def generate():
+                for i in range(1000):
+                    yield f"{i}\n".encode()
+
+            await client.post_async('/import', lambda r: r.body.stream(generate(), 'text/plain'))
+            ```
+        """
+        def add_data(rq: AthenaRequest):
+            rq.data = StreamUpload(chunks, content_type)
+            rq.headers["Content-Type"] = content_type
+            return rq
+        self._add_build_step(add_data)
+        return self._parent
+
+    def multipart_field(self, name: str, value: str | int | float | bool) -> RequestBuilder:
+        """Add a field to the multipart form payload.
+
+        Args:
+            name (str): name of the field
+            value (str | int | float | bool): value of the field
+        """
+        def add_data(rq: AthenaRequest):
+            _get_multipart(rq).add_field(name, str(value))
+            return rq
+        self._add_build_step(add_data)
+        return self._parent
+
+    def multipart_file(self, name: str, path: str, filename: str | None=None, content_type: str | None=None) -> RequestBuilder:
+        """Add a file to the multipart form payload. The file is streamed from disk while the request
+        is sent, and the trace only keeps the size, hash and a preview of the payload.
+
+        Args:
+            name (str): name of the field
+            path (str): path of the file to upload
+            filename (str | None): file name sent with the part, defaults to the name of the file
+            content_type (str | None): content type of the part, guessed from the file name if not provided
+
+        Example:
+
+            ```python
+            client.post('/documents', lambda r: r
+                .body.multipart_field('title', 'report')
+                .body.multipart_file('document', 'report.pdf'))
+            ```
+        """
+        def add_data(rq: AthenaRequest):
+            _get_multipart(rq).add_file(name, path, filename, content_type)
+            return rq
+        self._add_build_step(add_data)
+        return self._parent
+
     def form_append(self, form_key: str, form_value: str | int | float | bool | list[str | int | float | bool]) -> RequestBuilder:
         """Set a value in the form payload, without overwriting the existing form payload.
 
@@ -175,7 +287,7 @@ class BodyStepFactory:
             form_value (str | int | float | bool | list[str | int | float | bool]): value to append to form
         """
         def add_data(rq: AthenaRequest):
-            if rq.data is None:
+            if rq.data is None or isinstance(rq.data, (bytes, Upload)):
                 rq.data = {}
             if form_key not in rq.data:
                 rq.data[form_key] = []
@@ -241,6 +353,42 @@ class RequestBuilder:
         return self
 
 
+    def stream_response(self, spill_threshold: int=DEFAULT_SPILL_THRESHOLD) -> RequestBuilder:
+        """Read the response body in chunks, instead of all at once. Bodies larger than the threshold are
+        written to a temporary file, and the response trace will hold a `Body` instead of the full text.
+
+        Args:
+            spill_threshold (int): size in bytes above which the body is written to disk (default 8MiB)
+        """
+        def set_stream_response(rq: AthenaRequest):
+            rq.stream_response = True
+            rq.spill_threshold = spill_threshold
+            return rq
+        self._build_steps.append(set_stream_response)
+        return self
+
+    def json_encoder(self, encoder: Callable[[Any], bytes | str]) -> RequestBuilder:
+        """Set the function used to encode the json payload. The payload is encoded once, and the
+        same bytes are sent and kept in the trace. Defaults to `json.dumps`.
+
+        Args:
+            encoder (Callable[[Any], bytes | str]): function that encodes a payload to json
+
+        Example:
+
+            ```python
+            import orjson
+
+            client = athena.client(lambda r: r.json_encoder(orjson.dumps))
+            client.post('/items', lambda r: r.body.json(items))
+            ```
+        """
+        def set_json_encoder(rq: AthenaRequest):
+            rq.json_encoder = encoder
+            return rq
+        self._build_steps.append(set_json_encoder)
+        return self
+
     def header(self, header_key, header_value) -> RequestBuilder:
         """Add a header to the request.
 
@@ -283,6 +431,35 @@ class RequestBuilder:
             request = step(request)
         return request
 
+RequestSpec = tuple[str, str] | tuple[str, str, Callable[[RequestBuilder], RequestBuilder] | None]
+
+def _unpack_request_spec(spec: RequestSpec) -> tuple[str, str, Callable[[RequestBuilder], RequestBuilder] | None]:
+    if not isinstance(spec, tuple) or len(spec) not in [2, 3]:
+        raise AthenaException(f"expected request to be a tuple of (method, url) or (method, url, build_request), but found `{spec}`")
+    if len(spec) == 2:
+        return spec[0], spec[1], None
+    return spec
+
+def _validate_concurrency(concurrency: int):
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+        raise AthenaException(f"expected concurrency to be a positive integer, but found `{concurrency}`")
+
+async def _iterate_async(items: Iterable | AsyncIterable) -> AsyncIterator:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+def _is_event_loop_running() -> bool:
+    # sync modules and fixtures are run on an executor, so this is only true for sync requests made from a coroutine
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
 class Client:
     """Client class for making http requests
 
@@ -291,8 +468,7 @@ class Client:
     """
     def __init__(
             self,
-            session: requests.Session,
-            async_session: aiohttp.ClientSession,
+            pool: ConnectionPool,
             partial_request_builder: Callable[[RequestBuilder], RequestBuilder] | None=None,
             name=None,
             pre_hook: Callable[[str], None] | None=None,
@@ -303,12 +479,17 @@ class Client:
             self.__base_request_apply = partial_request_builder(RequestBuilder()).compile()
         else:
             self.__base_request_apply = lambda rq: rq
-        self.__session = session
-        self.__async_session = async_session
+        self.__pool = pool
         self.name = name or ""
         self.__pre_hook = pre_hook or (lambda _: None)
         self.__post_hook = post_hook or (lambda _: None)
-        self.__async_lock = asyncio.Lock()
+
+    def _bind(self, pre_hook: Callable[[str], None], post_hook: Callable[[AthenaTrace], None]) -> Client:
+        # a copy that shares the pool and base request, but traces into another module
+        client = copy.copy(self)
+        client.__pre_hook = pre_hook
+        client.__post_hook = post_hook
+        return client
 
     def _generate_trace_id(self):
         return str(uuid.uuid4())
@@ -334,21 +515,18 @@ class Client:
             athena_request = build_request(RequestBuilder()).apply(athena_request)
 
         athena_request._run_before_hooks()
+        athena_request._encode_body()
         self.__pre_hook(trace_id)
-        request = athena_request._to_requests_request(self.__session)
 
-        start = time()
-        response = self.__session.send(request, allow_redirects=athena_request.allow_redirects, timeout=athena_request.timeout, verify=athena_request.verify_ssl)
-        end = time()
+        if self.__pool.transport == 'aiohttp':
+            trace = self.__pool.run_in_loop(self.__send_aiohttp(trace_id, athena_request)).result()
+        else:
+            trace = self.__send_requests(trace_id, athena_request)
 
-        trace_name = ""
-        if self.name is not None and len(self.name) > 0:
-            trace_name += self.name + "+"
-        trace_name += athena_request.url
-        trace = AthenaTrace(trace_id, trace_name, response.request, response, start, end)
-        
         if(athena_request.verify_ssl == False):
             trace.warnings.append("request was executed with ssl verification disabled")
+        if _is_event_loop_running():
+            trace.warnings.append(f"synchronous request blocked the event loop for {humanize.delta(trace.end - trace.start)}, use `send_async` in async code")
 
         self.__post_hook(trace)
         athena_request._run_after_hooks(trace.response)
@@ -376,38 +554,205 @@ class Client:
             athena_request = build_request(RequestBuilder()).apply(athena_request)
 
         athena_request._run_before_hooks()
-        async with self.__async_lock:
-            self.__pre_hook(trace_id)
-        request = athena_request._to_aiohttp_request()
+        athena_request._encode_body()
+        # the hooks don't await, so they can't interleave on the event loop, and are thread safe on their own
+        self.__pre_hook(trace_id)
+
+        if self.__pool.transport == 'aiohttp':
+            trace = await asyncio.wrap_future(self.__pool.run_in_loop(self.__send_aiohttp(trace_id, athena_request)))
+        else:
+            trace = await self.__send_aiohttp(trace_id, athena_request)
+
+        if(athena_request.verify_ssl == False):
+            trace.warnings.append("request was executed with ssl verification disabled")
+
+        self.__post_hook(trace)
+        athena_request._run_after_hooks(trace.response)
+        return trace.response
 
-        trace = None
-        timeout = aiohttp.ClientTimeout(total=athena_request.timeout)
+    def __get_trace_name(self, athena_request: AthenaRequest) -> str:
+        trace_name = ""
+        if self.name is not None and len(self.name) > 0:
+            trace_name += self.name + "+"
+        trace_name += athena_request.url
+        return trace_name
+
+    def __send_requests(self, trace_id: str, athena_request: AthenaRequest) -> AthenaTrace:
+        session = self.__pool.session
+        request = athena_request._to_requests_request(session)
+
+        body = None
+        start = time()
+        with telemetry.record(RequestTelemetry()) as request_telemetry:
+            request_telemetry.pool_timeout = self.__pool.requests_pool_timeout(athena_request.timeout)
+            response = session.send(request, allow_redirects=athena_request.allow_redirects, timeout=self.__pool.requests_timeout(athena_request.timeout), verify=athena_request.verify_ssl,
+                stream=athena_request.stream_response)
+            if athena_request.stream_response:
+                body = Body(athena_request.spill_threshold, response.encoding, response.headers.get('Content-Type'))
+                with response:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        body._write(chunk)
+                body._finish()
+            request_telemetry.body_received()
+        end = time()
 
+        return AthenaTrace(trace_id, self.__get_trace_name(athena_request), response.request, response, start, end,
+            connection=request_telemetry.connection(), timings=request_telemetry.timings(), request_body=athena_request._summarize_upload(), response_body=body)
+
+    async def __send_aiohttp(self, trace_id: str, athena_request: AthenaRequest) -> AthenaTrace:
+        request = athena_request._to_aiohttp_request()
+        timeout = self.__pool.aiohttp_timeout(athena_request.timeout)
+
+        request_telemetry = RequestTelemetry()
         start = time()
-        async with self.__async_session.request(request.method, request.url, timeout=timeout, **request.kwargs) as response:
+        async with self.__pool.async_session.request(request.method, request.url, timeout=timeout, trace_request_ctx=request_telemetry, **request.kwargs) as response:
+            # read the body before stopping the clock, the same as a synchronous request
+            response_content, body = None, None
+            if athena_request.stream_response:
+                body = Body(athena_request.spill_threshold, response.charset, response.headers.get('Content-Type'))
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    body._write(chunk)
+                body._finish()
+            else:
+                response_content = await response.read()
+            request_telemetry.body_received()
             end = time()
-            trace_name = ""
-            if self.name is not None and len(self.name) > 0:
-                trace_name += self.name + "+"
-            trace_name += athena_request.url
             assert isinstance(response, LinkedResponse)
             request = response.athena_get_request()
             assert request is not None
-            if isinstance(request.body, aiohttp.BytesPayload):
-                writer = BasicStringWriter()
-                await request.body.write(writer)
-                request_text = writer.decode()
-                trace = AthenaTrace(trace_id, trace_name, request, response, start, end, request_text=request_text, response_text=await response.text())
-            else:
-                trace = AthenaTrace(trace_id, trace_name, request, response, start, end, response_text=await response.text())
+            if response.athena_connection_protocol is not None:
+                request_telemetry.connection_id = telemetry.connection_id(response.athena_connection_protocol)
+            request_content = None
+            if isinstance(athena_request.data, bytes):
+                # a redirect may have dropped the body
+                request_content = athena_request.data if isinstance(request.body, aiohttp.Payload) and request.body.size else b''
+            return AthenaTrace(trace_id, self.__get_trace_name(athena_request), request, response, start, end, request_content=request_content, response_content=response_content,
+                connection=request_telemetry.connection(), timings=request_telemetry.timings(), request_body=athena_request._summarize_upload(), response_body=body)
+
+    def send_many(self, specs: Iterable[RequestSpec], concurrency: int=10, ordered: bool=False) -> Iterator[ResponseTrace]:
+        """
+        Sends synchronous HTTP requests from a pool of worker threads. Requests are only taken
+        from `specs` as workers become free, so it may be a generator of any length.
 
-        if(athena_request.verify_ssl == False):
-            trace.warnings.append("request was executed with ssl verification disabled")
+        Args:
+            specs (Iterable[tuple]): The requests to send, as tuples of `(method, url)` or `(method, url, build_request)`.
+            concurrency (int, optional): Maximum number of requests in flight at once. Defaults to 10.
+            ordered (bool, optional): Yield the responses in the same order as the requests, rather than
+                as they complete. Defaults to False.
 
-        async with self.__async_lock:
-            self.__post_hook(trace)
-        athena_request._run_after_hooks(trace.response)
-        return trace.response
+        Returns:
+            Iterator[ResponseTrace]: The response traces, yielded as the requests complete.
+
+        Example:
+
+            ```python
+            client = athena.client()
+            for response in client.send_many((('get', f'https://example.com/users/{i}') for i in range(5000)), concurrency=50):
+                assert response.status_code == 200
+            ```
+        """
+        _validate_concurrency(concurrency)
+        iterator = iter(specs)
+        exhausted = False
+        pending: set[Future] = set()
+        completed: dict[int, ResponseTrace] = {}
+        count = 0
+        next_index = 0
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        def send(index: int, spec: RequestSpec) -> tuple[int, ResponseTrace]:
+            return index, self.send(*_unpack_request_spec(spec))
+
+        try:
+            while True:
+                # responses held back for ordering count towards the limit, so they can't build up without bound
+                while not exhausted and len(pending) + len(completed) < concurrency:
+                    try:
+                        spec = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    # each thread runs in a copy of the caller's context, see `Athena.parallel_map`
+                    pending.add(executor.submit(contextvars.copy_context().run, send, count, spec))
+                    count += 1
+                if len(pending) == 0:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, response = future.result()
+                    if ordered:
+                        completed[index] = response
+                    else:
+                        yield response
+                while next_index in completed:
+                    yield completed.pop(next_index)
+                    next_index += 1
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def send_many_async(self, specs: Iterable[RequestSpec] | AsyncIterable[RequestSpec], concurrency: int=10, ordered: bool=False) -> AsyncIterator[ResponseTrace]:
+        """
+        Sends asynchronous HTTP requests from a pool of workers. Requests are only taken
+        from `specs` as workers become free, so it may be a generator of any length.
+
+        Args:
+            specs (Iterable[tuple] | AsyncIterable[tuple]): The requests to send, as tuples of `(method, url)` or `(method, url, build_request)`.
+            concurrency (int, optional): Maximum number of requests in flight at once. Defaults to 10.
+            ordered (bool, optional): Yield the responses in the same order as the requests, rather than
+                as they complete. Defaults to False.
+
+        Returns:
+            AsyncIterator[ResponseTrace]: The response traces, yielded as the requests complete.
+
+        Example:
+
+            ```python
+            client = athena.client()
+            async for response in client.send_many_async((('get', f'https://example.com/users/{i}') for i in range(5000)), concurrency=50):
+                assert response.status_code == 200
+            ```
+        """
+        _validate_concurrency(concurrency)
+        iterator = _iterate_async(specs).__aiter__()
+        exhausted = False
+        pending: set[asyncio.Task] = set()
+        completed: dict[int, ResponseTrace] = {}
+        count = 0
+        next_index = 0
+
+        async def send(index: int, spec: RequestSpec) -> tuple[int, ResponseTrace]:
+            return index, await self.send_async(*_unpack_request_spec(spec))
+
+        try:
+            while True:
+                # responses held back for ordering count towards the limit, so they can't build up without bound
+                while not exhausted and len(pending) + len(completed) < concurrency:
+                    try:
+                        spec = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.create_task(send(count, spec)))
+                    count += 1
+                if len(pending) == 0:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, response = task.result()
+                    if ordered:
+                        completed[index] = response
+                    else:
+                        yield response
+                while next_index in completed:
+                    yield completed.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                await asyncio.gather(*pending, return_exceptions=True)
 
     def get(self, url, build_request: Callable[[RequestBuilder], RequestBuilder] | None=None) -> ResponseTrace:
         """
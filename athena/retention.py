@@ -0,0 +1,136 @@
+from __future__ import annotations
+from typing import Any
+
+from .athena_json import serializeable
+from .exceptions import AthenaException
+from .resource import try_extract_value_from_resource
+from .trace import AthenaTrace
+
+class RetentionPolicy:
+    """Decides which traces are kept in the history of a module. Traces that match `failures` or `slow`
+    are always kept. The rest are kept one in every `sample`, or all kept if neither `failures` nor `slow`
+    is set. Any setting that is left as `None` will fall back to the environment settings, and then to
+    keeping every trace.
+
+    Attributes:
+        keep_last (int | None): Only keep this many of the most recently completed traces.
+        failures (bool | None): Keep the traces of requests that failed with a 4xx or 5xx status code.
+        slow (float | None): Keep the traces of requests that took at least this many seconds.
+        sample (int | None): Keep one in every `sample` of the traces that weren't kept otherwise.
+        metadata_only (bool | None): Drop the bodies of the traces that are kept, only keeping their size, hash and preview.
+    """
+    def __init__(self,
+        keep_last: int | None=None,
+        failures: bool | None=None,
+        slow: float | None=None,
+        sample: int | None=None,
+        metadata_only: bool | None=None
+    ):
+        self.keep_last = keep_last
+        self.failures = failures
+        self.slow = slow
+        self.sample = sample
+        self.metadata_only = metadata_only
+
+    def merge(self, other: RetentionPolicy | None) -> RetentionPolicy:
+        """Create a copy of this policy, with any settings from `other` taking precedence.
+
+        Args:
+            other (RetentionPolicy | None): The policy to apply on top of this one.
+
+        Returns:
+            RetentionPolicy: The merged policy.
+        """
+        merged = RetentionPolicy(**self.__dict__)
+        if other is not None:
+            for k, v in other.__dict__.items():
+                if v is not None:
+                    merged.__dict__[k] = v
+        return merged
+
+RETENTION_OPTIONS = list(RetentionPolicy().__dict__.keys())
+
+def load_retention_policy(resource: Any, environment: str | None) -> RetentionPolicy:
+    # the `retention` section of the .athena file has the same layout as the `pool` section, `option.environment: value`
+    if resource is None:
+        return RetentionPolicy()
+    if not isinstance(resource, dict):
+        raise AthenaException("expected `retention` settings in .athena to be of type `Dict`")
+    policy = RetentionPolicy()
+    for name, value_set in resource.items():
+        if name not in RETENTION_OPTIONS:
+            raise AthenaException(f"unknown retention setting `{name}` in .athena, expected one of {', '.join(RETENTION_OPTIONS)}")
+        if not isinstance(value_set, dict):
+            raise AthenaException(f"expected retention setting `{name}` in .athena to be of type `Dict`")
+        success, value = try_extract_value_from_resource(resource, name, environment)
+        if success and value is not None:
+            if name in ['failures', 'metadata_only']:
+                if not isinstance(value, bool):
+                    raise AthenaException(f"expected retention setting `{name}` in .athena to be a boolean, but found `{value}`")
+            elif name in ['keep_last', 'sample']:
+                if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                    raise AthenaException(f"expected retention setting `{name}` in .athena to be a positive integer, but found `{value}`")
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise AthenaException(f"expected retention setting `{name}` in .athena to be a non-negative number, but found `{value}`")
+            policy.__dict__[name] = value
+    return policy
+
+@serializeable
+class TraceCounts:
+    """Totals over every request sent by a module, including those whose traces were not retained.
+
+    Attributes:
+        requests (int): Requests that completed.
+        failures (int): Requests that failed with a 4xx or 5xx status code.
+        retained (int): Traces that are still kept in the history.
+        dropped (int): Traces that were dropped by the retention policy.
+        total_time (float): Combined duration of the requests, in seconds.
+        max_time (float): Duration of the slowest request, in seconds.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retained = 0
+        self.dropped = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+# applies a policy to traces as they complete. not thread safe, the caller holds the history lock.
+class TraceRetention:
+    def __init__(self, policy: RetentionPolicy):
+        self.policy = policy
+        self.counts = TraceCounts()
+        self._unmatched = 0
+
+    # returns the trace to keep in the history, or `None` if it is dropped
+    def retain(self, trace: AthenaTrace) -> AthenaTrace | None:
+        duration = trace.end - trace.start
+        failed = trace.response.status_code >= 400
+        self.counts.requests += 1
+        self.counts.total_time += duration
+        self.counts.max_time = max(self.counts.max_time, duration)
+        if failed:
+            self.counts.failures += 1
+
+        policy = self.policy
+        matched = (bool(policy.failures) and failed) or (policy.slow is not None and duration >= policy.slow)
+        if matched:
+            keep = True
+        elif policy.sample is not None:
+            # deterministic, so the first of every `sample` traces is kept
+            keep = self._unmatched % policy.sample == 0
+            self._unmatched += 1
+        else:
+            keep = not policy.failures and policy.slow is None
+
+        if not keep:
+            self.counts.dropped += 1
+            return None
+        self.counts.retained += 1
+        if policy.metadata_only:
+            return trace._without_bodies()
+        return trace
+
+    def evicted(self):
+        self.counts.retained -= 1
+        self.counts.dropped += 1
@@ -1,5 +1,7 @@
 from collections.abc import Coroutine
-import os, sys, logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio, contextvars, multiprocessing, os, sys, logging, threading
+import queue as queue_module
 from typing import Any, Dict, List, Callable
 
 from . import history
@@ -7,9 +9,12 @@ from . import history
 from .athena_json import jsonify, serializeable
 
 from .format import color, colors, indent, long_format_error, pretty_format_error, short_format_error
+from .telemetry import PoolSummary
+from .retention import TraceCounts
 from .trace import AthenaTrace
 from . import cache, file, module
 from .client import Athena, Context, AthenaSession
+from .request import Client
 from .exceptions import AthenaException
 from .resource import ResourceLoader
 import importlib, inspect
@@ -28,6 +33,8 @@ class SerializableExecutionTrace:
         self.filename: str | None  = None
         self.module_name: str = "None"
         self.environment: str | None = None
+        self.pool: PoolSummary | None = None
+        self.trace_counts: TraceCounts | None = None
 
     def jsonify(self):
         return jsonify(self, indent=4)
@@ -41,6 +48,8 @@ class ExecutionTrace:
         self.filename: str | None  = None
         self.module_name: str = module_name
         self.environment: str | None = None
+        self.pool: PoolSummary | None = None
+        self.trace_counts: TraceCounts | None = None
 
     def format_short(self) -> str:
         if not self.success:
@@ -75,40 +84,226 @@ class ExecutionTrace:
         output.filename = self.filename
         output.module_name = self.module_name
         output.environment = self.environment
+        output.pool = self.pool
+        output.trace_counts = self.trace_counts
         return output
 
+FIXTURE_SCOPES = ['module', 'directory', 'run']
+
+# clients send their traces to the `Athena` instance that created them, so shared clients are rebound to
+# the module using them. only clients held directly, or in dicts, lists, tuples and sets, can be found.
+def _bind_to_module(value: Any, athena_instance: Athena) -> Any:
+    if isinstance(value, Client):
+        return athena_instance._bind_client(value)
+    if isinstance(value, Athena):
+        return athena_instance
+    if isinstance(value, dict):
+        items = {k: _bind_to_module(v, athena_instance) for k, v in value.items()}
+        if any(items[k] is not v for k, v in value.items()):
+            return items
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = [_bind_to_module(v, athena_instance) for v in value]
+        if any(item is not v for item, v in zip(items, value)):
+            return type(value)(items)
+    return value
+
+# memoizes the values of fixtures that declare a `directory` or `run` scope for the length of a run
+class FixtureCache:
+    def __init__(self):
+        self._scopes: dict[str, str] = {}
+        self._values: dict[tuple[str, str], dict[str, Any]] = {}
+        # fixtures run on the executor, but a shared fixture should still only run once
+        self._lock = threading.Lock()
+        self._fixture_locks: dict[str, threading.Lock] = {}
+
+    def _get_key(self, fixture_path: str, module_path: str) -> tuple[str, str] | None:
+        match self._scopes.get(fixture_path):
+            case 'run':
+                return (fixture_path, '')
+            case 'directory':
+                return (fixture_path, os.path.dirname(module_path))
+        return None
+
+    async def try_execute_fixture_async(self, fixture_path: str, module_path: str, athena_instance: Athena, executor: Executor | None=None) -> tuple[bool, Exception | None]:
+        # fixtures are synchronous, so they are moved off the loop to keep their requests from blocking other modules
+        if executor is None:
+            return self.try_execute_fixture(fixture_path, module_path, athena_instance)
+        return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, self.try_execute_fixture, fixture_path, module_path, athena_instance)
+
+    def try_execute_fixture(self, fixture_path: str, module_path: str, athena_instance: Athena) -> tuple[bool, Exception | None]:
+        if self._scopes.get(fixture_path) == 'module':
+            return self._try_execute_fixture(fixture_path, module_path, athena_instance)
+        with self._lock:
+            fixture_lock = self._fixture_locks.setdefault(fixture_path, threading.Lock())
+        with fixture_lock:
+            return self._try_execute_fixture(fixture_path, module_path, athena_instance)
+
+    def _try_execute_fixture(self, fixture_path: str, module_path: str, athena_instance: Athena) -> tuple[bool, Exception | None]:
+        fixture = athena_instance.fixture
+        key = self._get_key(fixture_path, module_path)
+        if key is not None and key in self._values:
+            for name, value in self._values[key].items():
+                setattr(fixture, name, _bind_to_module(value, athena_instance))
+            return True, None
+
+        success, fixture_module, error = module.try_load_module(fixture_path)
+        if not success:
+            return False, error
+        scope = getattr(fixture_module, 'scope', 'module')
+        if scope not in FIXTURE_SCOPES:
+            raise AthenaException(f"invalid scope `{scope}` for fixture at {fixture_path}, expected one of {', '.join(FIXTURE_SCOPES)}")
+        self._scopes[fixture_path] = scope
+
+        existing_values = dict(fixture._fixtures)
+        success, _, error = module.try_execute_function(fixture_module, "fixture", (fixture, athena_instance))
+        if not success and error is None:
+            success, _, error = module.try_execute_function(fixture_module, "fixture", (fixture,))
+
+        key = self._get_key(fixture_path, module_path)
+        if success and key is not None:
+            self._values[key] = {k: v for k, v in fixture._fixtures.items()
+                if k not in existing_values or existing_values[k] is not v}
+        return success, error
+
 async def run_modules(
     root, 
     modules: list[str], 
     environment: str | None=None,
     module_completed_callback: Callable[[str, ExecutionTrace], None] | None=None,
-    session: AthenaSession | None = None) -> Dict[str, ExecutionTrace]:
+    session: AthenaSession | None = None,
+    jobs: int=1) -> Dict[str, ExecutionTrace]:
     if session is not None:
-        return await _run_modules(root, modules, environment, module_completed_callback, session)
+        return await _run_modules(root, modules, environment, module_completed_callback, session, jobs)
     async with AthenaSession() as session:
-        return await _run_modules(root, modules, environment, module_completed_callback, session)
+        return await _run_modules(root, modules, environment, module_completed_callback, session, jobs)
 
 async def _run_modules(
     root: str, 
     modules: list[str], 
     environment: str | None,
     module_completed_callback: Callable[[str, ExecutionTrace], None] | None,
-    session: AthenaSession) -> Dict[str, ExecutionTrace]:
-    sys.path[0] = ''
+    session: AthenaSession,
+    jobs: int) -> Dict[str, ExecutionTrace]:
     athena_cache = cache.load(root)
-    results = {}
     try:
-        for path in modules:
-            module_name = os.path.basename(path)[:-3]
-            results[path] = await _run_module(root, module_name, path, session, athena_cache, environment)
-            history.push(root, lambda: results[path].as_serializable().jsonify())
-            if module_completed_callback is not None:
-                module_completed_callback(module_name, results[path])
+        return await _execute_modules(root, modules, environment, module_completed_callback, session, jobs, athena_cache, True)
     finally:
         cache.save(root, athena_cache)
+
+async def _execute_modules(
+    root: str, 
+    modules: list[str], 
+    environment: str | None,
+    module_completed_callback: Callable[[str, ExecutionTrace], None] | None,
+    session: AthenaSession,
+    jobs: int,
+    athena_cache: cache.Cache,
+    push_history: bool) -> Dict[str, ExecutionTrace]:
+    results = {}
+    semaphore = asyncio.Semaphore(jobs)
+    # sync modules and fixtures are run off the loop, since other modules or project roots may be sharing it
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    fixture_cache = FixtureCache()
+
+    async def run_and_report(path: str):
+        module_name = os.path.basename(path)[:-3]
+        async with semaphore:
+            result = await _run_module(root, module_name, path, session, athena_cache, fixture_cache, environment, executor)
+        results[path] = result
+        if push_history:
+            history.push(root, lambda: result.as_serializable().jsonify())
+        if module_completed_callback is not None:
+            module_completed_callback(module_name, result)
+
+    tasks = [asyncio.create_task(run_and_report(path)) for path in modules]
+    try:
+        await asyncio.gather(*tasks)
+    except:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        executor.shutdown()
     return results
 
-async def _run_module(module_root, module_name, module_path, athena_session: AthenaSession, athena_cache: cache.Cache, environment=None) -> ExecutionTrace:
+def run_modules_in_workers(
+    root: str,
+    modules: list[str],
+    environment: str | None,
+    module_completed_callback: Callable[[str, str], None] | None,
+    workers: int,
+    jobs: int=1):
+    # results are streamed back to the parent as they complete, the callback receives the
+    # module name and the long-formatted result. history and cache are only written by the parent.
+    modules = sorted(modules)
+    shards = [modules[i::workers] for i in range(workers)]
+    shards = [shard for shard in shards if len(shard) > 0]
+
+    # spawn instead of fork, the parent may already be holding threads (e.g. the history writer)
+    mp_context = multiprocessing.get_context('spawn')
+    queue = mp_context.Queue()
+    processes = [mp_context.Process(target=_run_worker, args=(i, root, shard, environment, jobs, queue), daemon=True)
+        for i, shard in enumerate(shards)]
+
+    athena_cache = cache.load(root)
+    errors: list[str] = []
+    pending = set(range(len(processes)))
+    try:
+        for process in processes:
+            process.start()
+
+        while len(pending) > 0:
+            try:
+                message = queue.get(timeout=0.1)
+            except queue_module.Empty:
+                for i in list(pending):
+                    if not processes[i].is_alive() and processes[i].exitcode != 0:
+                        pending.remove(i)
+                        errors.append(f"worker {i} exited unexpectedly with code {processes[i].exitcode}")
+                continue
+
+            match message:
+                case ('module', _, module_name, serialized_trace, formatted_result):
+                    history.push(root, serialized_trace)
+                    if module_completed_callback is not None:
+                        module_completed_callback(module_name, formatted_result)
+                case ('error', _, error):
+                    errors.append(error)
+                case ('done', i, initial_cache_data, cache_data):
+                    cache.merge(athena_cache, initial_cache_data, cache_data)
+                    pending.discard(i)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        cache.save(root, athena_cache)
+
+    if len(errors) > 0:
+        raise AthenaException(errors[0])
+
+def _run_worker(worker_id: int, root: str, modules: list[str], environment: str | None, jobs: int, queue):
+    athena_cache = cache.load(root)
+    initial_cache_data = dict(athena_cache.data)
+
+    def report(module_name: str, result: ExecutionTrace):
+        queue.put(('module', worker_id, module_name, result.as_serializable().jsonify(), result.format_long()))
+
+    async def inner():
+        async with AthenaSession() as session:
+            await _execute_modules(root, modules, environment, report, session, jobs, athena_cache, False)
+
+    try:
+        asyncio.run(inner())
+    except AthenaException as e:
+        queue.put(('error', worker_id, str(e)))
+    except Exception as e:
+        queue.put(('error', worker_id, short_format_error(e)))
+    finally:
+        queue.put(('done', worker_id, initial_cache_data, athena_cache.data))
+
+async def _run_module(module_root, module_name, module_path, athena_session: AthenaSession, athena_cache: cache.Cache, fixture_cache: FixtureCache, environment=None, executor: Executor | None=None) -> ExecutionTrace:
     trace = ExecutionTrace(module_name)
     trace.filename = module_path
     trace.environment = environment
@@ -119,8 +314,6 @@ async def _run_module(module_root, module_name, module_path, athena_session: Ath
     if not module_path.endswith(".py"):
         raise AthenaException(f"not a python module {module_path}")
 
-    module_dir = os.path.dirname(module_path)
-
     context = Context(
         environment,
         module_name,
@@ -133,20 +326,24 @@ async def _run_module(module_root, module_name, module_path, athena_session: Ath
         athena_session,
         athena_cache.data
     )
+    initial_cache_data = dict(athena_instance.cache._data)
 
     try:
         # load fixtures
         for fixture_path in file.search_module_half_ancestors(module_root, module_path, 'fixture.py'):
-            success, _, trace.error = module.try_execute_module(os.path.dirname(fixture_path), "fixture", "fixture", (athena_instance.fixture,))
+            success, trace.error = await fixture_cache.try_execute_fixture_async(fixture_path, module_path, athena_instance, executor)
             if not success and trace.error is not None:
                 trace.athena_traces = athena_instance.traces()
                 return trace
 
         # execute module
-        trace.success, trace.result, trace.error = await module.try_execute_module_async(module_dir, module_name, "run", (athena_instance,))
+        trace.success, trace.result, trace.error = await module.try_execute_module_async(module_path, "run", (athena_instance,), executor)
         trace.athena_traces = athena_instance.traces()
         return trace
 
     finally:
-        athena_cache.data = athena_instance.cache._data
-
+        trace.pool = athena_session.pool_summary()
+        trace.trace_counts = athena_instance.trace_counts()
+        athena_instance._close()
+        # other modules may have written to the cache in the meantime, so only apply this module's changes
+        cache.merge(athena_cache, initial_cache_data, athena_instance.cache._data)
@@ -339,6 +339,5 @@ class ServerBuilder():
         return start_functions
 
 def execute_module(builder: ServerBuilder, module_path) -> ServerBuilder:
-    module_dir = os.path.dirname(module_path)
-    module.execute_module(module_dir, "server", "serve", (builder,))
+    module.execute_module(module_path, "serve", (builder,))
     return builder
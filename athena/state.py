@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any
 
 import os
 
@@ -6,9 +7,14 @@ from .resource import DEFAULT_ENVIRONMENT_KEY
 from .exceptions import AthenaException
 from . import file
 
+# settings that are left out of .athena while they are empty
+_OPTIONAL_SECTIONS = ['pool', 'retention']
+
 @dataclass
 class State:
     environment: str = DEFAULT_ENVIRONMENT_KEY
+    pool: dict[str, Any] = field(default_factory=dict)
+    retention: dict[str, Any] = field(default_factory=dict)
 
 def init() -> State:
     return State()
@@ -25,7 +31,8 @@ def load(root: str) -> State:
     return state
 
 def save(root: str, state: State):
-    state_yaml = file.export_yaml(state.__dict__)
+    state_dict = {k: v for k, v in state.__dict__.items() if k not in _OPTIONAL_SECTIONS or v}
+    state_yaml = file.export_yaml(state_dict)
     with open(os.path.join(root, '.athena'), 'w') as f:
         f.write(state_yaml)
     return 
@@ -0,0 +1,342 @@
+from __future__ import annotations
+from contextlib import contextmanager
+import itertools, socket, threading, time, weakref
+from types import SimpleNamespace
+from typing import Any
+
+import aiohttp
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, EmptyPoolError, NewConnectionError
+try:
+    from urllib3.exceptions import NameResolutionError
+except ImportError: # urllib3<2
+    NameResolutionError = None
+from urllib3.util.connection import allowed_gai_family
+
+from .athena_json import serializeable
+from .trace import ConnectionTrace, TimingTrace
+
+_connection_ids: weakref.WeakKeyDictionary[Any, int] = weakref.WeakKeyDictionary()
+_connection_counter = itertools.count(1)
+_connection_ids_lock = threading.Lock()
+
+def next_connection_id() -> int:
+    with _connection_ids_lock:
+        return next(_connection_counter)
+
+def connection_id(connection: Any) -> int:
+    # ids are handed out in the order connections are first seen, and stay with the connection for its lifetime
+    with _connection_ids_lock:
+        if connection not in _connection_ids:
+            _connection_ids[connection] = next(_connection_counter)
+        return _connection_ids[connection]
+
+@serializeable
+class PoolSummary:
+    """Utilization of the connection pools in a session.
+
+    Attributes:
+        active (int): Connections currently in use by a request.
+        idle (int): Open connections waiting in the pool to be reused.
+        peak (int): Most connections in use at the same time.
+        opened (int): Connections that were newly opened for a request.
+        reused (int): Requests that were sent on an already open connection.
+    """
+    def __init__(self, active: int, idle: int, peak: int, opened: int, reused: int):
+        self.active = active
+        self.idle = idle
+        self.peak = peak
+        self.opened = opened
+        self.reused = reused
+
+# counters shared by every pool in a session. both send paths can acquire
+# connections at the same time, from the event loop and from worker threads.
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self, reused: bool):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            if reused:
+                self.reused += 1
+            else:
+                self.opened += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def summarize(self, idle: int) -> PoolSummary:
+        with self._lock:
+            return PoolSummary(self.active, idle, self.peak, self.opened, self.reused)
+
+def _add(total: float | None, duration: float) -> float:
+    return duration if total is None else total + duration
+
+# collected while a single request is in flight, by the trace config hooks
+# for aiohttp and by the instrumented connection pools for urllib3. all the
+# timestamps come from the monotonic perf_counter clock.
+class RequestTelemetry:
+    def __init__(self):
+        self.pool_wait = 0.0
+        # how long a synchronous request may wait for a free connection, requests itself has no such setting
+        self.pool_timeout: float | None = None
+        self.connection_reused: bool | None = None
+        self.connection_id: int | None = None
+        self.dns: float | None = None
+        self.connect: float | None = None
+        self.tls: float | None = None
+        self.ttfb: float | None = None
+        self.transfer: float | None = None
+        self._queued_at: float | None = None
+        self._dns_started_at: float | None = None
+        self._connect_started_at: float | None = None
+        self._connected_at: float | None = None
+        self._ready_at: float | None = None
+        self._headers_at: float | None = None
+
+    def resolved(self, started_at: float):
+        self.dns = _add(self.dns, time.perf_counter() - started_at)
+
+    def connected(self, started_at: float):
+        self._connected_at = time.perf_counter()
+        self.connect = _add(self.connect, self._connected_at - started_at)
+
+    def ready(self):
+        self._ready_at = time.perf_counter()
+
+    def headers_received(self):
+        self._headers_at = time.perf_counter()
+        if self._ready_at is not None:
+            self.ttfb = _add(self.ttfb, self._headers_at - self._ready_at)
+
+    def body_received(self):
+        if self._headers_at is not None:
+            self.transfer = time.perf_counter() - self._headers_at
+
+    def connection(self) -> ConnectionTrace | None:
+        if self.connection_reused is None:
+            return None
+        return ConnectionTrace(self.connection_id, self.connection_reused, self.pool_wait)
+
+    def timings(self) -> TimingTrace | None:
+        if self.ttfb is None:
+            return None
+        return TimingTrace(self.dns, self.connect, self.tls, self.ttfb, self.transfer)
+
+def create_trace_config(stats: PoolStats) -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+
+    def get_telemetry(context: SimpleNamespace) -> RequestTelemetry | None:
+        telemetry = context.trace_request_ctx
+        return telemetry if isinstance(telemetry, RequestTelemetry) else None
+
+    async def on_connection_queued_start(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None:
+            telemetry._queued_at = time.perf_counter()
+
+    async def on_connection_queued_end(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None and telemetry._queued_at is not None:
+            telemetry.pool_wait += time.perf_counter() - telemetry._queued_at
+            telemetry._queued_at = None
+
+    def acquire(context: SimpleNamespace, reused: bool):
+        # a redirect acquires a new connection without ending the request
+        release(context)
+        stats.acquire(reused)
+        context.acquired = True
+        telemetry = get_telemetry(context)
+        if telemetry is not None:
+            telemetry.connection_reused = reused
+            telemetry.ready()
+
+    def release(context: SimpleNamespace):
+        if getattr(context, 'acquired', False):
+            stats.release()
+            context.acquired = False
+
+    async def on_dns_resolvehost_start(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None:
+            telemetry._dns_started_at = time.perf_counter()
+    async def on_dns_resolvehost_end(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None and telemetry._dns_started_at is not None:
+            telemetry.resolved(telemetry._dns_started_at)
+            # aiohttp resolves the host while creating the connection, so that time isn't part of connecting
+            if telemetry._connect_started_at is not None:
+                telemetry._connect_started_at = time.perf_counter()
+            telemetry._dns_started_at = None
+
+    async def on_connection_create_start(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None:
+            telemetry._connect_started_at = time.perf_counter()
+    async def on_connection_create_end(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None and telemetry._connect_started_at is not None:
+            telemetry.connected(telemetry._connect_started_at)
+            telemetry._connect_started_at = None
+        acquire(context, False)
+    async def on_connection_reuseconn(_, context: SimpleNamespace, __):
+        acquire(context, True)
+
+    async def on_request_end(_, context: SimpleNamespace, __):
+        telemetry = get_telemetry(context)
+        if telemetry is not None:
+            telemetry.headers_received()
+        release(context)
+    async def on_request_failed(_, context: SimpleNamespace, __):
+        release(context)
+
+    trace_config.on_connection_queued_start.append(on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(on_connection_queued_end)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_failed)
+    trace_config.on_request_redirect.append(on_request_end)
+    return trace_config
+
+_current = threading.local()
+
+@contextmanager
+def record(telemetry: RequestTelemetry):
+    # urllib3 gives no way to pass context through a request, but the whole request happens on the calling thread
+    _current.telemetry = telemetry
+    try:
+        yield telemetry
+    finally:
+        _current.telemetry = None
+
+def _get_current() -> RequestTelemetry | None:
+    return getattr(_current, 'telemetry', None)
+
+class _TelemetryConnectionMixin:
+    host: str
+    port: int
+    _dns_host: str
+
+    def _new_conn(self):
+        telemetry = _get_current()
+        if telemetry is None:
+            return super()._new_conn() # type: ignore
+        # the host is resolved up front to time it separately from connecting, and each
+        # address is then tried in turn, the same way urllib3 would have
+        started_at = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host.strip('[]'), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if NameResolutionError is None:
+                raise NewConnectionError(self, f"Failed to resolve '{self.host}' ({e})") from e
+            raise NameResolutionError(self.host, self, e) from e # type: ignore
+        telemetry.resolved(started_at)
+
+        started_at = time.perf_counter()
+        dns_host = self._dns_host
+        error: Exception | None = None
+        try:
+            for address in dict.fromkeys([sockaddr[0] for *_, sockaddr in addresses]):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn() # type: ignore
+                    telemetry.connected(started_at)
+                    return sock
+                except ConnectTimeoutError as e:
+                    error = e
+        finally:
+            self._dns_host = dns_host
+        assert error is not None
+        raise error
+
+    def connect(self):
+        super().connect() # type: ignore
+        telemetry = _get_current()
+        if telemetry is not None:
+            if isinstance(self, HTTPSConnection) and telemetry._connected_at is not None:
+                telemetry.tls = _add(telemetry.tls, time.perf_counter() - telemetry._connected_at)
+            telemetry.ready()
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs) # type: ignore
+        telemetry = _get_current()
+        if telemetry is not None:
+            telemetry.headers_received()
+        return response
+
+# named after the urllib3 classes, since the names show up in connection errors
+_TelemetryHTTPConnection = type('HTTPConnection', (_TelemetryConnectionMixin, HTTPConnection), {})
+_TelemetryHTTPSConnection = type('HTTPSConnection', (_TelemetryConnectionMixin, HTTPSConnection), {})
+
+class _TelemetryPoolMixin:
+    athena_stats: PoolStats
+    athena_pools: weakref.WeakSet
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.athena_pools.add(self)
+
+    def _get_conn(self, timeout=None):
+        start = time.perf_counter()
+        telemetry = _get_current()
+        if timeout is None and telemetry is not None:
+            timeout = telemetry.pool_timeout
+        try:
+            conn = super()._get_conn(timeout)
+        except EmptyPoolError:
+            raise EmptyPoolError(self, f"timed out after {timeout}s waiting for a free connection to {self.host}, all {self.pool.maxsize} connections are in use") from None # type: ignore
+        # connections are opened lazily, so a connection without a socket is a new one
+        reused = conn.sock is not None
+        # the same connection object is reopened once its socket is closed, so it gets a new id each time
+        if not reused or not hasattr(conn, 'athena_connection_id'):
+            conn.athena_connection_id = next_connection_id()
+        self.athena_stats.acquire(reused)
+        if telemetry is not None:
+            telemetry.pool_wait += time.perf_counter() - start
+            telemetry.connection_reused = reused
+            telemetry.connection_id = conn.athena_connection_id
+            # a new connection is only ready once it has connected
+            if reused:
+                telemetry.ready()
+        return conn
+
+    def _put_conn(self, conn):
+        self.athena_stats.release()
+        super()._put_conn(conn)
+
+    def athena_idle(self) -> int:
+        pool = getattr(self, 'pool', None)
+        if pool is None:
+            return 0
+        return sum([1 for conn in list(pool.queue) if conn is not None and conn.sock is not None])
+
+class TelemetryHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats: PoolStats, **kwargs):
+        # set before calling super, which builds the pool manager
+        self.athena_stats = stats
+        self.athena_pools = weakref.WeakSet()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attributes = { 'athena_stats': self.athena_stats, 'athena_pools': self.athena_pools }
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('HTTPConnectionPool', (_TelemetryPoolMixin, HTTPConnectionPool), { **attributes, 'ConnectionCls': _TelemetryHTTPConnection }),
+            'https': type('HTTPSConnectionPool', (_TelemetryPoolMixin, HTTPSConnectionPool), { **attributes, 'ConnectionCls': _TelemetryHTTPSConnection }),
+        }
+
+    def idle(self) -> int:
+        return sum([pool.athena_idle() for pool in list(self.athena_pools)])
@@ -1,9 +1,12 @@
 from datetime import timedelta
+from functools import lru_cache
 from multidict import CIMultiDict, CIMultiDictProxy
-import requests, json, aiohttp, re
+import requests, json, aiohttp, copy, sys
 from .exceptions import AthenaException
 from .athena_json import serializeable, jsonify
-from typing import Callable
+from .body import PREVIEW_SIZE, Body, is_binary
+from .json_stream import iter_json
+from typing import Any, Callable, Iterator
 
 class AioHttpRequestContainer:
     def __init__(self, method, url, kwargs):
@@ -18,6 +21,7 @@ class LinkedRequest(aiohttp.ClientRequest):
         resp = await super().send(conn)
         assert isinstance(resp, LinkedResponse)
         resp.athena_get_request = lambda: self
+        resp.athena_connection_protocol = conn.protocol
         return resp
 
 
@@ -25,8 +29,64 @@ class LinkedResponse(aiohttp.ClientResponse):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.athena_get_request: Callable[[], LinkedRequest | None] = lambda: None 
+        self.athena_connection_protocol: Any = None
 
 
+@serializeable
+class ConnectionTrace:
+    """Trace of the pooled connection a request was sent on.
+
+    Attributes:
+        id (int | None): Identifier of the connection, unique for the lifetime of the process.
+        reused (bool): Whether an already open connection was reused, rather than opening a new one.
+        pool_wait (float): Time spent waiting for a free connection in the pool, in seconds.
+    """
+    __slots__ = ('id', 'reused', 'pool_wait')
+    def __init__(self, id: int | None, reused: bool, pool_wait: float):
+        self.id = id
+        self.reused = reused
+        self.pool_wait = pool_wait
+
+@serializeable
+class TimingTrace:
+    """Durations of the phases of a request, in seconds. Phases that did not take place,
+    such as connecting when an open connection was reused, are `None`.
+
+    Attributes:
+        dns (float | None): Time spent resolving the host name.
+        connect (float | None): Time spent establishing the connection. For `async` requests this includes the TLS handshake.
+        tls (float | None): Time spent on the TLS handshake.
+        ttfb (float | None): Time from the connection being ready until the response headers were received.
+        transfer (float | None): Time spent receiving the response body.
+    """
+    __slots__ = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+    def __init__(self,
+        dns: float | None=None,
+        connect: float | None=None,
+        tls: float | None=None,
+        ttfb: float | None=None,
+        transfer: float | None=None
+    ):
+        self.dns = dns
+        self.connect = connect
+        self.tls = tls
+        self.ttfb = ttfb
+        self.transfer = transfer
+
+    def phases(self) -> list[tuple[str, float | None]]:
+        """The phases of the request, in the order they take place.
+
+        Returns:
+            list[tuple[str, float | None]]: The name and duration of each phase.
+        """
+        return [
+            ('dns', self.dns),
+            ('connect', self.connect),
+            ('tls', self.tls),
+            ('ttfb', self.ttfb),
+            ('transfer', self.transfer)
+        ]
+
 @serializeable
 class AthenaTrace:
     """Trace of a single request/response saga.
@@ -36,10 +96,14 @@ class AthenaTrace:
         name (str): The name of the trace.
         request (RequestTrace): Trace of the request.
         response (ResponseTrace): Trace of the response.
+        warnings (list[str]): Warnings raised while sending the request.
+        connection (ConnectionTrace | None): The connection the request was sent on.
+        timings (TimingTrace | None): Durations of the phases of the request.
         start (float): The start time of the request in seconds.
         end (float): The end time of the request in seconds.
-        elapsed (float): The duration of the request in seconds.
+        elapsed (str): The duration of the request.
     """
+    __slots__ = ('id', 'response', 'request', 'name', '_warnings', 'connection', 'timings', 'start', 'end', '__weakref__')
     def __init__(self,
         id: str,
         name: str,
@@ -47,28 +111,155 @@ class AthenaTrace:
         response: requests.Response | aiohttp.ClientResponse,
         start: float, 
         end: float,
-        request_text: str | None=None,
-        response_text: str | None=None,
-        warnings: list[str] | None=None
+        request_content: bytes | None=None,
+        response_content: bytes | None=None,
+        warnings: list[str] | None=None,
+        connection: ConnectionTrace | None=None,
+        timings: TimingTrace | None=None,
+        request_body: Body | None=None,
+        response_body: Body | None=None
     ):
 
         self.id = id
-        self.response = ResponseTrace(response, response_text)
-        self.request = RequestTrace(request, request_text)
+        self.response = ResponseTrace(response, response_content, response_body)
+        self.request = RequestTrace(request, request_content, request_body)
         self.name = name
-        self.warnings = warnings or []
-
+        self._warnings = warnings
+        self.connection = connection
+        self.timings = timings
 
         # timestamps are in seconds
-        self.elapsed = str(timedelta(seconds=end-start))
         self.start = start
         self.end = end
 
+    @property
+    def warnings(self) -> list[str]:
+        # most requests have no warnings, so the list is only created once it is needed
+        if self._warnings is None:
+            self._warnings = []
+        return self._warnings
+
+    @property
+    def elapsed(self) -> str:
+        return str(timedelta(seconds=self.end-self.start))
+
+    def _without_bodies(self) -> 'AthenaTrace':
+        # the module may still be reading the original response, so the bodies are dropped from a copy
+        trace = copy.copy(self)
+        trace.request = self.request._without_body()
+        trace.response = self.response._without_body()
+        trace.response._json = _UNPARSED
+        return trace
+
+    def _serialize(self) -> dict:
+        return {
+            'id': self.id,
+            'response': self.response,
+            'request': self.request,
+            'name': self.name,
+            'warnings': self._warnings or [],
+            'connection': self.connection,
+            'timings': self.timings,
+            'elapsed': self.elapsed,
+            'start': self.start,
+            'end': self.end
+        }
+
     def __str__(self):
         return jsonify(self)
 
+# header names and values repeat across most requests, so each pair is shared between traces
+@lru_cache(maxsize=4096)
+def _intern_header(name: str, value: str) -> tuple[str, str]:
+    return (sys.intern(name), sys.intern(value))
+
+# traces are created for every request, even when nobody looks at them. they only keep the
+# interned header pairs and the raw bytes of the body, and build the header dictionary and
+# decode the text once they are asked for. text bodies are serialized as `text`, while
+# binary and streamed ones are summarized by `body`.
+class _ContentTrace:
+    __slots__ = ('_header_pairs', '_headers', 'body', '_content', '_encoding', '_text', '__weakref__')
+    body: Body | None
+
+    def _set_headers(self, headers: Any):
+        pairs = []
+        for k, v in headers.items():
+            if isinstance(v, bytes):
+                v = v.decode('latin-1')
+            # multidict keys are a str subclass, which can't be interned
+            pairs.append(_intern_header(str(k), str(v)))
+        self._header_pairs = tuple(pairs)
+        self._headers: CIMultiDictProxy | None = None
+
+    def _get_header(self, name: str) -> str | None:
+        name = name.lower()
+        for k, v in self._header_pairs:
+            if k.lower() == name:
+                return v
+        return None
+
+    @property
+    def headers(self) -> CIMultiDictProxy:
+        if self._headers is None:
+            self._headers = CIMultiDictProxy(CIMultiDict(self._header_pairs))
+        return self._headers
+
+    @property
+    def content_type(self) -> str | None:
+        return self._get_header(aiohttp.hdrs.CONTENT_TYPE)
+
+    def _set_content(self, content: bytes, encoding: str | None=None):
+        self._content = content
+        self._encoding = encoding
+        self._text = None
+        self.body = None
+        if is_binary(self.content_type, memoryview(content)[:PREVIEW_SIZE]):
+            self.body = Body._wrap(content, encoding, self.content_type)
+            self._content = None
+
+    def _set_body(self, body: Body):
+        self.body = body
+        self._content = None
+        self._text = None
+
+    @property
+    def content(self) -> memoryview:
+        """The raw bytes of the body. Slicing the view does not copy the body."""
+        if self._content is None:
+            assert self.body is not None
+            return self.body.view()
+        return memoryview(self._content)
+
+    @property
+    def text(self) -> str:
+        """The body decoded as text. Streamed bodies are decoded again each time this is accessed."""
+        if self._content is None:
+            assert self.body is not None
+            return self.body.text()
+        if self._text is None:
+            self._text = str(self._content, self._encoding or 'utf-8', errors='replace')
+        return self._text
+
+    def _without_body(self):
+        trace = copy.copy(self)
+        if self.body is not None:
+            trace.body = self.body._summary()
+        elif self._content is not None:
+            trace.body = Body._summarize(self._content, self._encoding, self.content_type)
+        trace._content = None
+        trace._text = None
+        return trace
+
+    def _serialize_body(self, out: dict) -> dict:
+        out['body'] = self.body
+        if self.body is None:
+            out['text'] = self.text
+        return out
+
+_UNPARSED = object()
+
 @serializeable
-class ResponseTrace:
+class ResponseTrace(_ContentTrace):
     """Trace of the response component.
 
     Attributes:
@@ -77,48 +268,99 @@ class ResponseTrace:
         reason (str): The reason phrase of the response.
         content_type (str | None): The content type of the response.
         status_code (int): The status code of the response.
-        text (str): The text content of the response.
+        text (str): The body of the response, decoded as text when it is first accessed.
+        content (memoryview): The raw bytes of the body of the response.
+        body (Body | None): Summary of the body, if it was streamed or is binary. These bodies are
+            left out of the serialized trace, which only keeps their size, hash and preview.
 
     """
+    __slots__ = ('url', 'reason', 'status_code', '_json')
     def __init__(self,
         response: requests.Response | aiohttp.ClientResponse,
-        response_text: str | None
+        content: bytes | None,
+        body: Body | None=None
     ):
-        self.headers: CIMultiDictProxy = CIMultiDictProxy(CIMultiDict(list(response.headers.items())))
+        self._set_headers(response.headers)
         self.url = str(response.url)
         self.reason = response.reason
-        self.content_type: str | None = self.headers.get(aiohttp.hdrs.CONTENT_TYPE, None)
-        if self.content_type is not None:
-            self.content_type = self.content_type.split(";")[0]
 
         if isinstance(response, requests.Response):
             self.status_code = response.status_code
+            encoding = response.encoding
         else:
             self.status_code = response.status
+            # the charset is taken from the headers only, bodies without one are decoded as utf-8
+            encoding = response.charset
 
-        # just gonna assume for now that it's always text
-        if response_text is not None:
-            self.text = response_text
-        else:
+        self._json: Any = _UNPARSED
+        if body is not None:
+            self._set_body(body)
+            return
+
+        if content is None:
             if isinstance(response, requests.Response):
-                self.text = response.text
+                content = response.content
             else:
-                raise ValueError("response text must be provided with async response")
+                raise ValueError("response content must be provided with async response")
+        self._set_content(content, encoding)
+
+    @property
+    def content_type(self) -> str | None:
+        content_type = self._get_header(aiohttp.hdrs.CONTENT_TYPE)
+        if content_type is not None:
+            return content_type.split(";")[0]
+        return None
+
+    def _serialize(self) -> dict:
+        return self._serialize_body({
+            'headers': list(self._header_pairs),
+            'url': self.url,
+            'reason': self.reason,
+            'content_type': self.content_type,
+            'status_code': self.status_code
+        })
 
     def __str__(self):
         return jsonify(self)
 
     def json(self):
         """
-        Parses the response text as JSON and returns the result.
+        Parses the response text as JSON and returns the result. The result is cached,
+        so later calls return the same object.
 
         Returns:
             dict: The parsed JSON content of the response text.
         """
-        return json.loads(self.text)
+        if self._json is _UNPARSED:
+            self._json = json.loads(self.text)
+        return self._json
+
+    def iter_json(self, path: str="") -> Iterator[Any]:
+        """
+        Parses the items of a JSON array in the response one at a time, without parsing the
+        rest of the response. For streamed responses, the body is read incrementally.
+
+        Args:
+            path (str, optional): Dot separated keys of the objects leading to the array,
+                for example `data.items`. Defaults to the top level array.
+
+        Returns:
+            Iterator[Any]: The parsed items of the array.
+
+        Example:
+
+            ```python
+            response = client.get('/users', lambda r: r.stream_response())
+            for user in response.iter_json('data.users'):
+                assert 'id' in user
+            ```
+        """
+        if self.body is not None:
+            return iter_json(self.body.iter_text(), path)
+        return iter_json([self.text], path)
 
 @serializeable
-class RequestTrace:
+class RequestTrace(_ContentTrace):
     """Trace of the request component.
 
     Attributes:
@@ -126,39 +368,49 @@ class RequestTrace:
         url (str): The URL of the request.
         headers (dict): The headers of the request.
         content_type (str | None): The content type of the request.
-        text (str): The text content of the request.
+        text (str): The body of the request, decoded as text when it is first accessed.
+        content (memoryview): The raw bytes of the body of the request.
+        body (Body | None): Summary of the body, if it was streamed or is binary. These bodies are
+            left out of the serialized trace, which only keeps their size, hash and preview. The
+            content of streamed uploads is not kept.
 
     """
-    json_re = re.compile(r"^application/(?:[\w.+-]+?\+)?json")
+    __slots__ = ('method', 'url')
     def __init__(self, 
         request: requests.PreparedRequest | aiohttp.ClientRequest,
-        request_text: str | None=None
+        content: bytes | None=None,
+        body: Body | None=None
     ):
         self.method = request.method
         self.url = str(request.url)
-        self.headers: CIMultiDictProxy = CIMultiDictProxy(CIMultiDict(request.headers.items()))
-        self.content_type: str | None = self.headers.get(aiohttp.hdrs.CONTENT_TYPE, None)
+        self._set_headers(request.headers)
 
-        if request_text is not None:
-            self.text = request_text
-        else:
-            if self.content_type is not None \
-                and (RequestTrace.json_re.match(self.content_type) or self.content_type == "application/x-www-form-urlencoded") \
-                and isinstance(request.body, (str, bytes)):
-                if isinstance(request.body, bytes):
-                    self.text = request.body.decode('utf-8')
-                elif isinstance(request.body, str):
-                    self.text = request.body
-            elif isinstance(request.body, str):
-                self.text = request.body
-            #elif isinstance(request.body, BytesPayload) and isinstance(request, aiohttp.ClientRequest) and request.body.encoding is not None:
+        if body is not None:
+            self._set_body(body)
+            return
+
+        if content is None:
+            if isinstance(request.body, str):
+                content = request.body.encode('utf-8')
+            elif isinstance(request.body, bytes):
+                content = request.body
+            elif isinstance(request.body, (bytearray, memoryview)):
+                content = bytes(request.body)
             elif isinstance(request.body, aiohttp.Payload) and isinstance(request, aiohttp.ClientRequest) and request.body.size == 0:
-                self.text = ""
+                content = b''
             elif request.body is None:
-                self.text = ""
+                content = b''
             else:
                 raise AthenaException(f"unable to handle request body of type {type(request.body)} with content type {self.content_type}")
+        self._set_content(content)
+
+    def _serialize(self) -> dict:
+        return self._serialize_body({
+            'method': self.method,
+            'url': self.url,
+            'headers': list(self._header_pairs),
+            'content_type': self.content_type
+        })
 
     def __str__(self):
         return jsonify(self)
-
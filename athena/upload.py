@@ -0,0 +1,165 @@
+from __future__ import annotations
+import abc, asyncio, mimetypes, os, uuid
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from .body import CHUNK_SIZE, Body
+from .exceptions import AthenaException
+
+# request bodies that are streamed while the request is sent, instead of being read into memory.
+# both transports take the upload as is, requests iterates it and aiohttp iterates it asynchronously.
+# the chunks are summarized as they go by, since the body itself isn't kept for the trace.
+class Upload(abc.ABC):
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self._reset()
+
+    @property
+    def size(self) -> int | None:
+        return None
+
+    @abc.abstractmethod
+    def _chunks(self) -> Iterator[bytes]:
+        ...
+
+    async def _achunks(self) -> AsyncIterator[bytes]:
+        chunks = self._chunks()
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    # the summary is finished before the last chunk is handed over, since the response, and the trace
+    # built from it, may arrive before the transport asks for the chunk after it
+    def __iter__(self) -> Iterator[bytes]:
+        # a redirect sends the body again, so the summary starts over
+        self._reset()
+        last = None
+        for chunk in self._chunks():
+            if last is not None:
+                yield last
+            self._body._write(chunk)
+            last = chunk
+        self._finish()
+        if last is not None:
+            yield last
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self._reset()
+        last = None
+        async for chunk in self._achunks():
+            if last is not None:
+                yield last
+            self._body._write(chunk)
+            last = chunk
+        self._finish()
+        if last is not None:
+            yield last
+
+    def _reset(self):
+        self._body = Body(content_type=self.content_type, retain=False)
+        self._finished = False
+
+    def _finish(self):
+        if not self._finished:
+            self._body._finish()
+            self._finished = True
+
+    def summarize(self) -> Body:
+        # the server may have responded before the whole body was sent, in which case it covers what was sent
+        self._finish()
+        return self._body
+
+def _read_file(path: str) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+def _guess_content_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+class FileUpload(Upload):
+    def __init__(self, path: str, content_type: str | None=None):
+        if not os.path.isfile(path):
+            raise AthenaException(f"unable to upload `{path}`: file not found")
+        super().__init__(content_type or _guess_content_type(path))
+        self.path = path
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    # requests sends the body with a content length instead of chunking it, if it has one
+    def __len__(self) -> int:
+        return self.size
+
+    def _chunks(self) -> Iterator[bytes]:
+        return _read_file(self.path)
+
+class StreamUpload(Upload):
+    def __init__(self, chunks: Iterable[bytes] | AsyncIterable[bytes], content_type: str):
+        super().__init__(content_type)
+        self.chunks = chunks
+        self.is_async = isinstance(chunks, AsyncIterable)
+
+    def _chunks(self) -> Iterator[bytes]:
+        if isinstance(self.chunks, AsyncIterable):
+            raise AthenaException("an async iterable body can only be sent with an async request, or with the aiohttp transport")
+        return iter(self.chunks)
+
+    async def _achunks(self) -> AsyncIterator[bytes]:
+        if isinstance(self.chunks, AsyncIterable):
+            async for chunk in self.chunks:
+                yield chunk
+        else:
+            async for chunk in super()._achunks():
+                yield chunk
+
+def _quote(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+class MultipartUpload(Upload):
+    def __init__(self):
+        self.boundary = uuid.uuid4().hex
+        super().__init__(f"multipart/form-data; boundary={self.boundary}")
+        # each part is its headers, followed by either its value or the path of the file it is read from
+        self.parts: list[tuple[bytes, bytes | None, str | None]] = []
+
+    def add_field(self, name: str, value: str):
+        headers = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+        self.parts.append((headers.encode('utf-8'), value.encode('utf-8'), None))
+
+    def add_file(self, name: str, path: str, filename: str | None=None, content_type: str | None=None):
+        if not os.path.isfile(path):
+            raise AthenaException(f"unable to upload `{path}`: file not found")
+        filename = filename if filename is not None else os.path.basename(path)
+        content_type = content_type or _guess_content_type(path)
+        headers = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"; filename="{_quote(filename)}"\r\nContent-Type: {content_type}\r\n\r\n'
+        self.parts.append((headers.encode('utf-8'), None, path))
+
+    @property
+    def size(self) -> int:
+        size = len(self._closing())
+        for headers, value, path in self.parts:
+            size += len(headers) + 2
+            size += len(value) if value is not None else os.path.getsize(path) # type: ignore
+        return size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _closing(self) -> bytes:
+        return f'--{self.boundary}--\r\n'.encode('utf-8')
+
+    def _chunks(self) -> Iterator[bytes]:
+        for headers, value, path in self.parts:
+            yield headers
+            if value is not None:
+                yield value
+            else:
+                yield from _read_file(path) # type: ignore
+            yield b'\r\n'
+        yield self._closing()
@@ -0,0 +1,76 @@
+"""Micro-benchmark for preparing a json request body for an async send, and capturing it for the trace.
+
+    python tests/benchmarks/request_body.py --items 1000 --iterations 200
+
+`reserialize` is how the body used to be handled: aiohttp serialized `json=` into a payload, which
+was then written out a second time and decoded to fill the trace. `encode once` is the current path,
+where the body is encoded to bytes once and the same buffer is sent and kept for the trace.
+"""
+import argparse, asyncio, io, json, timeit
+
+import aiohttp
+from aiohttp.abc import AbstractStreamWriter
+from aiohttp.payload import JsonPayload
+
+from athena.request import AthenaRequest
+
+class _Writer(AbstractStreamWriter):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+    async def write(self, chunk):
+        self.buffer.write(chunk)
+    async def write_eof(self, chunk=b""):
+        self.buffer.write(chunk)
+    async def drain(self):
+        pass
+    def enable_compression(self, encoding="deflate", strategy=None):
+        pass
+    def enable_chunking(self):
+        pass
+    async def write_headers(self, status_line, headers):
+        pass
+
+def make_payload(items: int):
+    return [{'id': i, 'name': f'item {i}', 'tags': ['a', 'b', 'c'], 'price': i * 1.5, 'active': i % 2 == 0} for i in range(items)]
+
+def reserialize(loop: asyncio.AbstractEventLoop, payload):
+    body = JsonPayload(payload)
+    writer = _Writer()
+    loop.run_until_complete(body.write(writer))
+    return writer.buffer.getvalue().decode()
+
+def encode_once(payload, encoder=json.dumps):
+    request = AthenaRequest()
+    request.json = payload
+    request.json_encoder = encoder
+    request._encode_body()
+    body = aiohttp.payload.BytesPayload(request.data)
+    return request.data, body
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    payload = make_payload(args.items)
+    loop = asyncio.new_event_loop()
+    cases = {
+        'reserialize': lambda: reserialize(loop, payload),
+        'encode once': lambda: encode_once(payload),
+    }
+    try:
+        import orjson
+        cases['encode once (orjson)'] = lambda: encode_once(payload, orjson.dumps)
+    except ImportError:
+        pass
+
+    size = len(encode_once(payload)[0])
+    print(f"{args.items} items, {size} bytes per body, {args.iterations} iterations")
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=args.iterations, repeat=5)) / args.iterations
+        print(f"{name:>22}: {best * 1e6:9.1f}us per request")
+    loop.close()
+
+if __name__ == '__main__':
+    main()
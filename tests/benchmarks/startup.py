@@ -0,0 +1,44 @@
+"""Import time report for the cli entry point, based on `python -X importtime`.
+
+    python tests/benchmarks/startup.py --top 25 > tests/benchmarks/startup.txt
+    python tests/benchmarks/startup.py --top 25 status
+
+With no arguments, only `athena.__main__` is imported. Any arguments are passed to the cli, to see what
+a single command pulls in on top of that. `startup.txt` is the report for the entry point, commit it
+again when an import is added or moved so the change in cold start shows up in the diff.
+"""
+import argparse, subprocess, sys
+
+def import_times(args: list[str]) -> dict[str, tuple[int, int]]:
+    code = 'import athena.__main__' if len(args) == 0 else 'from athena.__main__ import main; main()'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code, *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'site':
+            # everything up to here is interpreter startup, and is paid by any python command
+            times.clear()
+            continue
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    options = parser.parse_args()
+
+    times = import_times(options.args)
+    command = ' '.join(['athena', *options.args]) if len(options.args) > 0 else 'import athena.__main__'
+    print(f"{command}: {len(times)} modules")
+    print(f"{'cumulative':>12} | {'self':>10} | module")
+    slowest = sorted(times.items(), key=lambda kvp: kvp[1][1], reverse=True)[:options.top]
+    for name, (own, cumulative) in slowest:
+        print(f"{cumulative:>10}us | {own:>8}us | {name}")
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import subprocess, time, os, json
+import subprocess, time, os, json, hashlib
 import pytest
 
 @pytest.fixture(scope="module")
@@ -53,3 +53,151 @@ def test_form_append(setup_athena):
     assert response_body['headers']['Content-Type'] == 'application/x-www-form-urlencoded'
     assert response_body['form']['foo'] == ['bar', 'baz', 'qux']
 
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_file(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_file_{method}.py'
+    code = f'''import asyncio, json, os
+async def run(athena):
+    path = os.path.join(os.path.dirname(__file__), 'upload_{method}.txt')
+    with open(path, 'w') as f:
+        f.write('abcdefghij' * 10000)
+    client = athena.client()
+    # the summary used to race the last chunk of the upload, so send it a few times
+    for _ in range(20):
+        response = client.{method}('http://{API_HOST}/api/echo', lambda r: r
+            .body.file(path))
+        if asyncio.iscoroutine(response):
+            response = await response
+    return json.dumps(response.json())'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    echo = json.loads(trace['result'])
+    assert echo['headers']['Content-Type'] == 'text/plain'
+    assert echo['headers']['Content-Length'] == '100000'
+    assert echo['body'] == str(b'abcdefghij' * 10000)
+
+    # only a summary of the upload is kept
+    assert len(trace['athena_traces']) == 20
+    for athena_trace in trace['athena_traces']:
+        request = athena_trace['request']
+        assert 'text' not in request
+        assert request['body']['size'] == 100000
+        assert request['body']['sha256'] == hashlib.sha256(b'abcdefghij' * 10000).hexdigest()
+        assert request['body']['preview'] == ('abcdefghij' * 10000)[:1024]
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_stream(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_stream_{method}.py'
+    code = f'''import asyncio, json
+def generate():
+    for i in range(100):
+        yield f'{{i}},'.encode()
+async def generate_async():
+    for chunk in generate():
+        yield chunk
+async def run(athena):
+    response = athena.client().{method}('http://{API_HOST}/api/echo', lambda r: r
+        .body.stream({'generate_async' if method == 'post_async' else 'generate'}(), 'text/csv'))
+    if asyncio.iscoroutine(response):
+        response = await response
+    return json.dumps(response.json())'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    expected = ''.join([f'{i},' for i in range(100)])
+    echo = json.loads(trace['result'])
+    assert echo['headers']['Transfer-Encoding'] == 'chunked'
+    assert echo['body'] == str(expected.encode())
+    request = trace['athena_traces'][0]['request']
+    assert request['body']['size'] == len(expected)
+    assert request['body']['preview'] == expected
+
+def test_stream_async_iterable_sync_request(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_stream_async_iterable_sync_request.py'
+    code = f'''async def generate():
+    yield b'abc'
+def run(athena):
+    athena.client().post('http://{API_HOST}/api/echo', lambda r: r.body.stream(generate()))'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'async iterable body' in result.stderr
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_multipart(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_multipart_{method}.py'
+    code = f'''import asyncio, json, os
+async def run(athena):
+    path = os.path.join(os.path.dirname(__file__), 'multipart_{method}.bin')
+    with open(path, 'wb') as f:
+        f.write(bytes(range(256)) * 100)
+    response = athena.client().{method}('http://{API_HOST}/api/echo', lambda r: r
+        .body.multipart_field('title', 'report')
+        .body.multipart_file('document', path, 'report.bin'))
+    if asyncio.iscoroutine(response):
+        response = await response
+    return json.dumps(response.json())'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    echo = json.loads(trace['result'])
+    assert echo['form'] == { 'title': ['report'] }
+    assert echo['files']['document'] == ['report.bin', 'application/octet-stream', hashlib.sha256(bytes(range(256)) * 100).hexdigest()]
+    request = trace['athena_traces'][0]['request']
+    assert request['body']['size'] == int(echo['headers']['Content-Length'])
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_json_encoder(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_json_encoder_{method}.py'
+    code = f'''import asyncio, json
+def encode(payload):
+    return json.dumps(payload, separators=(',', ':')).encode()
+async def run(athena):
+    client = athena.client(lambda r: r.json_encoder(encode))
+    response = client.{method}('http://{API_HOST}/api/echo', lambda r: r
+        .body.json({{'foo': [1, 2]}}))
+    if asyncio.iscoroutine(response):
+        response = await response
+    return response.json()['body']'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    # the encoded body is sent and kept in the trace as is
+    assert trace['result'] == str(b'{"foo":[1,2]}')
+    request = trace['athena_traces'][0]['request']
+    assert request['text'] == '{"foo":[1,2]}'
+    assert request['content_type'] == 'application/json'
@@ -0,0 +1,237 @@
+import subprocess, time, os, json
+import pytest
+
+@pytest.fixture(scope="module")
+def setup_athena(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_tmp')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    yield os.path.join(tmp_dir, 'athena')
+
+API_HOST='flask-test-image:5000'
+
+CONCURRENT_REQUESTS_CODE = f'''import asyncio
+async def run(athena):
+    client = athena.client()
+    await asyncio.gather(*[client.post_async('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.5}})) for _ in range(3)])'''
+
+def write_pool_settings(athena_dir: str, settings: str):
+    with open(os.path.join(athena_dir, '.athena'), 'w') as f:
+        f.write(f'environment: __default__\npool:\n{settings}')
+
+def test_pool_settings_omitted(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_pool_settings_omitted')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    athena_dir = os.path.join(tmp_dir, 'athena')
+    result = subprocess.run(['athena', 'set', 'environment', 'staging'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    # an empty section is left out, rather than written as `pool: {}`
+    with open(os.path.join(athena_dir, '.athena'), 'r') as f:
+        assert 'pool' not in f.read()
+
+    write_pool_settings(athena_dir, '  limit:\n    staging: 1\n')
+    result = subprocess.run(['athena', 'set', 'environment', 'production'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    with open(os.path.join(athena_dir, '.athena'), 'r') as f:
+        assert 'staging: 1' in f.read()
+
+def test_pool_limit_environment(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_limit_environment.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(CONCURRENT_REQUESTS_CODE)
+    write_pool_settings(athena_dir, '  limit:\n    production: 1\n')
+
+    start = time.time()
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0
+    assert 'passed' in result.stdout
+    assert duration < 1.5
+
+    start = time.time()
+    result = subprocess.run(['athena', 'run', '-e', 'production', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0
+    assert 'passed' in result.stdout
+    assert duration >= 1.5
+
+def test_pool_limit_client(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_limit_client.py'
+    code = CONCURRENT_REQUESTS_CODE.replace('athena.client()', 'athena.client(pool=PoolOptions(limit_per_host=1))')
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('from athena.pool import PoolOptions\n' + code)
+    write_pool_settings(athena_dir, '  limit:\n    __default__: 50\n')
+
+    start = time.time()
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0
+    assert 'passed' in result.stdout
+    assert duration >= 1.5
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_pool_read_timeout(setup_athena, method):
+    athena_dir = setup_athena
+    filename = f'test_pool_read_timeout_{method}.py'
+    code = f'''async def run(athena):
+    response = athena.client().{method}('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 5}}))
+    if asyncio.iscoroutine(response):
+        await response'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('import asyncio\n' + code)
+    write_pool_settings(athena_dir, '  read_timeout:\n    __default__: 0.5\n')
+
+    start = time.time()
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+
+    assert result.returncode == 0
+    trace = json.loads(result.stdout)
+    assert trace['success'] == False
+    assert 'Timeout' in trace['error']
+    assert duration < 2
+
+def test_pool_invalid_settings(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_invalid_settings.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('def run(athena):\n    athena.client()')
+
+    write_pool_settings(athena_dir, '  pool_size:\n    __default__: 5\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'unknown pool setting `pool_size`' in result.stderr
+
+    write_pool_settings(athena_dir, '  limit:\n    __default__: 0\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'positive integer' in result.stderr
+
+    write_pool_settings(athena_dir, '  transport:\n    __default__: httpx\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'requests, aiohttp' in result.stderr
+
+@pytest.mark.parametrize('method', ['get', 'get_async'])
+def test_pool_telemetry(setup_athena, method):
+    athena_dir = setup_athena
+    filename = f'test_pool_telemetry_{method}.py'
+    code = f'''async def run(athena):
+    client = athena.client()
+    for _ in range(2):
+        response = client.{method}('http://{API_HOST}/api/echo')
+        if asyncio.iscoroutine(response):
+            await response'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('import asyncio\n' + code)
+    write_pool_settings(athena_dir, '  limit:\n    __default__: 10\n')
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+
+    # the test server closes the connection after every response, so none can be reused
+    first, second = [t['connection'] for t in trace['athena_traces']]
+    assert first['reused'] == False
+    assert second['reused'] == False
+    assert first['id'] != second['id']
+    assert first['pool_wait'] >= 0
+    assert trace['pool'] == { 'active': 0, 'idle': 0, 'peak': 1, 'opened': 2, 'reused': 0 }
+
+    result = subprocess.run(['athena', 'traces', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'pool: 0 active, 0 idle, 1 peak (2 opened, 0 reused)' in result.stdout
+    assert f"connection #{first['id']}" in result.stdout
+
+def test_pool_telemetry_peak(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_telemetry_peak.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(CONCURRENT_REQUESTS_CODE)
+    write_pool_settings(athena_dir, '  limit:\n    __default__: 2\n')
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['pool']['peak'] == 2
+    assert trace['pool']['opened'] == 3
+    # one of the requests had to wait for a connection to be released
+    waits = sorted([t['connection']['pool_wait'] for t in trace['athena_traces']])
+    assert waits[-1] >= 0.4
+
+@pytest.mark.parametrize('transport', ['requests', 'aiohttp'])
+def test_pool_transport(setup_athena, transport):
+    athena_dir = setup_athena
+    filename = f'test_pool_transport_{transport}.py'
+    code = f'''async def run(athena):
+    client = athena.client(lambda r: r.base_url('http://{API_HOST}'))
+    client.post('/api/response', lambda r: r
+        .body.json({{'headers': {{'Set-Cookie': 'foo=bar; Path=/'}}}}))
+    response = await client.get_async('/api/echo')
+    return response.json()['headers'].get('Cookie')'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+    write_pool_settings(athena_dir, f'  transport:\n    __default__: {transport}\n')
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+
+    user_agents = [dict(t['request']['headers']).get('User-Agent', '') for t in trace['athena_traces']]
+    if transport == 'aiohttp':
+        # both requests went through the same session, so they share a cookie jar
+        assert all(['aiohttp' in user_agent for user_agent in user_agents])
+        assert trace['result'] == 'foo=bar'
+    else:
+        assert 'python-requests' in user_agents[0]
+        assert trace['result'] is None
+
+def test_pool_limit_threads(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_limit_threads.py'
+    code = f'''def run(athena):
+    client = athena.client()
+    athena.parallel_map(lambda _: client.post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.5}})), range(3), workers=3)'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+    write_pool_settings(athena_dir, '  limit_per_host:\n    __default__: 1\n')
+
+    start = time.time()
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+    # the threads took turns on the one connection, rather than opening more
+    assert duration >= 1.5
+    assert trace['pool']['peak'] == 1
+    waits = sorted([t['connection']['pool_wait'] for t in trace['athena_traces']])
+    assert waits[-1] >= 0.9
+
+def test_pool_timeout_threads(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_pool_timeout_threads.py'
+    code = f'''def run(athena):
+    client = athena.client()
+    athena.parallel_map(lambda _: client.post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 2}})), range(2), workers=2)'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+    write_pool_settings(athena_dir, '  limit_per_host:\n    __default__: 1\n  pool_timeout:\n    __default__: 0.5\n')
+
+    start = time.time()
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    # the thread without a connection gave up, instead of waiting for the other request to finish
+    assert trace['success'] == False
+    assert 'waiting for a free connection' in trace['error']
+    assert duration < 4
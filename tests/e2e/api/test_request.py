@@ -53,3 +53,348 @@ def test_param(setup_athena):
 
     assert response_body['args'] == {'foo': ['bar', 'bar', 'baz']}
 
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_timings(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_timings_{method}.py'
+    code = f'''import asyncio
+async def run(athena):
+    response = athena.client().{method}('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.3}}))
+    if asyncio.iscoroutine(response):
+        await response'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+
+    athena_trace = trace['athena_traces'][0]
+    timings = athena_trace['timings']
+    assert timings['dns'] >= 0
+    assert timings['connect'] >= 0
+    assert timings['tls'] is None
+    assert timings['ttfb'] >= 0.3
+    assert timings['transfer'] >= 0
+    phases = [v for v in timings.values() if v is not None]
+    assert sum(phases) <= athena_trace['end'] - athena_trace['start']
+
+    result = subprocess.run(['athena', 'traces', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'ttfb' in result.stdout
+    assert 'transfer' in result.stdout
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_send_many(setup_athena, ordered):
+    athena_dir = setup_athena
+
+    filename = f'test_send_many_{ordered}.py'
+    code = f'''def run(athena):
+    client = athena.client()
+    def specs():
+        for i in range(8):
+            yield ('post', 'http://{API_HOST}/api/response', lambda r, i=i: r.body.json({{'duration': 0.4 if i == 0 else 0.2, 'body': str(i)}}))
+    return [r.text for r in client.send_many(specs(), concurrency=4, ordered={ordered})]'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    start = time.time()
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+    assert len(trace['athena_traces']) == 8
+    assert duration < 2
+
+    order = eval(trace['result'])
+    assert sorted(order) == [str(i) for i in range(8)]
+    if ordered:
+        assert order == [str(i) for i in range(8)]
+    else:
+        # the first request is the slowest, so it can't be first out
+        assert order[0] != '0'
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_send_many_async(setup_athena, ordered):
+    athena_dir = setup_athena
+
+    filename = f'test_send_many_async_{ordered}.py'
+    code = f'''async def run(athena):
+    client = athena.client()
+    async def specs():
+        for i in range(8):
+            yield ('post', 'http://{API_HOST}/api/response', lambda r, i=i: r.body.json({{'duration': 0.4 if i == 0 else 0.2, 'body': str(i)}}))
+    return [r.text async for r in client.send_many_async(specs(), concurrency=4, ordered={ordered})]'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    start = time.time()
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    duration = time.time() - start
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+    assert len(trace['athena_traces']) == 8
+    assert duration < 2
+
+    order = eval(trace['result'])
+    assert sorted(order) == [str(i) for i in range(8)]
+    if ordered:
+        assert order == [str(i) for i in range(8)]
+    else:
+        assert order[0] != '0'
+
+def test_send_many_invalid(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_send_many_invalid.py'
+    code = f'''def run(athena):
+    list(athena.client().send_many([('get',)]))'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'expected request to be a tuple' in result.stderr
+
+def test_sync_request_in_event_loop(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_sync_request_in_event_loop.py'
+    code = f'''async def run(athena):
+    client = athena.client()
+    client.get('http://{API_HOST}/api/echo')
+    await client.get_async('http://{API_HOST}/api/echo')'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True
+    sync_trace, async_trace = trace['athena_traces']
+    assert len(sync_trace['warnings']) == 1
+    assert 'blocked the event loop' in sync_trace['warnings'][0]
+    assert async_trace['warnings'] == []
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+@pytest.mark.parametrize('spill_threshold', [1024 * 1024, 1024])
+def test_stream_response(setup_athena, method, spill_threshold):
+    athena_dir = setup_athena
+
+    filename = f'test_stream_response_{method}_{spill_threshold}.py'
+    code = f'''import asyncio, hashlib
+async def run(athena):
+    response = athena.client().{method}('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'body': 'abcdefghij' * 10000}})
+        .stream_response({spill_threshold}))
+    if asyncio.iscoroutine(response):
+        response = await response
+    assert response.text == 'abcdefghij' * 10000
+    assert response.body.read() == response.text.encode()
+    assert b''.join(response.body.iter_bytes(4096)) == response.body.read()
+    return hashlib.sha256(response.text.encode()).hexdigest()'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    response = trace['athena_traces'][0]['response']
+    assert 'text' not in response
+    assert response['body']['size'] == 100000
+    assert response['body']['sha256'] == trace['result']
+    assert response['body']['spilled'] == (spill_threshold < 100000)
+    assert response['body']['preview'] == ('abcdefghij' * 10000)[:1024]
+
+    result = subprocess.run(['athena', 'responses', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert f"[stream] 100KB sha256:{trace['result'][:12]}" in result.stdout
+
+def test_stream_response_close(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_stream_response_close.py'
+    code = f'''import json
+from athena.exceptions import AthenaException
+from athena.retention import RetentionPolicy
+def run(athena):
+    athena.retain(RetentionPolicy(keep_last=1))
+    client = athena.client()
+    send = lambda: client.post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'body': 'abcdefghij' * 10000}})
+        .stream_response(1024))
+    first = send()
+    view = first.body.view()
+    send()
+    # the first trace was evicted, which closes its temporary file, but views that were already taken stay readable
+    try:
+        first.body.read()
+        closed = False
+    except AthenaException:
+        closed = True
+    return json.dumps([closed, bytes(view[:10]).decode(), first.body.size])'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+    assert json.loads(trace['result']) == [True, 'abcdefghij', 100000]
+    assert trace['athena_traces'][0]['response']['body']['spilled'] == True
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_iter_json(setup_athena, stream):
+    athena_dir = setup_athena
+
+    filename = f'test_iter_json_{stream}.py'
+    stream_step = '.stream_response(1024)' if stream else ''
+    code = f'''import json
+def run(athena):
+    body = json.dumps({{'count': 20000, 'data': {{'items': [{{'id': i, 'name': f'item {{i}}'}} for i in range(20000)]}}}})
+    response = athena.client().post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'body': body, 'headers': {{'Content-Type': 'application/json'}}}}){stream_step})
+    ids = [item['id'] for item in response.iter_json('data.items')]
+    assert ids == list(range(20000))
+    assert response.json() is response.json()
+    assert len(response.json()['data']['items']) == 20000
+    try:
+        next(response.iter_json('data.missing'))
+        assert False
+    except Exception as e:
+        assert 'not found' in str(e)'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+@pytest.mark.parametrize('size', [1, 2])
+def test_iter_json_chunk_boundaries(setup_athena, size):
+    athena_dir = setup_athena
+
+    filename = f'test_iter_json_chunk_boundaries_{size}.py'
+    code = f'''import json
+from athena.json_stream import iter_json
+def run(athena):
+    document = '{{"data": {{"items": [1.5, 2, -3.25e-2, 1.5e3, 1E+5, 12345, 0, true, false, null, "a, b]", {{"n": [6.75, -1]}}]}}}}'
+    chunks = [document[i:i + {size}] for i in range(0, len(document), {size})]
+    return json.dumps(list(iter_json(chunks, 'data.items')) == json.loads(document)['data']['items'])'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+    assert json.loads(trace['result']) == True
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_binary_body(setup_athena, method):
+    athena_dir = setup_athena
+
+    filename = f'test_binary_body_{method}.py'
+    code = f'''import asyncio, hashlib
+async def run(athena):
+    client = athena.client(lambda r: r.base_url('http://{API_HOST}'))
+    payload = bytes(range(256))
+    upload = client.{method}('/api/echo', lambda r: r.body.binary(payload, 'application/x-protobuf'))
+    download = client.{method}('/api/response', lambda r: r
+        .body.json({{'body': '\\x00\\x01\\x02', 'headers': {{'Content-Type': 'image/png'}}}}))
+    if asyncio.iscoroutine(upload):
+        upload, download = await upload, await download
+    assert bytes(upload.content[:1]) == b'{{'
+    assert upload.json()['body'] == str(payload)
+    assert bytes(download.content) == b'\\x00\\x01\\x02'
+    return hashlib.sha256(payload).hexdigest()'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    upload, download = trace['athena_traces']
+    # binary bodies are summarized, while text bodies are still included in full
+    assert 'text' not in upload['request']
+    assert upload['request']['body']['size'] == 256
+    assert upload['request']['body']['sha256'] == trace['result']
+    assert upload['request']['body']['binary'] == True
+    assert 'text' in upload['response']
+    assert 'text' not in download['response']
+    assert download['response']['body']['size'] == 3
+    assert download['response']['body']['preview'] == ''
+
+    result = subprocess.run(['athena', 'traces', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert f"application/x-protobuf [binary] 256B sha256:{trace['result'][:12]}" in result.stdout
+
+def test_trace_lookup(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_trace_lookup.py'
+    code = f'''import asyncio, json
+async def run(athena):
+    client = athena.client(lambda r: r.base_url('http://{API_HOST}'))
+    # the requests complete in the reverse of the order they were sent
+    responses = await asyncio.gather(*[client.post_async('/api/response', lambda r, i=i: r
+        .body.json({{'body': str(i), 'duration': 0.3 - i * 0.1}})) for i in range(3)])
+    for response in responses:
+        trace = athena.trace(response)
+        assert trace.response is response
+        assert athena.trace(trace.request) is trace
+        assert athena.trace(trace) is trace
+    last = client.post('/api/response', lambda r: r.body.json({{'body': 'last'}}))
+    assert athena.trace().response is last
+    return json.dumps([t.response.text for t in athena.traces()])'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+    # traces are in the order the requests were sent
+    assert json.loads(trace['result']) == ['0', '1', '2', 'last']
+
+def test_parallel_map(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_parallel_map.py'
+    code = f'''import json, time
+def run(athena):
+    client = athena.client(lambda r: r.base_url('http://{API_HOST}'))
+    def send(i):
+        # the later items complete first
+        first = client.post('/api/response', lambda r: r.body.json({{'body': f'{{i}}a', 'duration': 0.5 - i * 0.1}}))
+        second = client.post('/api/response', lambda r: r.body.json({{'body': f'{{i}}b'}}))
+        return first.text + second.text
+    client.post('/api/response', lambda r: r.body.json({{'body': 'before'}}))
+    start = time.time()
+    results = athena.parallel_map(send, range(5), workers=5)
+    duration = time.time() - start
+    return json.dumps([results, [t.response.text for t in athena.traces()], duration])'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+
+    results, traces, duration = json.loads(trace['result'])
+    assert results == [f'{i}a{i}b' for i in range(5)]
+    assert traces == ['before'] + [f'{i}{part}' for i in range(5) for part in 'ab']
+    assert [t['response']['text'] for t in trace['athena_traces']] == traces
+    assert duration < 1.2
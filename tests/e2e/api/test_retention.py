@@ -0,0 +1,154 @@
+import subprocess, os, json
+import pytest
+
+@pytest.fixture(scope="module")
+def setup_athena(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_tmp')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    yield os.path.join(tmp_dir, 'athena')
+
+API_HOST='flask-test-image:5000'
+
+# sends 10 requests, every third one fails
+REQUESTS_CODE = f'''async def run(athena):
+    client = athena.client()
+    for i in range(10):
+        response = client.{{method}}('http://{API_HOST}/api/response', lambda r: r
+            .body.json({{{{'status_code': 500 if i % 3 == 0 else 200, 'body': f'response {{{{i}}}}'}}}}))
+        if asyncio.iscoroutine(response):
+            await response'''
+
+def write_retention_settings(athena_dir: str, settings: str):
+    with open(os.path.join(athena_dir, '.athena'), 'w') as f:
+        f.write(f'environment: __default__\nretention:\n{settings}')
+
+def run_traces(athena_dir: str, filename: str, code: str):
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('import asyncio\nfrom athena.retention import RetentionPolicy\n' + code)
+    result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    trace = json.loads(result.stdout)
+    assert trace['success'] == True, trace['error']
+    return trace
+
+def response_texts(trace):
+    return [t['response']['text'] for t in trace['athena_traces']]
+
+def test_retention_settings_omitted(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_retention_settings_omitted')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    athena_dir = os.path.join(tmp_dir, 'athena')
+    result = subprocess.run(['athena', 'set', 'environment', 'staging'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    # an empty section is left out, rather than written as `retention: {}`
+    with open(os.path.join(athena_dir, '.athena'), 'r') as f:
+        assert 'retention' not in f.read()
+
+    write_retention_settings(athena_dir, '  keep_last:\n    staging: 5\n')
+    result = subprocess.run(['athena', 'set', 'environment', 'production'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    with open(os.path.join(athena_dir, '.athena'), 'r') as f:
+        assert 'staging: 5' in f.read()
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_retention_default(setup_athena, method):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  {}\n')
+    trace = run_traces(athena_dir, f'test_retention_default_{method}.py', REQUESTS_CODE.format(method=method))
+
+    assert response_texts(trace) == [f'response {i}' for i in range(10)]
+    counts = trace['trace_counts']
+    assert counts['requests'] == 10
+    assert counts['failures'] == 4
+    assert counts['retained'] == 10
+    assert counts['dropped'] == 0
+
+@pytest.mark.parametrize('method', ['post', 'post_async'])
+def test_retention_environment(setup_athena, method):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  failures:\n    __default__: true\n  keep_last:\n    __default__: 3\n')
+    trace = run_traces(athena_dir, f'test_retention_environment_{method}.py', REQUESTS_CODE.format(method=method))
+
+    assert response_texts(trace) == ['response 3', 'response 6', 'response 9']
+    counts = trace['trace_counts']
+    assert counts['requests'] == 10
+    assert counts['failures'] == 4
+    assert counts['retained'] == 3
+    assert counts['dropped'] == 7
+    assert counts['total_time'] >= counts['max_time'] > 0
+
+    result = subprocess.run(['athena', 'traces', f'test_retention_environment_{method}.py'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'traces: 10 requests (4 failed), 3 retained, 7 dropped' in result.stdout
+
+def test_retention_sample(setup_athena):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  {}\n')
+    code = REQUESTS_CODE.format(method='post').replace('client = athena.client()', 'athena.retain(RetentionPolicy(sample=4))\n    client = athena.client()')
+    trace = run_traces(athena_dir, 'test_retention_sample.py', code)
+
+    assert response_texts(trace) == ['response 0', 'response 4', 'response 8']
+    assert trace['trace_counts']['dropped'] == 7
+
+def test_retention_module_overrides_environment(setup_athena):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  failures:\n    __default__: true\n')
+    code = REQUESTS_CODE.format(method='post').replace('client = athena.client()', 'athena.retain(RetentionPolicy(keep_last=2))\n    client = athena.client()')
+    trace = run_traces(athena_dir, 'test_retention_module_overrides_environment.py', code)
+
+    # the failures setting from the environment still applies
+    assert response_texts(trace) == ['response 6', 'response 9']
+
+def test_retention_metadata_only(setup_athena):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  metadata_only:\n    __default__: true\n')
+    code = f'''def run(athena):
+    response = athena.client().post('http://{API_HOST}/api/echo', lambda r: r.body.json({{'foo': 'bar'}}))
+    trace = athena.trace(response)
+    return json.dumps([response.json()['method'], trace.response.body.size == len(response.content)])'''
+    trace = run_traces(athena_dir, 'test_retention_metadata_only.py', 'import json\n' + code)
+
+    # the module still gets the full response, only the trace is trimmed
+    assert json.loads(trace['result']) == ['POST', True]
+    athena_trace = trace['athena_traces'][0]
+    for subject in ['request', 'response']:
+        body = athena_trace[subject]['body']
+        assert body['size'] > 0
+        assert len(body['sha256']) == 64
+        assert 'text' not in athena_trace[subject]
+    assert athena_trace['request']['body']['preview'] == '{"foo": "bar"}'
+
+def test_retention_evicted_trace(setup_athena):
+    athena_dir = setup_athena
+    write_retention_settings(athena_dir, '  keep_last:\n    __default__: 1\n')
+    code = f'''def run(athena):
+    client = athena.client()
+    first = client.get('http://{API_HOST}/api/echo')
+    client.get('http://{API_HOST}/api/echo')
+    athena.trace(first)'''
+    with open(os.path.join(athena_dir, 'test_retention_evicted_trace.py'), 'w') as f:
+        f.write(code)
+    result = subprocess.run(['athena', 'run', 'test_retention_evicted_trace.py'], cwd=athena_dir, capture_output=True, text=True)
+    assert 'unable to resolve parent for trace' in result.stdout + result.stderr
+
+def test_retention_invalid_settings(setup_athena):
+    athena_dir = setup_athena
+    filename = 'test_retention_invalid_settings.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('def run(athena):\n    pass')
+
+    write_retention_settings(athena_dir, '  keep_first:\n    __default__: 5\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'unknown retention setting `keep_first`' in result.stderr
+
+    write_retention_settings(athena_dir, '  sample:\n    __default__: 0\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'positive integer' in result.stderr
+
+    write_retention_settings(athena_dir, '  failures:\n    __default__: yes please\n')
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'boolean' in result.stderr
@@ -0,0 +1,212 @@
+import subprocess, os, json
+import pytest
+
+@pytest.fixture(scope="module")
+def setup_athena(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_tmp')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    yield os.path.join(tmp_dir, 'athena')
+
+API_HOST='flask-test-image:5000'
+
+def write_module(athena_dir: str, filename: str, code: str) -> str:
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+    return filename
+
+def test_load(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load.py', f'''def run(athena):
+    client = athena.client(lambda b: b.base_url('http://{API_HOST}'))
+    client.get('/api/echo')
+    client.get('/api/missing')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-c', '4', '-d', '1s', '-w', '200ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['concurrency'] == 4
+    assert report['iterations'] > 0
+    assert report['failed_iterations'] == 0
+    traces = { t['name']: t for t in report['traces'] }
+    assert set(traces.keys()) == {'/api/echo', '/api/missing'}
+    assert traces['/api/echo']['error_rate'] == 0
+    assert traces['/api/missing']['error_rate'] == 1
+    assert report['total']['requests'] == traces['/api/echo']['requests'] + traces['/api/missing']['requests']
+    for trace in report['traces']:
+        latency = trace['latency']
+        assert 0 < latency['min'] <= latency['p50'] <= latency['p90'] <= latency['p99'] <= latency['p999'] <= latency['max']
+
+def test_load_trace_names(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_trace_names.py', f'''import uuid
+def run(athena):
+    client = athena.client(lambda b: b.base_url('http://{API_HOST}'))
+    client.get(f'/api/echo?id={{uuid.uuid4()}}')
+    client.get(f'/api/missing/{{uuid.uuid4()}}')
+    for i in range(120):
+        client.get(f'/api/missing/page{{i}}')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-d', '500ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    traces = { t['name']: t for t in report['traces'] }
+    assert len(traces) == 100
+    assert traces['/api/echo']['requests'] == report['iterations']
+    assert traces['/api/missing/{id}']['requests'] == report['iterations']
+    # the two names above, the first 97 pages, and the rest of the pages
+    assert traces['(other)']['requests'] == 23 * report['iterations']
+
+def test_load_rate(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_rate.py', f'''def run(athena):
+    athena.client().get('http://{API_HOST}/api/echo')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-c', '4', '-d', '1s', '-r', '10', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['iterations'] == 10
+    assert report['total']['requests'] == 10
+
+def test_load_function(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_function.py', f'''def run(athena):
+    raise Exception('run should not be called')
+
+def load(athena):
+    athena.client().get('http://{API_HOST}/api/echo')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-d', '500ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['iterations'] > 0
+    assert report['failed_iterations'] == 0
+    assert report['error'] is None
+
+def test_load_failures(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_failures.py', '''def run(athena):
+    raise ValueError('failed iteration')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-d', '200ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['iterations'] > 0
+    assert report['failed_iterations'] == report['iterations']
+    assert report['error'] == 'ValueError: failed iteration'
+    assert report['total']['requests'] == 0
+
+def test_load_open_loop(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_open_loop.py', f'''async def load(athena):
+    await athena.client().post_async('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.2}}))''')
+
+    # each request takes longer than the time between arrivals, so they have to overlap
+    result = subprocess.run(['athena', 'load', filename, '-d', '1s', '-r', '20', '-a', 'fixed', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['arrivals'] == 'fixed'
+    assert report['iterations'] == 20
+    assert report['total']['corrected_latency']['p50'] < 0.4
+
+def test_load_open_loop_overloaded(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_open_loop_overloaded.py', '''import asyncio, time
+peak = 0
+async def load(athena):
+    global peak
+    peak = max(peak, len(asyncio.all_tasks()))
+    athena.cache['peak'] = peak
+    # blocks the loop, so iterations are served slower than they arrive
+    time.sleep(0.05)''')
+
+    # the fixture from `athena init` runs on the executor, which would let iterations overlap
+    fixture_path = os.path.join(athena_dir, 'fixture.py')
+    os.rename(fixture_path, fixture_path + '.bak')
+    try:
+        result = subprocess.run(['athena', 'load', filename, '-d', '1s', '-r', '40', '-a', 'fixed', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    finally:
+        os.rename(fixture_path + '.bak', fixture_path)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout)['iterations'] == 40
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        data = json.loads(f.read())['data']
+    # each late arrival is started and run before the next one, rather than all of them at once
+    # when the loop frees up. the main task and the running iteration are the only ones left.
+    assert data['peak'] == 2
+
+def test_load_coordinated_omission(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_coordinated_omission.py', f'''def load(athena):
+    athena.client().post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.1}}))''')
+
+    # a single closed loop worker can't keep up with the rate, so iterations start later and later
+    result = subprocess.run(['athena', 'load', filename, '-d', '1s', '-r', '20', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    latency = report['total']['latency']
+    corrected_latency = report['total']['corrected_latency']
+    assert latency['p99'] < 0.2
+    assert corrected_latency['p99'] > 2 * latency['p99']
+
+def test_load_corrected_requires_schedule(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_load_unscheduled.py', f'''def run(athena):
+    athena.client().get('http://{API_HOST}/api/echo')''')
+
+    result = subprocess.run(['athena', 'load', filename, '-d', '200ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout)['total']['corrected_latency'] is None
+
+    result = subprocess.run(['athena', 'load', filename, '-d', '200ms', '-a', 'poisson'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+
+def test_find_capacity(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_find_capacity.py', f'''def load(athena):
+    athena.client().get('http://{API_HOST}/api/echo')''')
+
+    result = subprocess.run(['athena', 'load', filename, '--find-capacity', '--slo', 'p99<10s,errors<1%', '-d', '300ms', '-r', '10', '--step', '5', '--max-steps', '3', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['parameter'] == 'rate'
+    assert report['slo'] == ['p99<10s', 'errors<1.0%']
+    assert [step['rate'] for step in report['steps']] == [10, 15, 20]
+    assert all(step['passed'] for step in report['steps'])
+    assert report['breached'] == False
+    assert report['capacity'] == report['steps'][-1]
+
+def test_find_capacity_breached(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_find_capacity_breached.py', f'''def load(athena):
+    athena.client().get('http://{API_HOST}/api/missing')''')
+
+    result = subprocess.run(['athena', 'load', filename, '--find-capacity', '--slo', 'errors<1%', '-d', '200ms', '-p'], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    report = json.loads(result.stdout)
+    assert report['parameter'] == 'concurrency'
+    assert len(report['steps']) == 1
+    assert report['steps'][0]['breaches'] == ['errors 100.0% >= 1.0%']
+    assert report['breached'] == True
+    assert report['capacity'] is None
+
+def test_find_capacity_invalid_slo(setup_athena):
+    athena_dir = setup_athena
+    filename = write_module(athena_dir, 'test_find_capacity_invalid.py', '''def load(athena):
+    pass''')
+
+    for slo in ['p98<1s', 'p99>1s', 'errors<lots']:
+        result = subprocess.run(['athena', 'load', filename, '--find-capacity', '--slo', slo], cwd=athena_dir, capture_output=True, text=True)
+        assert result.returncode != 0
+        assert '--slo' in result.stderr
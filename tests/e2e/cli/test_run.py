@@ -0,0 +1,392 @@
+import subprocess, time, os, json, socket, stat
+import pytest
+
+@pytest.fixture(scope="module")
+def setup_athena(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_tmp')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    yield os.path.join(tmp_dir, 'athena')
+
+API_HOST='flask-test-image:5000'
+
+def test_jobs(setup_athena):
+    athena_dir = setup_athena
+    os.makedirs(os.path.join(athena_dir, 'jobs'), exist_ok=True)
+
+    sync_code = f'''def run(athena):
+    athena.client().post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 1}}))'''
+    async_code = f'''async def run(athena):
+    await athena.client().post_async('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 1}}))'''
+    filenames = []
+    for i, code in enumerate([sync_code, sync_code, async_code, async_code]):
+        filename = os.path.join('jobs', f'test_jobs_{i}.py')
+        with open(os.path.join(athena_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    start = time.time()
+    result = subprocess.run(['athena', 'run', '--jobs', '4', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    end = time.time()
+
+    assert result.returncode == 0
+    lines = result.stdout.strip().split('\n')
+    assert len(lines) == 4
+    for line in lines:
+        assert 'passed' in line
+    duration = end - start
+    assert duration < 3
+
+def test_jobs_cache(setup_athena):
+    athena_dir = setup_athena
+    os.makedirs(os.path.join(athena_dir, 'cache'), exist_ok=True)
+
+    filenames = []
+    for i in range(4):
+        filename = os.path.join('cache', f'test_jobs_cache_{i}.py')
+        code = f'''async def run(athena):
+    athena.cache['key_{i}'] = {i}'''
+        with open(os.path.join(athena_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    result = subprocess.run(['athena', 'exec', '--jobs', '4', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        cache = json.loads(f.read())
+    for i in range(4):
+        assert cache['data'][f'key_{i}'] == i
+
+def test_workers(setup_athena):
+    athena_dir = setup_athena
+    os.makedirs(os.path.join(athena_dir, 'workers'), exist_ok=True)
+
+    filenames = []
+    for i in range(4):
+        filename = os.path.join('workers', f'test_workers_{i}.py')
+        code = f'''def run(athena):
+    athena.cache['worker_key_{i}'] = {i}
+    athena.client().get('http://{API_HOST}/api/echo')'''
+        with open(os.path.join(athena_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    result = subprocess.run(['athena', 'run', '--workers', '2', *filenames], cwd=athena_dir, capture_output=True, text=True)
+
+    assert result.returncode == 0
+    lines = result.stdout.strip().split('\n')
+    assert sorted(lines) == [f'test_workers_{i}: passed' for i in range(4)]
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        cache = json.loads(f.read())
+    for i in range(4):
+        assert cache['data'][f'worker_key_{i}'] == i
+
+def test_fixture_scope(setup_athena):
+    athena_dir = setup_athena
+    for directory in ['scoped', 'unscoped']:
+        os.makedirs(os.path.join(athena_dir, directory), exist_ok=True)
+        with open(os.path.join(athena_dir, directory, 'fixture.py'), 'w') as f:
+            f.write(f'''import uuid
+{"scope = 'run'" if directory == 'scoped' else ''}
+def fixture(fixture):
+    fixture.value = str(uuid.uuid4())''')
+
+    filenames = []
+    for directory in ['scoped', 'unscoped']:
+        for i in range(3):
+            filename = os.path.join(directory, f'test_fixture_scope_{i}.py')
+            code = f'''def run(athena):
+    athena.cache['{directory}_{i}'] = athena.fixture.value'''
+            with open(os.path.join(athena_dir, filename), 'w') as f:
+                f.write(code)
+            filenames.append(filename)
+
+    result = subprocess.run(['athena', 'exec', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        cache = json.loads(f.read())
+    assert len(set(cache['data'][f'scoped_{i}'] for i in range(3))) == 1
+    assert len(set(cache['data'][f'unscoped_{i}'] for i in range(3))) == 3
+
+def test_fixture_scope_directory(setup_athena):
+    athena_dir = setup_athena
+    filenames = []
+    with open(os.path.join(athena_dir, 'fixture.py'), 'w') as f:
+        f.write('''import uuid
+scope = 'directory'
+def fixture(fixture):
+    fixture.value = str(uuid.uuid4())''')
+    for directory in ['siblings/foo', 'siblings/bar']:
+        os.makedirs(os.path.join(athena_dir, directory), exist_ok=True)
+        for i in range(2):
+            filename = os.path.join(directory, f'test_fixture_scope_directory_{i}.py')
+            with open(os.path.join(athena_dir, filename), 'w') as f:
+                f.write(f'''def run(athena):
+    athena.cache['{directory}_{i}'] = athena.fixture.value''')
+            filenames.append(filename)
+
+    try:
+        result = subprocess.run(['athena', 'exec', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    finally:
+        os.remove(os.path.join(athena_dir, 'fixture.py'))
+    assert result.returncode == 0, result.stderr
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        data = json.loads(f.read())['data']
+    # shared within a directory, but not across sibling directories
+    assert data['siblings/foo_0'] == data['siblings/foo_1']
+    assert data['siblings/bar_0'] == data['siblings/bar_1']
+    assert data['siblings/foo_0'] != data['siblings/bar_0']
+
+def test_fixture_scope_client(setup_athena):
+    athena_dir = setup_athena
+    os.makedirs(os.path.join(athena_dir, 'scoped_client'), exist_ok=True)
+    with open(os.path.join(athena_dir, 'scoped_client', 'fixture.py'), 'w') as f:
+        f.write(f'''scope = 'run'
+def fixture(fixture, athena):
+    fixture.clients = {{'api': athena.client(lambda b: b.base_url('http://{API_HOST}').auth.bearer('token'))}}''')
+    filenames = []
+    for i in range(3):
+        filename = os.path.join('scoped_client', f'test_fixture_scope_client_{i}.py')
+        with open(os.path.join(athena_dir, filename), 'w') as f:
+            f.write(f'''def run(athena):
+    response = athena.fixture.clients['api'].get('/api/echo')
+    athena.trace(response)
+    athena.cache['client_{i}'] = f"{{response.json()['headers']['Authorization']}} {{len(athena.traces())}}"''')
+        filenames.append(filename)
+
+    result = subprocess.run(['athena', 'exec', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        data = json.loads(f.read())['data']
+    # each module sees only the request it sent through the shared client
+    for i in range(3):
+        assert data[f'client_{i}'] == 'Bearer token 1'
+
+def test_dataclass_module(setup_athena):
+    athena_dir = setup_athena
+    os.makedirs(os.path.join(athena_dir, 'dataclasses'), exist_ok=True)
+    filenames = []
+    # two modules with the same file name, in different directories
+    for directory in ['foo', 'bar']:
+        os.makedirs(os.path.join(athena_dir, 'dataclasses', directory), exist_ok=True)
+        filename = os.path.join('dataclasses', directory, 'test_dataclass_module.py')
+        code = f'''from __future__ import annotations
+import pickle, typing
+from dataclasses import dataclass
+from typing import ClassVar
+
+@dataclass
+class Point:
+    x: int
+    y: "int"
+    dimensions: ClassVar[int] = 2
+
+def run(athena):
+    point = pickle.loads(pickle.dumps(Point(1, 2)))
+    assert typing.get_type_hints(Point)['x'] is int
+    athena.cache['{directory}'] = point.x + point.y + Point.dimensions'''
+        with open(os.path.join(athena_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    result = subprocess.run(['athena', 'run', *filenames], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().split('\n') == ['test_dataclass_module: passed']*2, result.stdout
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        cache = json.loads(f.read())
+    assert cache['data']['foo'] == 5
+    assert cache['data']['bar'] == 5
+
+def test_sibling_import(setup_athena):
+    athena_dir = setup_athena
+    directory = os.path.join(athena_dir, 'siblings_import')
+    os.makedirs(os.path.join(directory, 'shared'), exist_ok=True)
+    with open(os.path.join(directory, 'sibling_helpers.py'), 'w') as f:
+        f.write('from shared.values import VALUE\ndef double(x):\n    return x * 2')
+    with open(os.path.join(directory, 'shared', '__init__.py'), 'w') as f:
+        f.write('')
+    with open(os.path.join(directory, 'shared', 'values.py'), 'w') as f:
+        f.write('VALUE = 21')
+    filename = os.path.join('siblings_import', 'test_sibling_import.py')
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('''import sibling_helpers
+def run(athena):
+    from shared import values
+    athena.cache['sibling_import'] = sibling_helpers.double(values.VALUE)''')
+
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'test_sibling_import: passed', result.stdout
+    with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+        cache = json.loads(f.read())
+    assert cache['data']['sibling_import'] == 42
+
+def test_daemon(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_daemon.py'
+    code = f'''def run(athena):
+    athena.client().get('http://{API_HOST}/api/echo')'''
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(code)
+    print_filenames = []
+    for name in ['sync', 'async']:
+        print_filename = f'test_daemon_print_{name}.py'
+        with open(os.path.join(athena_dir, print_filename), 'w') as f:
+            f.write(f'''import sys
+{'async ' if name == 'async' else ''}def run(athena):
+    print('hello from {name} module')
+    print('warning from {name} module', file=sys.stderr)''')
+        print_filenames.append(print_filename)
+
+    daemon_process = subprocess.Popen(['athena', 'daemon'], cwd=athena_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        assert daemon_process.stdout is not None
+        assert 'daemon started' in daemon_process.stdout.readline()
+        from athena.daemon import get_socket_path
+        assert stat.S_IMODE(os.stat(get_socket_path(athena_dir)).st_mode) == 0o600
+
+        result = subprocess.run(['athena', 'traces', '-p', filename], cwd=athena_dir, capture_output=True, text=True)
+        assert result.returncode == 0
+        trace = json.loads(result.stdout)
+        assert trace['success'] == True
+        assert trace['athena_traces'][0]['response']['status_code'] == 200
+
+        # output written by the modules goes to the client, the same as when they are run directly
+        result = subprocess.run(['athena', 'run', *print_filenames], cwd=athena_dir, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        for name in ['sync', 'async']:
+            assert f'hello from {name} module' in result.stdout
+            assert f'warning from {name} module' in result.stderr
+            assert f'test_daemon_print_{name}: passed' in result.stdout
+    finally:
+        daemon_process.terminate()
+        daemon_process.wait()
+
+    result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stdout.strip() == 'test_daemon: passed'
+
+def test_daemon_settings(setup_athena):
+    athena_dir = setup_athena
+
+    filename = 'test_daemon_settings.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write(f'''def run(athena):
+    client = athena.client()
+    client.get('http://{API_HOST}/api/echo')
+    client.get('http://{API_HOST}/api/echo')
+    athena.cache['daemon_traces'] = len(athena.traces())''')
+    state_path = os.path.join(athena_dir, '.athena')
+    with open(state_path, 'r') as f:
+        state = f.read()
+
+    def run_traces() -> int:
+        result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        with open(os.path.join(athena_dir, '.cache'), 'r') as f:
+            return json.loads(f.read())['data']['daemon_traces']
+
+    daemon_process = subprocess.Popen(['athena', 'daemon'], cwd=athena_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        assert daemon_process.stdout is not None
+        assert 'daemon started' in daemon_process.stdout.readline()
+        assert run_traces() == 2
+
+        # the daemon picks up the new retention settings without being restarted
+        with open(state_path, 'w') as f:
+            f.write('environment: __default__\nretention:\n  keep_last:\n    __default__: 1\n')
+        time.sleep(1)
+        assert run_traces() == 1
+    finally:
+        with open(state_path, 'w') as f:
+            f.write(state)
+        daemon_process.terminate()
+        daemon_process.wait()
+
+def test_daemon_unresponsive(tmp_path_factory):
+    from athena.daemon import get_socket_path, FORWARD_TIMEOUT
+    tmp_dir = tmp_path_factory.mktemp('test_daemon_unresponsive')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    athena_dir = os.path.join(tmp_dir, 'athena')
+    filename = 'test_daemon_unresponsive.py'
+    with open(os.path.join(athena_dir, filename), 'w') as f:
+        f.write('def run(athena):\n    pass')
+
+    # a daemon that takes connections, but never reads them
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    socket_path = get_socket_path(athena_dir)
+    listener.bind(socket_path)
+    listener.listen()
+    try:
+        start = time.time()
+        result = subprocess.run(['athena', 'run', filename], cwd=athena_dir, capture_output=True, text=True, timeout=FORWARD_TIMEOUT * 4)
+        end = time.time()
+    finally:
+        listener.close()
+        os.remove(socket_path)
+
+    # the modules are run locally instead
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'test_daemon_unresponsive: passed'
+    assert FORWARD_TIMEOUT <= end - start
+
+def test_multiple_roots(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_roots')
+    filenames = []
+    for root in ['foo', 'bar']:
+        os.makedirs(os.path.join(tmp_dir, root))
+        subprocess.run(['athena', 'init', '--bare', os.path.join(tmp_dir, root)], capture_output=True, text=True)
+        filename = os.path.join(root, 'athena', 'test_multiple_roots.py')
+        code = f'''async def run(athena):
+    athena.cache['root'] = '{root}'
+    await athena.client().post_async('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 1}}))'''
+        with open(os.path.join(tmp_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    start = time.time()
+    result = subprocess.run(['athena', 'run', *filenames], cwd=tmp_dir, capture_output=True, text=True)
+    end = time.time()
+
+    assert result.returncode == 0
+    assert result.stdout.strip().split('\n') == ['test_multiple_roots: passed']*2
+    assert end - start < 2
+    for root in ['foo', 'bar']:
+        with open(os.path.join(tmp_dir, root, 'athena', '.cache'), 'r') as f:
+            cache = json.loads(f.read())
+        assert cache['data']['root'] == root
+
+def test_multiple_roots_sync(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_roots_sync')
+    filenames = []
+    for root in ['foo', 'bar']:
+        os.makedirs(os.path.join(tmp_dir, root))
+        subprocess.run(['athena', 'init', '--bare', os.path.join(tmp_dir, root)], capture_output=True, text=True)
+        with open(os.path.join(tmp_dir, root, 'athena', 'fixture.py'), 'w') as f:
+            f.write(f'''def fixture(fixture, athena):
+    athena.client().post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.5}}))''')
+        filename = os.path.join(root, 'athena', 'test_multiple_roots_sync.py')
+        code = f'''def run(athena):
+    athena.client().post('http://{API_HOST}/api/response', lambda r: r
+        .body.json({{'duration': 0.5}}))'''
+        with open(os.path.join(tmp_dir, filename), 'w') as f:
+            f.write(code)
+        filenames.append(filename)
+
+    # the sync fixtures and modules of each root must not block the other root
+    start = time.time()
+    result = subprocess.run(['athena', 'run', *filenames], cwd=tmp_dir, capture_output=True, text=True)
+    end = time.time()
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().split('\n') == ['test_multiple_roots_sync: passed']*2
+    assert end - start < 2
@@ -0,0 +1,50 @@
+import subprocess, os, sys
+import pytest
+
+@pytest.fixture(scope="module")
+def setup_athena(tmp_path_factory):
+    tmp_dir = tmp_path_factory.mktemp('test_tmp')
+    subprocess.run(['athena', 'init', tmp_dir], capture_output=True, text=True)
+    yield os.path.join(tmp_dir, 'athena')
+
+# dependencies that should only be imported by the subcommands that use them
+HEAVY_MODULES = ['aiohttp', 'requests', 'flask', 'faker', 'pygments', 'watchdog', 'asyncio']
+# modules that importing the cli entry point alone should not pull in
+ENTRY_POINT_EXCLUDED_MODULES = ['aiohttp', 'requests', 'yaml']
+
+def import_times(args: list[str], cwd: str) -> dict[str, int]:
+    # same as the `athena` entry point, but keeps athena.__main__ as a named import in the report
+    entry_point = 'from athena.__main__ import main; main()'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', entry_point, *args], cwd=cwd, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def format_report(times: dict[str, int]) -> str:
+    slowest = sorted(times.items(), key=lambda kvp: kvp[1], reverse=True)[:15]
+    return '\n'.join([f'{cumulative:>10}us | {name}' for name, cumulative in slowest])
+
+@pytest.mark.parametrize('args', [
+    ['--version'],
+    ['get', 'environment'],
+    ['set', 'environment', 'staging'],
+    ['status'],
+    ['clear', 'cache'],
+])
+def test_startup_imports(setup_athena, args):
+    times = import_times(args, setup_athena)
+    imported = [m for m in HEAVY_MODULES if m in times]
+    assert imported == [], f"`athena {' '.join(args)}` imported {imported}\n{format_report(times)}"
+
+def test_entry_point_imports():
+    code = 'import sys, athena.__main__; print(",".join(sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    modules = result.stdout.strip().split(',')
+    imported = [m for m in ENTRY_POINT_EXCLUDED_MODULES if m in modules]
+    assert imported == [], f"`import athena.__main__` imported {imported}"
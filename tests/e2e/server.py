@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify, request
-import time
+import hashlib, time
 
 app = Flask(__name__)
 
@@ -12,6 +12,7 @@ def echo():
         'method': request.method,
         'args': request.args.to_dict(flat=False),
         'form': request.form.to_dict(flat=False),
+        'files': { k: [f.filename, f.content_type, hashlib.sha256(f.read()).hexdigest()] for k, f in request.files.items() },
         'body': str(request.data),
         'headers': dict(request.headers)
     }